@@ -0,0 +1,176 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+
+SETTINGS_FILE = "logging_settings.json"
+LOG_FILE = "wiz_light_control.log"
+LOG_FILE_SIZE = 1024 * 1024  # Bytes per log file before it is rotated
+LOG_FILE_COUNT = 3  # Rotated log files kept
+BUFFER_SIZE = 10000  # Records waiting for the writer thread at most
+STOP_TIMEOUT = 2.0  # Seconds stop_logging() waits for the writer to write out the buffer
+FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+_handler = None
+_listener = None
+
+
+def app_path(filename):
+    """Return a file next to the .exe when packaged, else next to the scripts."""
+    if getattr(sys, 'frozen', False):  # Running as a packaged executable
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, filename)
+
+
+class RingBufferHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the writer thread through a bounded buffer, so logging never waits
+    for the console or the disk.
+
+    Debug records are dropped once the buffer is half full; when it is full the oldest
+    record makes room for the new one. Only the message is rendered in the calling
+    thread (its arguments may change later), the formatting happens in the writer.
+    """
+
+    def __init__(self, capacity=BUFFER_SIZE):
+        super().__init__(queue.Queue(capacity))
+        self.capacity = capacity
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if record.levelno <= logging.DEBUG and self.queue.qsize() >= self.capacity // 2:
+            self.dropped += 1
+            return
+        self.put(record)
+
+    def put(self, item):
+        """Add item to the buffer, dropping the oldest record if it is full."""
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class RingBufferListener(logging.handlers.QueueListener):
+    """
+    The writer thread of a RingBufferHandler.
+
+    Stopping it makes room for the stop marker like any other record, and waits at most
+    timeout seconds for the buffer to be written, so a stuck console can't hang the exit
+    (the thread is a daemon and is left behind).
+    """
+
+    def __init__(self, handler, *targets, timeout=STOP_TIMEOUT):
+        super().__init__(handler.queue, *targets)
+        self.handler = handler
+        self.timeout = timeout
+
+    def enqueue_sentinel(self):
+        self.handler.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            self.enqueue_sentinel()
+            self._thread.join(self.timeout)
+            self._thread = None
+
+
+def load_settings(path=None):
+    """
+    Return the logging settings: the level of every module, and the levels of single
+    modules (by logger name, e.g. "preview_pattern") that differ from it.
+
+        {"level": "INFO", "modules": {"preview_pattern": "DEBUG", "command_dispatch": "ERROR"}, "file": true}
+    """
+    settings = {"level": "INFO", "modules": {}, "file": True}
+    try:
+        with open(path or app_path(SETTINGS_FILE)) as f:
+            saved = json.load(f)
+        if isinstance(logging.getLevelName(str(saved.get("level", "INFO")).upper()), int):
+            settings["level"] = str(saved.get("level", "INFO")).upper()
+        settings["modules"] = {
+            str(name): str(level).upper() for name, level in saved.get("modules", {}).items()
+            if isinstance(logging.getLevelName(str(level).upper()), int)
+        }
+        settings["file"] = bool(saved.get("file", True))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        if sys.stderr is not None:
+            sys.stderr.write(f"Error loading logging settings, using the defaults: {e}\n")
+    return settings
+
+
+def setup_logging(settings=None):
+    """
+    Send every log record through one RingBufferHandler to a background writer thread that
+    prints to the console (if there is one) and writes the log file. Safe to call again,
+    e.g. with changed settings.
+    """
+    global _handler, _listener
+    settings = settings or load_settings()
+    root = logging.getLogger()
+    root.setLevel(settings["level"])
+    for name, level in settings["modules"].items():
+        logging.getLogger(name).setLevel(level)
+
+    if _listener is not None:
+        return _handler
+    formatter = logging.Formatter(FORMAT)
+    targets = []
+    if sys.stderr is not None:  # Packaged windowed apps have no console
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
+        targets.append(console)
+    if settings["file"]:
+        try:
+            log_file = logging.handlers.RotatingFileHandler(
+                app_path(LOG_FILE), maxBytes=LOG_FILE_SIZE, backupCount=LOG_FILE_COUNT, encoding="utf-8"
+            )
+            log_file.setFormatter(formatter)
+            targets.append(log_file)
+        except OSError as e:
+            if sys.stderr is not None:
+                sys.stderr.write(f"Cannot write the log file, logging to the console only: {e}\n")
+
+    if _handler is not None:
+        root.removeHandler(_handler)  # Left over from a stopped writer
+    _handler = RingBufferHandler()
+    root.addHandler(_handler)
+    _listener = RingBufferListener(_handler, *targets)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _handler
+
+
+def stop_logging():
+    """Write out the records still buffered and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records():
+    """Return how many records were dropped because the writer couldn't keep up."""
+    return _handler.dropped if _handler is not None else 0
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+
+from metrics import get_registry
+from rate_limit import RateLimits, TokenBucket
+from wiz_transport import TIMEOUT, get_transport
+
+
+log = logging.getLogger(__name__)
+
+
+# Defaults for sending one command to a group of lights
+FAN_OUT_CONCURRENCY = 32  # Lights contacted at the same time
+LIGHT_DEADLINE = 2.0  # Seconds each light gets to answer before it counts as timed out
+
+
+async def fan_out(ips, send, concurrency=FAN_OUT_CONCURRENCY, deadline=LIGHT_DEADLINE, semaphore=None):
+    """
+    Run send(ip) for every light concurrently and return a {ip: status} summary.
+
+    At most `concurrency` lights are in progress at once (or as many as the shared semaphore
+    allows) and every light gets `deadline` seconds, so one slow or offline light never delays
+    the others. Status is "timeout" or "error" on failure, otherwise whatever status string
+    send returned ("ok" if it returned something else).
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(ip):
+        async with semaphore:
+            try:
+                status = await asyncio.wait_for(send(ip), deadline)
+            except asyncio.TimeoutError:
+                return ip, "timeout"
+            except Exception as e:
+                log.warning("Error sending command to light %s: %s", ip, e)
+                return ip, "error"
+        return ip, status if isinstance(status, str) else "ok"
+
+    return dict(await asyncio.gather(*(run(ip) for ip in ips)))
+
+
+def summarize(results):
+    """Return a short text such as '3 ok, 1 timeout' for a fan_out result."""
+    counts = {}
+    for status in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    return ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+
+
+class CommandDispatcher:
+    """
+    Latest-value-wins command queue for the lights.
+
+    Pending commands are keyed by (light IP, parameter). Submitting a new value for a pair that
+    has not been sent yet replaces the older value, so stale intermediate values (e.g. from a
+    slider drag) are dropped instead of sent. At most max_in_flight commands per light are
+    waiting for an answer at any time; different lights are served concurrently.
+
+    Every light also has a token bucket with the burst and rate of its model. A light that is
+    out of tokens keeps its queued commands (one per key) until a token is available, so
+    commands sent meanwhile replace them instead of piling up behind them.
+    """
+
+    def __init__(self, max_in_flight=1, timeout=TIMEOUT, limits=None, group_concurrency=FAN_OUT_CONCURRENCY):
+        self.max_in_flight = max_in_flight
+        self.group_concurrency = group_concurrency  # Lights contacted at once by all group sends together
+        self.timeout = timeout
+        self.limits = limits or RateLimits()
+        self._pending = {}  # ip -> {key: (payload, future)}, kept in submission order
+        self._in_flight = {}  # ip -> number of commands currently awaiting an answer
+        self._tasks = set()
+        self._group_slots = None  # Semaphore shared by every group send
+        self._models = {}  # ip -> moduleName, for lights whose model is known
+        self._buckets = {}  # ip -> TokenBucket
+        self.coalesced = 0  # Number of values replaced before they were sent
+        self.throttled = 0  # Number of times a light had to wait for a token before a send
+        self.metrics = get_registry()
+
+    def submit(self, ip, key, payload, timeout=None):
+        """
+        Queue payload bytes for the (ip, key) pair.
+
+        timeout overrides how long the light may take to answer this command. A command whose
+        future was cancelled before it was sent (e.g. its caller gave up) is dropped.
+
+        Returns a future that resolves to "ok", "timeout", "error", or "coalesced" if a newer
+        value for the same pair replaced this one before it was sent.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(ip, {})
+        previous = pending.pop(key, None)  # Re-inserted below so the newest key is sent last
+        if previous is not None:
+            self.coalesced += 1
+            if not previous[1].done():
+                previous[1].set_result("coalesced")
+        pending[key] = (payload, future, timeout or self.timeout)
+
+        in_flight = self._in_flight.get(ip, 0)
+        if in_flight < self.max_in_flight:
+            self._in_flight[ip] = in_flight + 1
+            task = loop.create_task(self._drain(ip))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return future
+
+    def set_model(self, ip, model):
+        """Use the rate limit of a bulb model for a light."""
+        self._models[ip] = model
+        self._buckets.pop(ip, None)  # Made again with the model's limit on the next send
+
+    def set_limits(self, limits):
+        """Use new RateLimits for every light."""
+        self.limits = limits
+        self._buckets.clear()
+
+    def bucket(self, ip):
+        """Return the token bucket of a light."""
+        bucket = self._buckets.get(ip)
+        if bucket is None:
+            burst, rate = self.limits.for_model(self._models.get(ip))
+            bucket = self._buckets[ip] = TokenBucket(burst, rate)
+        return bucket
+
+    def summary(self):
+        return f"{self.throttled} throttled, {self.coalesced} coalesced commands"
+
+    async def _drain(self, ip):
+        """Send queued commands for one light until none are left."""
+        future = None
+        try:
+            transport = await get_transport()
+            pending = self._pending.get(ip)
+            while pending:
+                bucket = self.bucket(ip)
+                delay = bucket.delay()
+                if delay > 0:
+                    # Out of tokens: wait, letting newer values replace the queued ones meanwhile
+                    self.throttled += 1
+                    bucket.throttled += 1
+                    await asyncio.sleep(delay)
+                    pending = self._pending.get(ip)
+                    continue
+                key = next(iter(pending))
+                payload, future, timeout = pending.pop(key)
+                if future.cancelled():
+                    continue
+                bucket.take()
+                try:
+                    status = await self._send(transport, ip, payload, timeout)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                if not future.done():
+                    future.set_result(status)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Failed outside _send (e.g. no socket): don't leave the light's callers waiting forever
+            log.error("Error sending queued commands to light %s: %s", ip, e)
+            queued = self._pending.pop(ip, {})
+            futures = [entry[1] for entry in queued.values()]
+            queued.clear()  # Other drains of this light hold the same dict
+            for waiting in [future] + futures:
+                if waiting is not None and not waiting.done():
+                    waiting.set_result("error")
+        finally:
+            self._in_flight[ip] -= 1
+            if not self._in_flight[ip] and not self._pending.get(ip):
+                del self._in_flight[ip]
+                self._pending.pop(ip, None)
+
+    async def _send(self, transport, ip, payload, timeout):
+        started = time.monotonic()
+        try:
+            await transport.request(ip, payload, timeout=timeout)
+            status = "ok"
+        except asyncio.TimeoutError:
+            log.warning("Timeout while sending command to light %s", ip)
+            status = "timeout"
+        except Exception as e:
+            log.warning("Error sending command to light %s: %s", ip, e)
+            status = "error"
+        self.metrics.command_sent(ip, status, time.monotonic() - started)
+        return status
+
+    async def submit_group(self, ips, key, payload, deadline=LIGHT_DEADLINE):
+        """
+        Send one payload to many lights through fan_out and return the {ip: status} summary.
+
+        Concurrent group sends share group_concurrency slots between them.
+        """
+        if self._group_slots is None:
+            self._group_slots = asyncio.Semaphore(self.group_concurrency)
+        return await fan_out(
+            ips, lambda ip: self.submit(ip, key, payload, timeout=deadline),
+            deadline=deadline, semaphore=self._group_slots
+        )
+
+    def discard(self, key):
+        """Drop every queued command for key that has not been sent yet."""
+        for pending in self._pending.values():
+            entry = pending.pop(key, None)
+            if entry is not None and not entry[1].done():
+                entry[1].cancel()
+
+    def close(self):
+        """Cancel every queued and in-flight command."""
+        for task in list(self._tasks):
+            task.cancel()
+        for pending in self._pending.values():
+            for _, future, _ in pending.values():
+                if not future.done():
+                    future.cancel()
+        self._pending.clear()
@@ -3,43 +3,27 @@ import json
 import pyaudio
 import os
 import time
-import asyncio
-import pyi_splash
-import pyi_splash
+import logging
 
-from pywizlight import wizlight
-from PyQt5.QtCore import QProcess, QThread, pyqtSignal
+try:
+    import pyi_splash  # Only there in the packaged app
+except ImportError:
+    pyi_splash = None
+
+from PyQt5.QtCore import QProcess, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon
 from pycaw.utils import AudioUtilities, AudioDeviceState
+from qasync import asyncSlot
+from app_logging import setup_logging
+from light_io import run_event_loop
+from light_state import StateSubscriptionService
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QLineEdit,
     QPushButton, QGroupBox, QFormLayout, QScrollArea, QTabWidget, QTextEdit, QComboBox, QMessageBox, QColorDialog,
 )
 
-class LightStateFetcher:
-    def __init__(self, ip, update_callback):
-        self.light = wizlight(ip)
-        self.update_callback = update_callback
-        self.running = True
-
-    async def fetch_state(self):
-        """Fetch the state of the WiZ light periodically."""
-        while self.running:
-            if self.update_callback:  # Ensure the callback is defined
-                if self.running:  # Check if the visualizer is running
-                    try:
-                        await self.light.updateState()
-                        rgb = self.light.state.get_rgb()
-                        if rgb:
-                            self.update_callback(rgb)  # Emit signal to update light icon
-                    except Exception as e:
-                        print(f"Error fetching light state: {e}")
-                await asyncio.sleep(0.01)  # Poll every 10ms, adjust as necessary
-
-    def stop(self):
-        """Stop the fetch loop."""
-        self.running = False
 
+log = logging.getLogger("config_gui")
 
 
 def calibrate_silence_threshold(self):
@@ -52,7 +36,7 @@ def calibrate_silence_threshold(self):
 
 def handle_calibration_output(self):
     output = self.calibration_process.readAllStandardOutput().data().decode()
-    print(output)  # Or display in a text widget
+    log.info("%s", output.rstrip())  # Or display in a text widget
 
 def handle_calibration_finished(self):
     QMessageBox.information(self, "Calibration Complete", "Calibration completed successfully.")
@@ -73,7 +57,7 @@ class CalibrationThread(QThread):
         try:
             import subprocess
             # Run the calibration process in the background
-            print(f"Running calibration for {self.duration} seconds with device {self.device}")
+            log.info("Running calibration for %s seconds with device %s", self.duration, self.device)
             result = subprocess.run(
                 ["wiz_visualizer_freq.exe", "--calibrate", f"--duration={self.duration}", f"--device={self.device}"],
                 capture_output=True,
@@ -89,29 +73,6 @@ class CalibrationThread(QThread):
         except Exception as e:
             self.calibration_done.emit(f"An error occurred during calibration: {str(e)}")
 
-class LightUpdateThread(QThread):
-    update_signal = pyqtSignal(tuple)  # Signal to update the UI
-
-    def __init__(self, ip):
-        super().__init__()
-        self.ip = ip
-        self.fetcher = None
-
-    def run(self):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        self.fetcher = LightStateFetcher(self.ip, self.emit_update)
-        loop.run_until_complete(self.fetcher.fetch_state())
-
-    def emit_update(self, rgb):
-        """Emit the updated RGB values as a signal."""
-        self.update_signal.emit(rgb)
-
-    def stop(self):
-        """Stop the fetcher."""
-        if self.fetcher:
-            self.fetcher.stop()
-
 
 def load_icon():
     """
@@ -123,7 +84,7 @@ def load_icon():
         base_path = os.path.abspath(".")
 
     icon_path = os.path.join(base_path, 'icon', 'freq.ico')
-    print(f"Trying to load icon from: {icon_path}")  # Debug statement
+    log.debug("Trying to load icon from: %s", icon_path)
 
     return QIcon(icon_path)
 
@@ -136,10 +97,10 @@ def get_default_input_device():
         # Get default input device info (recording device)
         default_device_index = p.get_default_input_device_info()["index"]
         default_device_info = p.get_device_info_by_index(default_device_index)
-        print("Default input device info:", default_device_info)  # Debug statement
+        log.debug("Default input device info: %s", default_device_info)
         return default_device_index, default_device_info["name"]
     except Exception as e:
-        print(f"Error retrieving default input device: {e}")
+        log.error("Error retrieving default input device: %s", e)
         return None, "Unknown"
     finally:
         p.terminate()
@@ -158,14 +119,14 @@ def load_stylesheet(app, theme_name="dark"):
         base_path = os.path.join(os.path.abspath("."), 'themes')
 
     theme_path = os.path.join(base_path, f"{theme_name}.qss")
-    print(f"Trying to load stylesheet from: {theme_path}")  # Debug statement
+    log.debug("Trying to load stylesheet from: %s", theme_path)
 
     try:
         with open(theme_path, "r") as f:
             stylesheet = f.read()
             app.setStyleSheet(stylesheet)
     except FileNotFoundError:
-        print(f"Stylesheet not found: {theme_path}")
+        log.warning("Stylesheet not found: %s", theme_path)
 
 def load_theme_effects(theme_name):
     """
@@ -177,17 +138,17 @@ def load_theme_effects(theme_name):
         base_path = os.path.join(os.path.abspath("."), 'themes')
 
     effects_path = os.path.join(base_path, 'theme_effects.json')
-    print(f"Trying to load theme effects from: {effects_path}")  # Debug statement
+    log.debug("Trying to load theme effects from: %s", effects_path)
 
     try:
         with open(effects_path, "r") as f:
             effects = json.load(f)
             return effects.get(theme_name, {})
     except FileNotFoundError:
-        print("Theme effects file not found.")
+        log.warning("Theme effects file not found.")
         return {}
     except json.JSONDecodeError:
-        print("Error parsing theme effects file.")
+        log.error("Error parsing theme effects file.")
         return {}
 
 
@@ -325,10 +286,10 @@ class ConfigEditor(QMainWindow):
             with open(config_path, 'r') as file:
                 return json.load(file)  # Assuming the config files are in JSON format
         except FileNotFoundError:
-            print(f"Configuration file '{filename}' not found at {config_path}.")
+            log.warning("Configuration file '%s' not found at %s.", filename, config_path)
             return {}  # Return an empty dict or handle as appropriate
         except json.JSONDecodeError:
-            print(f"Error decoding JSON from the file '{filename}'.")
+            log.error("Error decoding JSON from the file '%s'.", filename)
             return {}  # Return an empty dict or handle as appropriate
 
 
@@ -546,10 +507,22 @@ class ConfigEditor(QMainWindow):
         # Get the first light's IP from the configuration (default to '192.168.1.73' if no lights are configured)
         self.first_light_ip = self.config.get('lights', [{}])[0].get('ip', '192.168.1.73')
 
-        # Initialize the LightUpdateThread with the first light's IP
-        self.light_thread = LightUpdateThread(self.first_light_ip)  # Use the IP of the first light
-        self.light_thread.update_signal.connect(self.update_light_icon)
-        self.light_thread.start()
+        # Follow the first light's state on the app's asyncio loop: it pushes its changes
+        # (or is polled slowly if it doesn't), so the icon needs no polling thread
+        self.state_service = StateSubscriptionService()
+        self.state_service.add_listener(self.on_light_state_changed)
+        self.state_service.subscribe(self.first_light_ip)
+        QTimer.singleShot(0, self.startStateService)
+
+    @asyncSlot()
+    async def startStateService(self):
+        await self.state_service.start()
+
+    def on_light_state_changed(self, ip, state):
+        if ip == self.first_light_ip:
+            rgb = state.get_rgb()
+            if rgb and None not in rgb:
+                self.update_light_icon(rgb)
 
     def set_light_icon_active(self):
         """Set the light icon to active (shows current color)"""
@@ -574,32 +547,23 @@ class ConfigEditor(QMainWindow):
             self.set_light_icon_grey()  # Ensure the icon is grey if visualizer isn't running
 
     def update_light_icon_from_state(self):
-        """Fetch and update the light icon based on the actual light state."""
-        ip = "192.168.1.73"  # Replace with your light's IP
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-        # Create a LightStateFetcher object to fetch the light's state
-        light_state_fetcher = LightStateFetcher(ip, self.update_light_icon)
-        loop.run_until_complete(light_state_fetcher.fetch_state())
+        """Update the light icon from the last known state of the light."""
+        state = self.state_service.state(self.first_light_ip)
+        if state is not None:
+            self.on_light_state_changed(self.first_light_ip, state)
 
     def update_light_ip(self, new_ip):
         """
         Update the light IP dynamically when the user saves the config.
-        Stops the current light update thread and starts a new one with the updated IP.
+        The state service stops following the old light and follows the new one instead.
         """
-        # Stop the current thread if it's running
-        if self.light_thread is not None:
-            self.light_thread.stop()
+        self.state_service.unsubscribe(self.first_light_ip)
 
         # Update the IP in the config and UI (optional)
         self.first_light_ip = new_ip
         self.config['lights'][0]['ip'] = new_ip  # Update the IP of the first light in the config
 
-        # Restart the LightUpdateThread with the new IP
-        self.light_thread = LightUpdateThread(self.first_light_ip)
-        self.light_thread.update_signal.connect(self.update_light_icon)
-        self.light_thread.start()
+        self.state_service.subscribe(self.first_light_ip)
 
 
     def reset_to_default(self):
@@ -630,7 +594,7 @@ class ConfigEditor(QMainWindow):
                 with open(config_path, 'w') as config_file:
                     json.dump(self.config, config_file, indent=4)
 
-                print("Configuration reset to default values.")
+                log.info("Configuration reset to default values.")
 
                 # Refresh the UI to reflect default values
                 self.audio_device_input.setCurrentText(self.config.get('audio_device', ''))
@@ -687,9 +651,9 @@ class ConfigEditor(QMainWindow):
                 self.populate_lights()
 
             except FileNotFoundError:
-                print(f"Default configuration file '{default_path}' not found.")
+                log.warning("Default configuration file '%s' not found.", default_path)
             except json.JSONDecodeError:
-                print(f"Error decoding JSON from '{default_path}'.")
+                log.error("Error decoding JSON from '%s'.", default_path)
 
 
 
@@ -933,7 +897,7 @@ class ConfigEditor(QMainWindow):
                 # Refresh the lights layout to reflect changes
                 self.populate_lights()
 
-            print(f"Light {index + 1} removed.")
+            log.info("Light %s removed.", index + 1)
 
 
     def setup_help_tab(self, tab):
@@ -1071,15 +1035,15 @@ class ConfigEditor(QMainWindow):
                 json.dump(self.config, file, indent=4)
                 file.flush()  # Ensure data is flushed to disk
                 os.fsync(file.fileno())  # Force the OS to sync the file
-            print(f"Configuration saved successfully to: {config_path}")
+            log.info("Configuration saved successfully to: %s", config_path)
         except Exception as e:
-            print(f"Error saving configuration: {e}")
+            log.error("Error saving configuration: %s", e)
         # Debug print the final configuration
-        print(f"Saving configuration to: config.json")
-        print("Final configuration before saving:", json.dumps(self.config, indent=4))
+        log.info("Saving configuration to: config.json")
+        log.debug("Final configuration before saving: %s", json.dumps(self.config, indent=4))
 
         # Now that the config is saved, update the light icon's IP and thread
-        self.update_light_ip(self.config['lights'][0]['ip'])  # Update the light thread with the new IP
+        self.update_light_ip(self.config['lights'][0]['ip'])  # Follow the new IP's state
 
 
 
@@ -1106,22 +1070,22 @@ class ConfigEditor(QMainWindow):
         executable_name = "wiz_visualizer_freq.exe" if sys.platform == "win32" else "wiz_visualizer_freq"
         executable_path = os.path.join(base_path, executable_name)
 
-        print(f"Executable path: {executable_path}")  # Debug print
-        print(f"Config being used: {self.config}")    # Debug print
+        log.debug("Executable path: %s", executable_path)
+        log.debug("Config being used: %s", self.config)
 
         self.process.setProgram(executable_path)
         self.process.setProcessChannelMode(QProcess.ForwardedChannels)
 
-        self.process.started.connect(lambda: print("Program started."))
+        self.process.started.connect(lambda: log.info("Program started."))
         self.visualizer_running = True
         self.set_light_icon_active()  # Set icon to active when visualizer starts
-        self.process.finished.connect(lambda: print("Program stopped."))
-        self.process.errorOccurred.connect(lambda error: print(f"Error: {error}"))
+        self.process.finished.connect(lambda: log.info("Program stopped."))
+        self.process.errorOccurred.connect(lambda error: log.error("Error: %s", error))
         
         try:
             self.process.start()
         except Exception as e:
-            print(f"Failed to start the program: {e}")
+            log.error("Failed to start the program: %s", e)
 
 
 
@@ -1138,23 +1102,22 @@ class ConfigEditor(QMainWindow):
 
     def stop_program(self):
         if self.process.state() == QProcess.Running:
-            print("Stopping the program...")
+            log.info("Stopping the program...")
 
             # Terminate and set a shorter timeout
             self.process.terminate()
             if not self.process.waitForFinished(100):  # Timeout of 1 second
-                print("Force killing the program...")
+                log.warning("Force killing the program...")
                 self.process.kill()
 
-            print("Program stopped.")
+            log.info("Program stopped.")
         self.visualizer_running = False
         self.set_light_icon_grey()
 
 
     def closeEvent(self, event):
         """Handle the window close event."""
-        if self.light_thread:
-            self.light_thread.stop()
+        self.state_service.close()  # Stop following the light
         event.accept()
 
 
@@ -1162,20 +1125,21 @@ class ConfigEditor(QMainWindow):
         """
         Handle post-stopping cleanup and UI updates.
         """
-        print("Program has stopped successfully.")
+        log.info("Program has stopped successfully.")
         # Perform any UI updates or cleanup as needed
         self.start_button.setEnabled(True)  # Re-enable the Start button
         self.stop_button.setEnabled(False)  # Disable the Stop button
 
 
 if __name__ == "__main__":
+    setup_logging()
     app = QApplication(sys.argv)
-    pyi_splash.close()
+    if pyi_splash is not None:
+        pyi_splash.close()
     # Get theme from argument, default to "dark" if not provided
     theme_name = sys.argv[1] if len(sys.argv) > 1 else "dark"
-    pyi_splash.close()
     load_stylesheet(app, theme_name)
     window = ConfigEditor()
     window.show()
-    sys.exit(app.exec_())
+    sys.exit(run_event_loop(app))
 
@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import sys
+import time
+
+from pywizlight import wizlight
+from pywizlight.bulb import PilotParser
+
+
+log = logging.getLogger(__name__)
+
+
+CACHE_FILE = "light_cache.json"
+MAX_AGE = 30 * 24 * 3600  # Seconds a light that isn't seen any more stays in the cache
+
+
+def default_cache_path():
+    """Return where the cache is kept: next to the .exe when packaged, else next to the scripts."""
+    if getattr(sys, 'frozen', False):  # Running as a packaged executable
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, CACHE_FILE)
+
+
+class LightCache:
+    """
+    The lights of the last sessions, saved between runs.
+
+    One record per light, keyed by MAC (or IP when the MAC is unknown), with its last IP,
+    name, model and state, so the device list can be filled at launch before any discovery
+    has run. Lights that are not seen for MAX_AGE seconds are dropped.
+    """
+
+    def __init__(self, path=None, max_age=MAX_AGE):
+        self.path = path or default_cache_path()
+        self.max_age = max_age
+        self.records = {}  # mac or ip -> {"ip", "mac", "name", "model", "state", "seen"}
+
+    def load(self):
+        """Read the cache file and return its records; a missing or broken file gives an empty cache."""
+        try:
+            with open(self.path) as f:
+                records = json.load(f).get("lights", [])
+        except FileNotFoundError:
+            records = []
+        except (OSError, ValueError, AttributeError) as e:
+            log.warning("Ignoring the light cache %s: %s", self.path, e)
+            records = []
+
+        oldest = time.time() - self.max_age
+        self.records = {}
+        for record in records:
+            if isinstance(record, dict) and isinstance(record.get("ip"), str) and record.get("seen", 0) >= oldest:
+                self.records[record.get("mac") or record["ip"]] = record
+        return list(self.records.values())
+
+    def restore(self, registry):
+        """Add every cached light to the registry (with a wizlight handle) and return their entries."""
+        entries = []
+        for record in self.records.values():
+            entry = registry.add(wizlight(record["ip"], mac=record.get("mac")), record.get("name"))
+            entry.model = record.get("model")
+            if record.get("state"):
+                entry.state = PilotParser(record["state"])
+            entries.append(entry)
+        return entries
+
+    def update(self, registry):
+        """Record the lights currently in the registry as seen now."""
+        now = time.time()
+        for entry in registry:
+            record = {"ip": entry.ip, "mac": entry.mac, "name": entry.name, "model": entry.model, "seen": now}
+            if entry.state is not None:
+                record["state"] = entry.state.pilotResult
+            if entry.mac:
+                self.records.pop(entry.ip, None)  # Cached before its MAC was known
+            self.records[entry.mac or entry.ip] = record
+
+    def save(self, registry=None):
+        """Write the cache file (after recording the registry's lights, if one is given)."""
+        if registry is not None:
+            self.update(registry)
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump({"lights": list(self.records.values())}, f, indent=4)
+            os.replace(temporary, self.path)  # Never leave a half-written cache behind
+        except OSError as e:
+            log.error("Error saving the light cache: %s", e)
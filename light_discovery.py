@@ -0,0 +1,316 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+from pywizlight import wizlight
+
+from metrics import get_registry
+from wiz_transport import WIZ_PORT, encode_message
+
+try:
+    import psutil
+except ImportError:  # Optional, without it only the default interface is used
+    psutil = None
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_BROADCAST = "255.255.255.255"
+DISCOVERY_WAIT = 5.0  # Seconds to listen for answers (same as pywizlight's discovery)
+RESEND_INTERVAL = 1.0  # Seconds between repeated broadcasts, in case one gets lost
+SETTINGS_FILE = "discovery_settings.json"
+
+# Discovery modes
+BROADCAST = "broadcast"  # Ask every light at once with broadcasts
+SWEEP = "sweep"  # Ask every address of some networks one by one, for networks that filter broadcasts
+DISCOVERY_MODES = (BROADCAST, SWEEP)
+
+# Defaults for a unicast sweep
+SWEEP_CONCURRENCY = 256  # Addresses probed at the same time
+PROBE_TIMEOUT = 0.5  # Seconds an address gets to answer
+MAX_SWEEP_HOSTS = 4096  # Largest number of addresses one sweep probes (a /20)
+
+# Asks every light to answer with its MAC; register=false means nothing is changed on the light
+REGISTER_MESSAGE = encode_message(
+    "registration", {"phoneMac": "AAAAAAAAAAAA", "register": False, "phoneIp": "1.2.3.4", "id": "1"}
+)
+
+
+def settings_path():
+    """Return where the discovery settings are kept: next to the .exe when packaged, else next to the scripts."""
+    if getattr(sys, 'frozen', False):  # Running as a packaged executable
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, SETTINGS_FILE)
+
+
+def load_settings(path=None):
+    """
+    Return the discovery settings.
+
+    mode is BROADCAST or SWEEP. broadcast_addresses and interfaces (also use the broadcast
+    address of every local network interface) are for broadcasts; sweep_networks (CIDR
+    ranges, empty for the local networks), sweep_concurrency, probe_timeout and
+    expected_lights (stop once that many answered, 0 to always finish) are for sweeps.
+    """
+    settings = {
+        "mode": BROADCAST,
+        "broadcast_addresses": [DEFAULT_BROADCAST],
+        "interfaces": True,
+        "sweep_networks": [],
+        "sweep_concurrency": SWEEP_CONCURRENCY,
+        "probe_timeout": PROBE_TIMEOUT,
+        "expected_lights": 0,
+    }
+    try:
+        with open(path or settings_path()) as f:
+            saved = json.load(f)
+        if "broadcast_addresses" in saved:
+            settings["broadcast_addresses"] = [address for address in saved["broadcast_addresses"] if is_valid_address(address)]
+        settings["interfaces"] = bool(saved.get("interfaces", True))
+        if saved.get("mode") in DISCOVERY_MODES:
+            settings["mode"] = saved["mode"]
+        settings["sweep_networks"] = [network for network in saved.get("sweep_networks", []) if is_valid_network(network)]
+        settings["sweep_concurrency"] = max(1, int(saved.get("sweep_concurrency", SWEEP_CONCURRENCY)))
+        settings["probe_timeout"] = max(0.05, float(saved.get("probe_timeout", PROBE_TIMEOUT)))
+        settings["expected_lights"] = max(0, int(saved.get("expected_lights", 0)))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        log.warning("Error loading discovery settings, using the defaults: %s", e)
+    return settings
+
+
+def save_settings(settings, path=None):
+    try:
+        with open(path or settings_path(), "w") as f:
+            json.dump(settings, f, indent=4)
+    except OSError as e:
+        log.error("Error saving discovery settings: %s", e)
+
+
+def is_valid_address(address):
+    """Return True for a dotted IPv4 address such as 192.168.1.255."""
+    try:
+        ipaddress.IPv4Address(address)
+    except (ipaddress.AddressValueError, ValueError):
+        return False
+    return True
+
+
+def is_valid_network(network):
+    """Return True for an IPv4 network in CIDR notation such as 192.168.0.0/22."""
+    try:
+        ipaddress.IPv4Network(network, strict=False)
+    except (ipaddress.AddressValueError, ipaddress.NetmaskValueError, ValueError):
+        return False
+    return "/" in network
+
+
+def interface_networks():
+    """
+    Return every IPv4 network the computer is on (loopback and link-local excluded).
+
+    Uses psutil when it is installed; otherwise only the network of the default route is
+    found, assuming a /24.
+    """
+    networks = []
+    if psutil is not None:
+        for addresses in psutil.net_if_addrs().values():
+            for address in addresses:
+                if address.family == socket.AF_INET and address.netmask:
+                    networks.append(f"{address.address}/{address.netmask}")
+    else:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.connect(("10.255.255.255", 1))  # Sends nothing, just picks the outgoing interface
+                networks.append(f"{sock.getsockname()[0]}/24")
+        except OSError:
+            pass
+
+    found = []
+    for network in networks:
+        interface = ipaddress.IPv4Interface(network)
+        if interface.ip.is_loopback or interface.ip.is_link_local or interface.network.prefixlen >= 31:
+            continue
+        if interface.network not in found:
+            found.append(interface.network)
+    return found
+
+
+def interface_broadcast_addresses():
+    """Return the broadcast address of every IPv4 network the computer is on."""
+    return [str(network.broadcast_address) for network in interface_networks()]
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Sends the registration broadcast to every address and collects the answers by MAC."""
+
+    def __init__(self, addresses, port):
+        self.addresses = addresses
+        self.port = port
+        self.transport = None
+        self.found = {}  # mac -> ip, the first answer of each light wins
+        self.failed = set()  # Addresses that could not be sent to
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def broadcast(self):
+        for address in self.addresses:
+            try:
+                self.transport.sendto(REGISTER_MESSAGE, (address, self.port))
+            except OSError as e:
+                if address not in self.failed:
+                    self.failed.add(address)
+                    log.warning("Could not broadcast to %s: %s", address, e)
+
+    def datagram_received(self, data, addr):
+        try:
+            mac = json.loads(data).get("result", {}).get("mac")
+        except (ValueError, AttributeError):
+            return
+        if mac and mac not in self.found:
+            self.found[mac] = addr[0]
+
+
+def _discovery_socket(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    try:
+        sock.bind(("", port))  # Where pywizlight listens too, some lights answer there
+    except OSError:
+        sock.bind(("", 0))
+    return sock
+
+
+async def discover(addresses=(DEFAULT_BROADCAST,), interfaces=True, wait_time=DISCOVERY_WAIT, port=WIZ_PORT):
+    """
+    Broadcast to every address (plus every interface's broadcast address) at once and return
+    a wizlight for each light that answered, one per MAC.
+
+    All subnets are asked from one socket at the same time, so a sweep over any number of
+    them takes wait_time seconds.
+    """
+    targets = list(dict.fromkeys(list(addresses) + (interface_broadcast_addresses() if interfaces else [])))
+    if not targets:
+        targets = [DEFAULT_BROADCAST]
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: DiscoveryProtocol(targets, port), sock=_discovery_socket(port)
+    )
+    try:
+        deadline = loop.time() + wait_time
+        while True:
+            protocol.broadcast()
+            remaining = deadline - loop.time()
+            if remaining <= RESEND_INTERVAL:
+                await asyncio.sleep(max(0, remaining))
+                break
+            await asyncio.sleep(RESEND_INTERVAL)
+    finally:
+        transport.close()
+    get_registry().observe("discovery.broadcast_seconds", time.monotonic() - started)
+    get_registry().count("discovery.lights_found", len(protocol.found))
+    return [wizlight(ip=ip, mac=mac) for mac, ip in protocol.found.items()]
+
+
+class SweepProtocol(asyncio.DatagramProtocol):
+    """Matches the answers of a sweep to the probes waiting for them, by source address."""
+
+    def __init__(self):
+        self.transport = None
+        self.waiting = {}  # ip -> future of the probe to that address
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        future = self.waiting.get(addr[0])
+        if future is None or future.done():
+            return
+        try:
+            result = json.loads(data).get("result")
+        except (ValueError, AttributeError):
+            return
+        if isinstance(result, dict) and result.get("mac"):
+            future.set_result(result)
+
+
+def sweep_hosts(networks):
+    """Return the host addresses of the given CIDR networks (once each), or raise ValueError if there are too many."""
+    hosts = {}
+    for network in networks:
+        network = ipaddress.IPv4Network(network, strict=False)
+        if network.num_addresses > MAX_SWEEP_HOSTS or len(hosts) + network.num_addresses > MAX_SWEEP_HOSTS + 2:
+            raise ValueError(f"Sweeping more than {MAX_SWEEP_HOSTS} addresses is not supported ({network})")
+        hosts.update(dict.fromkeys(str(host) for host in network.hosts()))
+    return list(hosts)
+
+
+async def sweep(networks=None, concurrency=SWEEP_CONCURRENCY, timeout=PROBE_TIMEOUT, expected=0, port=WIZ_PORT):
+    """
+    Find lights without broadcasts by sending getSystemConfig to every address of some networks.
+
+    networks are CIDR ranges (the computer's own networks if none are given). At most
+    `concurrency` addresses are waiting for an answer at a time, each gets `timeout` seconds
+    (its probe is sent twice in case one is lost), and the sweep stops as soon as `expected`
+    lights answered. Returns [(ip, system config), ...], one per MAC; the config holds the
+    light's mac and moduleName.
+    """
+    hosts = sweep_hosts(networks if networks else [str(network) for network in interface_networks()])
+    if not hosts:
+        return []
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(SweepProtocol, local_addr=("0.0.0.0", 0))
+    probe = encode_message("getSystemConfig", {})
+    found = {}  # mac -> (ip, config)
+    done = loop.create_future()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def probe_host(ip):
+        async with slots:
+            if done.done():
+                return
+            future = protocol.waiting[ip] = loop.create_future()
+            try:
+                for wait in (timeout / 2, timeout / 2):
+                    try:
+                        transport.sendto(probe, (ip, port))
+                    except OSError:
+                        return  # Unreachable (e.g. no route), nothing will answer
+                    try:
+                        config = await asyncio.wait_for(asyncio.shield(future), wait)
+                    except asyncio.TimeoutError:
+                        continue
+                    found.setdefault(config["mac"], (ip, config))
+                    if expected and len(found) >= expected and not done.done():
+                        done.set_result(None)
+                    return
+            finally:
+                del protocol.waiting[ip]
+
+    probes = [loop.create_task(probe_host(ip)) for ip in hosts]
+    finished = loop.create_task(asyncio.wait(probes))
+    try:
+        await asyncio.wait([done, finished], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Stop early (enough lights answered) or on cancellation: drop the probes still waiting
+        for task in probes:
+            task.cancel()
+        await asyncio.gather(finished, *probes, return_exceptions=True)
+        done.cancel()
+        transport.close()
+    get_registry().observe("discovery.sweep_seconds", time.monotonic() - started)
+    get_registry().count("discovery.lights_found", len(found))
+    return list(found.values())
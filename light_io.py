@@ -0,0 +1,28 @@
+import asyncio
+
+from qasync import QEventLoop
+
+from wiz_transport import close_transport
+
+
+def run_event_loop(app):
+    """
+    Run a Qt app on a qasync loop until its last window closes, and return the exit code
+    passed to QApplication.exit() (0 when the last window closed).
+
+    This is the one asyncio loop of the process: all light I/O runs on it, in the GUI
+    thread, so no thread or loop has to be set up per task and results reach the widgets
+    without cross-thread signals. Whatever light I/O is still running at exit is cancelled
+    (so sockets get closed) before the loop is.
+    """
+    loop = QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    with loop:
+        exit_code = loop.run_forever()  # What app.exec() returned
+        pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        close_transport()
+    return exit_code
@@ -0,0 +1,158 @@
+class LightEntry:
+    """
+    Everything the app keeps about one light: its wizlight handle, display name,
+    last known state, model and the UI row that shows it.
+    """
+
+    __slots__ = ("ip", "mac", "light", "name", "state", "row", "model")
+
+    def __init__(self, ip, mac=None, light=None, name=None):
+        self.ip = ip
+        self.mac = mac
+        self.light = light
+        self.name = name
+        self.state = None
+        self.row = None
+        self.model = None  # moduleName from getSystemConfig, once asked
+
+    @property
+    def display_name(self):
+        """The user-given name, or the IP if the light was never renamed."""
+        return self.name or self.ip
+
+
+class LightRegistry:
+    """
+    Lights indexed by IP and by MAC, so lookups, renames and state updates are O(1).
+
+    Names are remembered per MAC (or IP when the MAC is unknown) and survive a light
+    disappearing from a discovery and coming back, even at a new IP.
+    """
+
+    def __init__(self):
+        self._by_ip = {}
+        self._by_mac = {}
+        self._names = {}  # mac or ip -> name given by the user
+        self.version = 0  # Bumped whenever the set of IPs changes
+        self._displaced = []  # Entries pushed out of their IP by another light
+
+    def add(self, light, name=None):
+        """
+        Add or update a discovered wizlight and return its entry.
+
+        A light that was known under another IP (same MAC) is moved to its new IP.
+        """
+        entry = self.add_ip(light.ip, getattr(light, "mac", None), name)
+        entry.light = light
+        return entry
+
+    def add_ip(self, ip, mac=None, name=None):
+        """Add or update a light known only by its address (and optionally its MAC)."""
+        entry = self._by_mac.get(mac) if mac else None
+        occupant = self._by_ip.get(ip)
+        if occupant is not None and occupant is not entry and (
+                entry is not None or (mac and occupant.mac and occupant.mac != mac)):
+            # Another light took over this IP (e.g. two lights swapped addresses after a
+            # DHCP renewal): drop it, it is added again once it is found at its new IP
+            self._displace(occupant)
+        if entry is not None and entry.ip != ip:
+            if self._by_ip.get(entry.ip) is entry:
+                del self._by_ip[entry.ip]
+            entry.ip = ip
+            self.version += 1
+        if entry is None:
+            entry = self._by_ip.get(ip)
+        if entry is None:
+            entry = LightEntry(ip, mac)
+            self.version += 1
+        if mac:
+            entry.mac = mac
+            self._by_mac[mac] = entry
+        self._by_ip[ip] = entry
+
+        if name:
+            self.rename(ip, name)
+        elif not entry.name:
+            entry.name = self._names.get(entry.mac) or self._names.get(entry.ip)
+        return entry
+
+    def get(self, ip):
+        return self._by_ip.get(ip)
+
+    def by_mac(self, mac):
+        return self._by_mac.get(mac)
+
+    def light(self, ip):
+        """Return the wizlight handle for an IP, or None if the light is unknown."""
+        entry = self._by_ip.get(ip)
+        return entry.light if entry is not None else None
+
+    def name(self, ip):
+        """Return the display name for an IP (the IP itself if the light has no name)."""
+        entry = self._by_ip.get(ip)
+        if entry is not None:
+            return entry.display_name
+        return self._names.get(ip) or ip
+
+    def rename(self, ip, name):
+        entry = self._by_ip.get(ip)
+        if entry is None:
+            return None
+        entry.name = name
+        self._names[entry.mac or entry.ip] = name
+        return entry
+
+    def update_state(self, ip, state):
+        entry = self._by_ip.get(ip)
+        if entry is not None:
+            entry.state = state
+        return entry
+
+    def set_row(self, ip, row):
+        entry = self._by_ip.get(ip)
+        if entry is not None:
+            entry.row = row
+        return entry
+
+    def remove(self, ip):
+        """Forget a light (its name is kept in case it comes back) and return its entry."""
+        entry = self._by_ip.pop(ip, None)
+        if entry is not None:
+            self.version += 1
+        if entry is not None and entry.mac and self._by_mac.get(entry.mac) is entry:
+            del self._by_mac[entry.mac]
+        return entry
+
+    def _displace(self, entry):
+        self.remove(entry.ip)
+        self._displaced.append(entry)
+
+    def pop_displaced(self):
+        """Return (and forget) the entries other lights pushed out of their IP since the last call."""
+        displaced, self._displaced = self._displaced, []
+        return displaced
+
+    def retain(self, ips):
+        """Remove every light whose IP is not in ips and return the removed entries."""
+        keep = set(ips)
+        return [self.remove(ip) for ip in list(self._by_ip) if ip not in keep]
+
+    def ips(self):
+        return list(self._by_ip)
+
+    def lights(self):
+        """Return the wizlight handles of every known light."""
+        return [entry.light for entry in self._by_ip.values() if entry.light is not None]
+
+    def as_dicts(self):
+        """Return the lights as the [{'ip': ..., 'name': ...}] list the pattern editor expects."""
+        return [{"ip": entry.ip, "name": entry.display_name} for entry in self._by_ip.values()]
+
+    def __contains__(self, ip):
+        return ip in self._by_ip
+
+    def __iter__(self):
+        return iter(list(self._by_ip.values()))
+
+    def __len__(self):
+        return len(self._by_ip)
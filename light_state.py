@@ -0,0 +1,250 @@
+import asyncio
+import json
+import logging
+import socket
+import time
+import uuid
+
+from pywizlight.bulb import PilotParser
+
+from wiz_transport import encode_message, get_pilot, get_transport
+
+
+log = logging.getLogger(__name__)
+
+
+PUSH_PORT = 38900  # Lights send their syncPilot updates here once we registered with them
+REGISTER_INTERVAL = 20.0  # Seconds between registrations; lights forget us if we stop renewing
+PUSH_TIMEOUT = 45.0  # A light that hasn't pushed for this long is polled instead
+MIN_POLL_INTERVAL = 2.0  # Polling of lights that don't push starts here...
+MAX_POLL_INTERVAL = 30.0  # ...and slows down to this while their state doesn't change
+POLL_TIMEOUT = 2.0  # Seconds a polled light gets to answer
+TICK = 0.5  # Seconds between checks for due registrations and polls
+
+# Keys of a syncPilot/getPilot result that say nothing about the light's state
+VOLATILE_KEYS = ("mac", "rssi", "src", "cnx")
+
+
+def _phone_mac():
+    """A MAC for this computer, as the lights expect one in the registration."""
+    return f"{uuid.getnode():012x}".upper()
+
+
+def _source_ip(ip):
+    """Return our own address on the network a light is on (the address it should push to)."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect((ip, PUSH_PORT))  # Sends nothing, just picks the outgoing interface
+            return sock.getsockname()[0]
+    except OSError:
+        return None
+
+
+def same_state(a, b):
+    """Return True if two pilot results describe the same light state."""
+    if a is None or b is None:
+        return a is b
+    keys = (set(a) | set(b)).difference(VOLATILE_KEYS)
+    return all(a.get(key) == b.get(key) for key in keys)
+
+
+class Subscription:
+    """What the service knows about one light: its last state and when to register or poll next."""
+
+    __slots__ = ("ip", "result", "state", "updated", "last_push", "next_register", "next_poll",
+                 "poll_interval", "polling", "source_ip")
+
+    def __init__(self, ip, now):
+        self.ip = ip
+        self.result = None  # Last pilot result (dict)
+        self.state = None  # The same as a PilotParser
+        self.updated = None  # When the state was last confirmed (pushed, polled or given)
+        self.last_push = None  # When the light last pushed, None if it never did
+        self.next_register = now
+        self.next_poll = now
+        self.poll_interval = MIN_POLL_INTERVAL
+        self.polling = None  # Task of the poll in flight
+        self.source_ip = None
+
+    def pushing(self, now):
+        return self.last_push is not None and now - self.last_push < PUSH_TIMEOUT
+
+
+class PushProtocol(asyncio.DatagramProtocol):
+    """Receives the syncPilot messages lights push to PUSH_PORT."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return  # The WiZ app sends b"test" to check the port, among others
+        if isinstance(message, dict) and message.get("method") == "syncPilot":
+            params = message.get("params")
+            if isinstance(params, dict):
+                self.service.pushed(addr[0], params)
+
+
+class StateSubscriptionService:
+    """
+    Keeps the state of every subscribed light, without polling the lights that push.
+
+    Each light is registered with (and re-registered every REGISTER_INTERVAL seconds) so
+    it sends a syncPilot message to PUSH_PORT whenever its state changes, plus a heartbeat.
+    Lights that never push (or stopped, or when PUSH_PORT is taken by another program) are
+    polled instead, every MIN_POLL_INTERVAL seconds, slowing down to MAX_POLL_INTERVAL
+    while nothing changes. Listeners are called with (ip, PilotParser) only when a light's
+    state actually changed; state(ip) reads the cache.
+    """
+
+    def __init__(self, port=PUSH_PORT, clock=time.monotonic):
+        self.port = port
+        self.clock = clock
+        self.subscriptions = {}  # ip -> Subscription
+        self.listeners = []
+        self.phone_mac = _phone_mac()
+        self.push_transport = None
+        self.push_available = False  # False until the push port is open (or if it can't be)
+        self.pushes = 0  # syncPilot messages received
+        self.polls = 0  # getPilot requests sent
+        self._task = None
+
+    async def start(self):
+        """Open the push port and start registering and polling; returns False if only polling is possible."""
+        if self._task is not None:
+            return self.push_available
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("", self.port))
+            self.push_transport, _ = await loop.create_datagram_endpoint(lambda: PushProtocol(self), sock=sock)
+            self.push_available = True
+        except OSError as e:
+            sock.close()
+            log.warning("Cannot listen for light updates on port %s (%s), polling the lights instead", self.port, e)
+        self._task = loop.create_task(self._run())
+        return self.push_available
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for subscription in self.subscriptions.values():
+            if subscription.polling is not None:
+                subscription.polling.cancel()
+        if self.push_transport is not None:
+            self.push_transport.close()
+            self.push_transport = None
+        self.push_available = False
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def subscribe(self, ip):
+        """Start following a light; it is registered and polled for its state on the next tick."""
+        if ip not in self.subscriptions:
+            self.subscriptions[ip] = Subscription(ip, self.clock())
+
+    def unsubscribe(self, ip):
+        subscription = self.subscriptions.pop(ip, None)
+        if subscription is not None and subscription.polling is not None:
+            subscription.polling.cancel()
+
+    def retain(self, ips):
+        """Unsubscribe every light whose IP is not in ips."""
+        keep = set(ips)
+        for ip in [ip for ip in self.subscriptions if ip not in keep]:
+            self.unsubscribe(ip)
+
+    def state(self, ip):
+        """Return the last known state of a light as a PilotParser (None if unknown)."""
+        subscription = self.subscriptions.get(ip)
+        return subscription.state if subscription is not None else None
+
+    def age(self, ip):
+        """Return the seconds since a light's state was last confirmed (None if unknown)."""
+        subscription = self.subscriptions.get(ip)
+        if subscription is None or subscription.updated is None:
+            return None
+        return self.clock() - subscription.updated
+
+    def is_pushing(self, ip):
+        subscription = self.subscriptions.get(ip)
+        return subscription is not None and subscription.pushing(self.clock())
+
+    def update(self, ip, result):
+        """Record a light's pilot result (from a push, a poll or anyone who asked the light)."""
+        subscription = self.subscriptions.get(ip)
+        if subscription is None:
+            return
+        now = self.clock()
+        subscription.updated = now
+        if same_state(subscription.result, result):
+            subscription.poll_interval = min(subscription.poll_interval * 2, MAX_POLL_INTERVAL)
+        else:
+            subscription.poll_interval = MIN_POLL_INTERVAL
+            subscription.result = result
+            subscription.state = PilotParser(result)
+            for listener in list(self.listeners):
+                listener(ip, subscription.state)
+        subscription.next_poll = now + subscription.poll_interval
+
+    def pushed(self, ip, params):
+        subscription = self.subscriptions.get(ip)
+        if subscription is None:
+            return
+        self.pushes += 1
+        subscription.last_push = self.clock()
+        self.update(ip, params)
+
+    def summary(self):
+        pushing = sum(1 for ip in self.subscriptions if self.is_pushing(ip))
+        return (f"{len(self.subscriptions)} light(s) followed, {pushing} pushing, "
+                f"{self.pushes} pushes and {self.polls} polls received/sent")
+
+    async def _run(self):
+        transport = await get_transport()
+        while True:
+            now = self.clock()
+            for subscription in list(self.subscriptions.values()):
+                if self.push_available and now >= subscription.next_register:
+                    self._register(transport, subscription)
+                    subscription.next_register = now + REGISTER_INTERVAL
+                if subscription.polling is None and now >= subscription.next_poll and not subscription.pushing(now):
+                    subscription.polling = asyncio.create_task(self._poll(subscription))
+            await asyncio.sleep(TICK)
+
+    def _register(self, transport, subscription):
+        if subscription.source_ip is None:
+            subscription.source_ip = _source_ip(subscription.ip)
+            if subscription.source_ip is None:
+                return
+        message = encode_message(
+            "registration",
+            {"phoneIp": subscription.source_ip, "register": True, "phoneMac": self.phone_mac}
+        )
+        try:
+            transport.send(subscription.ip, message)
+        except OSError as e:
+            log.warning("Could not register with light %s: %s", subscription.ip, e)
+
+    async def _poll(self, subscription):
+        self.polls += 1
+        try:
+            result = await get_pilot(subscription.ip, timeout=POLL_TIMEOUT)
+        except (asyncio.TimeoutError, OSError):
+            result = None
+        finally:
+            subscription.polling = None
+        if result and self.subscriptions.get(subscription.ip) is subscription:
+            self.update(subscription.ip, result)
+        else:
+            # Not answering, try again later without hammering it
+            subscription.poll_interval = min(subscription.poll_interval * 2, MAX_POLL_INTERVAL)
+            subscription.next_poll = self.clock() + subscription.poll_interval
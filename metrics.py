@@ -0,0 +1,186 @@
+import bisect
+import json
+import logging
+import os
+import sys
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+SNAPSHOT_FILE = "metrics_snapshot.json"
+SNAPSHOT_INTERVAL = 60  # Seconds between snapshot files written by the app
+
+# Histogram bucket upper bounds in seconds: 0.5 ms doubling up to about 33 s
+LATENCY_BOUNDS = tuple(0.0005 * 2 ** i for i in range(17))
+
+
+def default_snapshot_path():
+    """Return where the snapshot is kept: next to the .exe when packaged, else next to the scripts."""
+    if getattr(sys, 'frozen', False):  # Running as a packaged executable
+        base_path = os.path.dirname(sys.executable)
+    else:
+        base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, SNAPSHOT_FILE)
+
+
+class Histogram:
+    """
+    Counts of values in fixed buckets, plus their count, sum and maximum.
+
+    observe() is a bisect and a few additions, cheap enough for every pattern step.
+    Percentiles are the upper bound of the bucket they fall in, so they are at most
+    one bucket (a factor of two) off.
+    """
+
+    __slots__ = ("bounds", "counts", "count", "total", "max")
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket holds everything above the bounds
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        """Return the bucket bound below which `fraction` of the values lie (None if there are none)."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count, "mean": self.mean, "max": self.max if self.count else None,
+            "p50": self.percentile(0.5), "p99": self.percentile(0.99),
+        }
+
+
+class LightMetrics:
+    """Commands sent to one light, how they ended and how long the light took to answer."""
+
+    __slots__ = ("sent", "ok", "timeouts", "errors", "latency")
+
+    def __init__(self):
+        self.sent = 0
+        self.ok = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+    def as_dict(self):
+        return {"sent": self.sent, "ok": self.ok, "timeouts": self.timeouts, "errors": self.errors,
+                "latency": self.latency.as_dict()}
+
+
+class MetricsRegistry:
+    """
+    Counters, histograms and per-light command metrics of the whole process.
+
+    Updates are a dictionary lookup and an addition, and return right away while the
+    registry is disabled. Gauges are functions that are only called for a snapshot.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.started = time.time()
+        self.counters = {}  # name -> int
+        self.histograms = {}  # name -> Histogram
+        self.lights = {}  # ip -> LightMetrics
+        self.gauges = {}  # name -> function returning the current value
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        if self.enabled:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def light(self, ip):
+        """Return the LightMetrics of a light, created on first use."""
+        metrics = self.lights.get(ip)
+        if metrics is None:
+            metrics = self.lights[ip] = LightMetrics()
+        return metrics
+
+    def command_sent(self, ip, status, latency):
+        """Record a command to a light that ended with status ("ok", "timeout" or "error") after latency seconds."""
+        if not self.enabled:
+            return
+        metrics = self.lights.get(ip)
+        if metrics is None:
+            metrics = self.lights[ip] = LightMetrics()
+        metrics.sent += 1
+        if status == "ok":
+            metrics.ok += 1
+            metrics.latency.observe(latency)
+        elif status == "timeout":
+            metrics.timeouts += 1
+        else:
+            metrics.errors += 1
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def reset(self):
+        self.started = time.time()
+        self.counters.clear()
+        self.histograms.clear()
+        self.lights.clear()
+
+    def snapshot(self):
+        """Return every metric as plain data (seconds for durations)."""
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception as e:  # A gauge of something that went away shouldn't break the snapshot
+                gauges[name] = f"error: {e}"
+        return {
+            "time": time.time(),
+            "since": self.started,
+            "counters": dict(self.counters),
+            "gauges": gauges,
+            "histograms": {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+            "lights": {ip: metrics.as_dict() for ip, metrics in self.lights.items()},
+        }
+
+    def write_snapshot(self, path=None):
+        """Write snapshot() to a JSON file, replacing it in one step."""
+        path = path or default_snapshot_path()
+        temporary = path + ".tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(self.snapshot(), f, indent=4)
+            os.replace(temporary, path)
+        except OSError as e:
+            log.error("Error writing the metrics snapshot: %s", e)
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """Return the process-wide metrics registry."""
+    return _registry
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+from command_dispatch import LIGHT_DEADLINE, CommandDispatcher
+from pattern_runner import CATCH_UP, LATE_POLICIES, PatternRunner, PilotTracker
+from pattern_timeline import compile_pattern
+from rate_limit import DEFAULT_BURST, DEFAULT_RATE, RateLimits
+from wiz_simulator import DEFAULT_BASE, Simulator, bulb_addresses
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # Optional, only needed for the peak RSS on Windows
+    psutil = None
+
+
+LIGHT_COUNTS = (1, 10, 50, 100, 500)
+STEP_DURATIONS = (1, 10, 100, 1000)  # Milliseconds
+RUN_TIME = 5.0  # Seconds each run plays its pattern
+MIN_STEPS = 10  # Runs with long steps play at least this many steps
+ACK_GRACE = 1.0  # Seconds to wait for the answers of the last commands after a run
+RESULTS_FILE = "benchmark_results.json"
+REGRESSION_THRESHOLD = 0.2  # A result 20% worse than the baseline counts as a regression
+COLORS = ((255, 0, 0), (0, 0, 255))  # Every step changes every light's color
+
+
+def benchmark_pattern(step_ms):
+    """A pattern that switches every light between two colors every step_ms milliseconds."""
+    return {
+        "name": f"benchmark {step_ms} ms",
+        "steps": [
+            {"light_ip": "all", "action": "set_color", "color": list(color), "brightness": 255, "duration": step_ms}
+            for color in COLORS
+        ],
+    }
+
+
+def percentile(values, fraction):
+    """Return the value below which `fraction` of values lie (nearest rank), or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def peak_rss():
+    """Return this process's peak resident memory in bytes (None if it can't be found)."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, KiB elsewhere
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    return None
+
+
+async def run_case(ips, step_ms, run_time, burst, rate, policy=CATCH_UP):
+    """
+    Play the benchmark pattern on ips for run_time seconds and return the measurements.
+
+    Steps are fired through a PilotTracker and a CommandDispatcher the way LightApp.fireStep
+    does, so this measures the same code path the app runs.
+    """
+    timeline = compile_pattern(benchmark_pattern(step_ms), ips)
+    dispatcher = CommandDispatcher(limits=RateLimits((burst, rate)))
+    tracker = PilotTracker()
+    clock = time.monotonic
+    jitter = []  # Seconds each step started after its deadline
+    latencies = []  # Seconds from submitting a command until its light answered
+    statuses = {}
+    outstanding = set()  # Futures of the commands not answered yet
+    cycle = -1
+    last_index = None
+    start = None
+
+    def done(future, submitted):
+        outstanding.discard(future)
+        status = "cancelled" if future.cancelled() else future.result()
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == "ok":
+            latencies.append(clock() - submitted)
+
+    def fire(step):
+        nonlocal cycle, last_index
+        now = clock()
+        if last_index is None or step.index <= last_index:
+            cycle += 1
+        last_index = step.index
+        jitter.append(now - (start + cycle * timeline.cycle_duration + step.offset))
+        for ip in step.targets:
+            command = tracker.plan(ip, step)
+            if command is None:
+                continue
+            future = dispatcher.submit(ip, command[0], command[1], timeout=LIGHT_DEADLINE)
+            outstanding.add(future)
+            future.add_done_callback(lambda f, submitted=now: done(f, submitted))
+
+    runner = PatternRunner(timeline, fire, policy=policy)
+    cpu_start = time.process_time()
+    start = clock()
+    task = asyncio.create_task(runner.run())
+    await asyncio.sleep(run_time)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    elapsed = clock() - start
+    cpu = time.process_time() - cpu_start
+
+    # Let the last commands be answered, then drop whatever is still queued
+    grace_end = clock() + ACK_GRACE
+    while outstanding and clock() < grace_end:
+        await asyncio.sleep(0.01)
+    dispatcher.close()
+
+    steps = runner.stats.steps_fired
+    rss = peak_rss()
+    sent = sum(count for status, count in statuses.items() if status in ("ok", "timeout", "error"))
+    return {
+        "lights": len(ips),
+        "step_ms": step_ms,
+        "seconds": round(elapsed, 3),
+        "steps": steps,
+        "commands": sent,
+        "commands_per_sec": round(sent / elapsed, 1),
+        "statuses": statuses,
+        "coalesced": dispatcher.coalesced,
+        "throttled": dispatcher.throttled,
+        "jitter_p50_ms": milliseconds(percentile(jitter, 0.5)),
+        "jitter_p99_ms": milliseconds(percentile(jitter, 0.99)),
+        "jitter_max_ms": milliseconds(max(jitter) if jitter else None),
+        "latency_p50_ms": milliseconds(percentile(latencies, 0.5)),
+        "latency_p99_ms": milliseconds(percentile(latencies, 0.99)),
+        "cpu_ms_per_step": round(cpu * 1000 / steps, 4) if steps else None,
+        "peak_rss_mb": round(rss / 2 ** 20, 1) if rss is not None else None,
+    }
+
+
+async def run_suite(args):
+    """Start the simulated bulbs, run every case in a process of its own and return the results."""
+    simulator = Simulator(
+        bulb_addresses(max(args.lights), args.base), broadcast=False,
+        latency=args.latency, jitter=args.jitter, loss=args.loss,
+    )
+    await simulator.start()
+    runs = []
+    try:
+        for lights in args.lights:
+            for step_ms in args.steps:
+                run_time = max(args.duration, MIN_STEPS * step_ms / 1000)
+                case = {
+                    "ips": simulator.ips[:lights], "step_ms": step_ms, "run_time": run_time,
+                    "burst": args.burst, "rate": args.rate, "policy": args.policy,
+                }
+                received = sum(bulb.received for bulb in simulator.bulbs)
+                # A fresh process per case, so its CPU time and peak memory are its own
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case),
+                    stdout=asyncio.subprocess.PIPE,
+                )
+                output, _ = await process.communicate()
+                lines = output.decode().strip().splitlines()
+                if process.returncode != 0 or not lines:
+                    print(f"{lights} lights, {step_ms} ms steps: the run failed (exit code {process.returncode})")
+                    continue
+                result = json.loads(lines[-1])
+                result["bulb_packets"] = sum(bulb.received for bulb in simulator.bulbs) - received
+                runs.append(result)
+                print(format_result(result))
+    finally:
+        simulator.close()
+    return runs
+
+
+def format_result(result):
+    return (
+        f"{result['lights']:>4} lights {result['step_ms']:>5} ms steps: "
+        f"{result['commands_per_sec']:>8.1f} commands/s, "
+        f"jitter p50 {result['jitter_p50_ms']} / p99 {result['jitter_p99_ms']} ms, "
+        f"latency p50 {result['latency_p50_ms']} / p99 {result['latency_p99_ms']} ms, "
+        f"{result['cpu_ms_per_step']} ms CPU/step, {result['peak_rss_mb']} MB peak"
+    )
+
+
+def compare(runs, baseline, threshold=REGRESSION_THRESHOLD):
+    """Return a line for every result that is more than threshold worse than the baseline's same case."""
+    previous = {(run["lights"], run["step_ms"]): run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in runs:
+        before = previous.get((run["lights"], run["step_ms"]))
+        if before is None:
+            continue
+        case = f"{run['lights']} lights, {run['step_ms']} ms steps"
+        # Higher is better for the command rate, lower is better for the rest
+        if before["commands_per_sec"] and run["commands_per_sec"] < before["commands_per_sec"] * (1 - threshold):
+            regressions.append(f"{case}: {run['commands_per_sec']} commands/s, was {before['commands_per_sec']}")
+        for key in ("jitter_p99_ms", "latency_p99_ms", "cpu_ms_per_step"):
+            # Differences of a millisecond or less are noise at these scales
+            if run[key] is not None and before.get(key) is not None and run[key] > max(before[key] * (1 + threshold), before[key] + 1):
+                regressions.append(f"{case}: {key} {run[key]}, was {before[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pattern engine against simulated bulbs.")
+    parser.add_argument("--lights", type=int, nargs="+", default=LIGHT_COUNTS, help=f"light counts to run (default {' '.join(map(str, LIGHT_COUNTS))})")
+    parser.add_argument("--steps", type=int, nargs="+", default=STEP_DURATIONS, help=f"step durations in ms (default {' '.join(map(str, STEP_DURATIONS))})")
+    parser.add_argument("--duration", type=float, default=RUN_TIME, help=f"seconds per run (default {RUN_TIME:g})")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help=f"dispatcher burst per light (default {DEFAULT_BURST})")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help=f"dispatcher commands/sec per light, 0 for no limit (default {DEFAULT_RATE:g})")
+    parser.add_argument("--policy", choices=LATE_POLICIES, default=CATCH_UP, help="late-step policy")
+    parser.add_argument("--base", default=DEFAULT_BASE, help=f"address of the first simulated bulb (default {DEFAULT_BASE})")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the simulated bulbs take to answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds their answers vary by")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of packets the simulated bulbs lose")
+    parser.add_argument("--output", default=RESULTS_FILE, help=f"JSON results file (default {RESULTS_FILE})")
+    parser.add_argument("--baseline", help="results file of an earlier run; exit with 1 if anything got worse")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)  # Used by the suite for each of its runs
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        case = json.loads(args.run_case)
+        result = asyncio.run(run_case(case["ips"], case["step_ms"], case["run_time"], case["burst"], case["rate"], case["policy"]))
+        print(json.dumps(result))
+        return 0
+
+    try:
+        runs = asyncio.run(run_suite(args))
+    except OSError as e:
+        print(f"Could not start the simulated bulbs: {e}")
+        return 1
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "duration": args.duration, "burst": args.burst, "rate": args.rate, "policy": args.policy,
+            "latency": args.latency, "jitter": args.jitter, "loss": args.loss,
+        },
+        "runs": runs,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(runs, json.load(f))
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,369 @@
+"""
+Binary pattern files (.wizp).
+
+    header   <4sHHIIII  magic b"WZPT", version, header flags, step count and the byte
+                        lengths of the name, the description and the target table
+    name     UTF-8
+    desc     UTF-8
+    targets  UTF-8 JSON list of the distinct light_ip values of the steps
+    records  one <IiHBBBBBB record (16 bytes) per step: offset and duration in ms, index
+             into the target table, action, r, g, b, brightness and flags
+
+The flags remember how the step was written in JSON (color as a list or dict, missing
+color, brightness or duration), so converting to .wizp and back gives the same pattern.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+from pattern_timeline import PatternCompileError, TimelineStep, resolve_targets
+from wiz_transport import encode_pilot
+
+
+EXTENSION = ".wizp"
+MAGIC = b"WZPT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIII")
+RECORD = struct.Struct("<IiHBBBBBB")
+
+ACTION_CODES = {"set_color": 0, "turn_off": 1}
+ACTION_NAMES = {code: action for action, code in ACTION_CODES.items()}
+
+# Header flags
+HAS_NAME = 1
+HAS_DESCRIPTION = 2
+
+# Record flags
+HAS_COLOR = 1
+COLOR_AS_LIST = 2
+HAS_BRIGHTNESS = 4
+NO_DURATION = 8  # Set when the step had no duration, so files written before it read the same
+
+STEP_KEYS = ("light_ip", "action", "color", "brightness", "duration")
+PATTERN_KEYS = ("name", "description", "steps")
+
+
+class PatternFormatError(ValueError):
+    """Raised when a pattern can't be stored in (or read from) the binary format."""
+
+
+def _byte(value, what, index):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= 255:
+        raise PatternFormatError(f"Step {index + 1}: {what} {value!r} must be an integer from 0 to 255")
+    return value
+
+
+def encode_pattern(pattern):
+    """Return the .wizp bytes of a JSON pattern dict. Raises PatternFormatError for anything it can't store losslessly."""
+    if not isinstance(pattern, dict):
+        raise PatternFormatError("A pattern must be an object")
+    extra = set(pattern) - set(PATTERN_KEYS)
+    if extra:
+        raise PatternFormatError(f"Unsupported pattern keys: {', '.join(sorted(extra))}")
+    steps = pattern.get("steps", [])
+    if not isinstance(steps, list):
+        raise PatternFormatError("steps must be a list")
+
+    targets = []
+    target_index = {}
+    records = bytearray()
+    offset = 0
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict):
+            raise PatternFormatError(f"Step {index + 1}: expected an object")
+        extra = set(step) - set(STEP_KEYS)
+        if extra:
+            raise PatternFormatError(f"Step {index + 1}: unsupported keys: {', '.join(sorted(extra))}")
+        if step.get("action") not in ACTION_CODES:
+            raise PatternFormatError(f"Step {index + 1}: unknown action {step.get('action')!r}")
+
+        light_ip = step.get("light_ip")
+        key = json.dumps(light_ip)
+        if key not in target_index:
+            try:
+                resolve_targets(light_ip, ())
+            except ValueError as e:
+                raise PatternFormatError(f"Step {index + 1}: {e}") from e
+            target_index[key] = len(targets)
+            targets.append(light_ip)
+
+        duration = step.get("duration", 0)
+        if isinstance(duration, bool) or not isinstance(duration, int) or not -2**31 <= duration < 2**31:
+            raise PatternFormatError(f"Step {index + 1}: duration {duration!r} must be a whole number of milliseconds")
+
+        flags = 0 if "duration" in step else NO_DURATION
+        r = g = b = 0
+        if "color" in step:
+            flags |= HAS_COLOR
+            color = step["color"]
+            if isinstance(color, list) and len(color) == 3:
+                flags |= COLOR_AS_LIST
+                r, g, b = color
+            elif isinstance(color, dict) and set(color) == {"r", "g", "b"}:
+                r, g, b = color["r"], color["g"], color["b"]
+            else:
+                raise PatternFormatError(f"Step {index + 1}: unsupported color {color!r}")
+        brightness = 0
+        if "brightness" in step:
+            flags |= HAS_BRIGHTNESS
+            brightness = _byte(step["brightness"], "brightness", index)
+
+        records += RECORD.pack(
+            offset, duration, target_index[key], ACTION_CODES[step["action"]],
+            _byte(r, "color", index), _byte(g, "color", index), _byte(b, "color", index), brightness, flags
+        )
+        offset += max(0, duration)
+        if offset >= 2**32:
+            raise PatternFormatError("Pattern is too long for the binary format")
+    if len(targets) > 0xFFFF:
+        raise PatternFormatError("Pattern uses too many different light selections")
+
+    for key in ("name", "description"):
+        if not isinstance(pattern.get(key, ""), str):
+            raise PatternFormatError(f"{key} must be text")
+    header_flags = (HAS_NAME if "name" in pattern else 0) | (HAS_DESCRIPTION if "description" in pattern else 0)
+    name = pattern.get("name", "").encode("utf-8")
+    description = pattern.get("description", "").encode("utf-8")
+    target_table = json.dumps(targets, separators=(",", ":")).encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, header_flags, len(steps), len(name), len(description), len(target_table))
+    return header + name + description + target_table + bytes(records)
+
+
+def save_pattern(pattern, path):
+    """
+    Write a JSON pattern dict to path as a .wizp file.
+
+    The new file is written next to the old one and then replaces it, so a failed save
+    leaves the old file as it was. Windows can't replace a file that is still mapped:
+    close any BinaryPattern of path first, or this raises PermissionError (an OSError).
+    """
+    data = encode_pattern(pattern)
+    temporary = path + ".tmp"
+    try:
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+class BinaryPattern:
+    """
+    A memory-mapped .wizp file.
+
+    Steps are decoded from the mapping when they are needed, so opening even a pattern
+    with hundreds of thousands of steps is instant and playing it uses constant memory.
+    Supports get() for the name and description like a JSON pattern dict.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise PatternFormatError(f"{os.path.basename(path)} is not a binary pattern")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header(size)
+        except Exception:
+            self.close()  # Don't keep a file we can't use mapped (and locked on Windows)
+            raise
+
+    def _read_header(self, size):
+        path = self.path
+        magic, version, header_flags, count, name_len, desc_len, targets_len = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise PatternFormatError(f"{os.path.basename(path)} is not a binary pattern")
+        if version != VERSION:
+            raise PatternFormatError(f"{os.path.basename(path)} uses unsupported version {version}")
+        pos = HEADER.size
+        self.name = self._map[pos:pos + name_len].decode("utf-8")
+        pos += name_len
+        self.description = self._map[pos:pos + desc_len].decode("utf-8")
+        pos += desc_len
+        try:
+            self.targets = json.loads(self._map[pos:pos + targets_len].decode("utf-8"))
+        except ValueError as e:
+            raise PatternFormatError(f"{os.path.basename(path)} has a broken target table") from e
+        self.records_start = pos + targets_len
+        self.step_count = count
+        if self.records_start + count * RECORD.size > size:
+            raise PatternFormatError(f"{os.path.basename(path)} is truncated")
+        # Only what the JSON pattern had, so get() behaves like it does on the JSON dict
+        self.header = {}
+        if header_flags & HAS_NAME:
+            self.header["name"] = self.name
+        if header_flags & HAS_DESCRIPTION:
+            self.header["description"] = self.description
+
+    def get(self, key, default=None):
+        return self.header.get(key, default)
+
+    def _mapping(self):
+        if self.closed:  # Unloaded (e.g. to replace the file) while it was still playing
+            raise PatternCompileError(f"{os.path.basename(self.path)} was closed while playing")
+        return self._map
+
+    def records(self, chunk=4096):
+        """Iterate over the raw step records, reading chunk records at a time."""
+        end = self.records_start + self.step_count * RECORD.size
+        for start in range(self.records_start, end, chunk * RECORD.size):
+            yield from RECORD.iter_unpack(self._mapping()[start:min(start + chunk * RECORD.size, end)])
+
+    def records_valid(self, target_count, chunk=65536):
+        """Check every record's action and target index without decoding the records one by one."""
+        end = self.records_start + self.step_count * RECORD.size
+        for start in range(self.records_start, end, chunk * RECORD.size):
+            data = self._mapping()[start:min(start + chunk * RECORD.size, end)]
+            if max(data[10::RECORD.size]) > max(ACTION_NAMES):  # Action byte
+                return False
+            # Target index is little-endian at bytes 8 and 9; only look closer if the high byte is used
+            low, high = data[8::RECORD.size], data[9::RECORD.size]
+            if any(high):
+                targets = memoryview(bytes(byte for pair in zip(low, high) for byte in pair)).cast("H")
+                if max(targets) >= target_count:
+                    return False
+            elif max(low) >= target_count:
+                return False
+        return True
+
+    def record(self, index):
+        return RECORD.unpack_from(self._mapping(), self.records_start + index * RECORD.size)
+
+    def step_dict(self, record):
+        """Turn one record back into the JSON step it was made from."""
+        _, duration, target, action, r, g, b, brightness, flags = record
+        step = {"light_ip": self.targets[target], "action": ACTION_NAMES[action]}
+        if flags & HAS_COLOR:
+            step["color"] = [r, g, b] if flags & COLOR_AS_LIST else {"r": r, "g": g, "b": b}
+        if flags & HAS_BRIGHTNESS:
+            step["brightness"] = brightness
+        if not flags & NO_DURATION:
+            step["duration"] = duration
+        return step
+
+    def to_json(self):
+        """Return the pattern as a JSON pattern dict (materializes every step)."""
+        pattern = dict(self.header)
+        pattern["steps"] = [self.step_dict(record) for record in self.records()]
+        return pattern
+
+    def timeline(self, available_ips):
+        """Return a MappedTimeline that plays this pattern on the lights in available_ips."""
+        return MappedTimeline(self, available_ips)
+
+    def close(self):
+        """Release the mapping (and with it the file); the pattern can't be played afterwards."""
+        self.closed = True
+        self._map.close()
+
+
+class MappedSteps:
+    """Read-only sequence of TimelineSteps decoded on access from a BinaryPattern."""
+
+    def __init__(self, pattern, targets):
+        self._pattern = pattern
+        self._targets = targets  # Target table index -> tuple of IPs
+
+    def __len__(self):
+        return self._pattern.step_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        offset, duration, target, action, r, g, b, brightness, flags = self._pattern.record(index)
+        if action == ACTION_CODES["set_color"]:
+            rgb = (r, g, b) if flags & HAS_COLOR else (255, 255, 255)
+            brightness = brightness if flags & HAS_BRIGHTNESS else 255
+            payload = encode_pilot(rgb=rgb, brightness=brightness)
+        else:
+            rgb = brightness = None
+            payload = encode_pilot(state=False)
+        return TimelineStep(index, offset / 1000, max(0, duration) / 1000, self._targets[target], ACTION_NAMES[action], rgb, brightness, payload)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class MappedTimeline:
+    """
+    A timeline that streams its steps from a memory-mapped .wizp file.
+
+    Offers the same steps, cycle_duration and missing attributes as PatternTimeline. The
+    records are checked once when the timeline is made, so a broken file is reported
+    before the pattern starts.
+    """
+
+    def __init__(self, pattern, available_ips):
+        self.name = pattern.name or "Unnamed Pattern"
+        if not pattern.step_count:
+            raise PatternCompileError("Pattern has no steps")
+        available = dict.fromkeys(available_ips)
+        resolved = []
+        missing = {}
+        for index, light_ip in enumerate(pattern.targets):
+            try:
+                targets, target_missing = resolve_targets(light_ip, available)
+            except ValueError as e:
+                raise PatternCompileError(f"Target {index + 1}: {e}") from e
+            resolved.append(targets)
+            missing.update(dict.fromkeys(target_missing))
+        self.missing = tuple(missing)
+
+        if not pattern.records_valid(len(resolved)):
+            raise PatternCompileError(f"{os.path.basename(pattern.path)} has broken step records")
+        last = pattern.record(pattern.step_count - 1)
+        self.cycle_duration = (last[0] + max(0, last[1])) / 1000
+        self.steps = MappedSteps(pattern, resolved)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+
+def load_pattern(path):
+    """Return the JSON pattern dict stored in a .wizp file."""
+    pattern = BinaryPattern(path)
+    try:
+        return pattern.to_json()
+    finally:
+        pattern.close()
+
+
+def convert_file(source, destination=None):
+    """Convert a pattern between .json and .wizp, depending on the extension of source."""
+    base, extension = os.path.splitext(source)
+    if extension == EXTENSION:
+        destination = destination or base + ".json"
+        with open(destination, "w") as f:
+            json.dump(load_pattern(source), f, indent=4)
+    else:
+        destination = destination or base + EXTENSION
+        with open(source) as f:
+            save_pattern(json.load(f), destination)
+    return destination
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: {os.path.basename(sys.argv[0])} PATTERN.json|PATTERN.wizp [DESTINATION]")
+        sys.exit(2)
+    try:
+        print(f"Wrote {convert_file(*sys.argv[1:])}")
+    except (OSError, ValueError) as e:
+        print(f"Conversion failed: {e}")
+        sys.exit(1)
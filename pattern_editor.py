@@ -1,15 +1,23 @@
 import sys
 import json
-import asyncio
 import os
+import logging
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QListWidget, QPushButton, QLabel,
-    QColorDialog, QVBoxLayout, QWidget, QComboBox, QLineEdit, QSpinBox,
+    QColorDialog, QVBoxLayout, QWidget, QLineEdit, QSpinBox,
     QDialog, QColorDialog, QSlider, QHBoxLayout, QListWidgetItem, QFileDialog, QCheckBox, QMessageBox, QSpacerItem, QSizePolicy, QAbstractItemView
 )
-from PyQt5.QtGui import QColor, QFont, QPalette, QIntValidator, QIcon
+from PyQt5.QtGui import QFont, QIntValidator, QIcon
 from PyQt5.QtCore import Qt
 from preview_pattern import PatternPreview
+from step_list_view import StepListModel, StepListView
+import pattern_binary
+
+
+log = logging.getLogger(__name__)
+
+
+PATTERN_FILE_FILTERS = "Pattern Files (*.json *.wizp);;JSON Files (*.json);;Binary Pattern Files (*.wizp);;All Files (*)"
 
 def load_icon():
     """
@@ -21,7 +29,7 @@ def load_icon():
         base_path = os.path.abspath(".")
 
     icon_path = os.path.join(base_path, 'icon', 'pattern.ico')
-    print(f"Trying to load icon from: {icon_path}")  # Debug statement
+    log.debug("Trying to load icon from: %s", icon_path)
 
     return QIcon(icon_path)
 
@@ -204,13 +212,14 @@ class StepDialog(QDialog):
 
 
 class PatternEditor(QMainWindow):
-    def __init__(self, available_lights=None, discovered_lights=None):
+    def __init__(self, available_lights=None, discovered_lights=None, pattern_library=None):
         super().__init__()
         self.setWindowTitle("WiZ Light Pattern Editor")
         self.setGeometry(100, 100, 800, 600)
         self.setWindowIcon(load_icon())  # Load the icon dynamically        
         self.available_lights = available_lights or []  # List of lights from main program
         self.discovered_lights = discovered_lights or []  # List of discovered lights
+        self.pattern_library = pattern_library  # The main program's patterns, which may have the file we save open
 
         self.pattern_name = ""
         self.pattern_description = ""
@@ -262,8 +271,9 @@ class PatternEditor(QMainWindow):
         self.preview_button.clicked.connect(self.open_preview)
         main_layout.addWidget(self.preview_button)
 
-        # Steps List
-        self.stepsList = QListWidget(self)
+        # Steps List, a model over self.pattern_steps that only repaints the rows that change
+        self.stepsModel = StepListModel(self.pattern_steps, self)
+        self.stepsList = StepListView(self.stepsModel, self)
         self.stepsList.setMinimumHeight(325)  # Set the desired minimum height for the step list
         self.stepsList.setDragDropMode(QAbstractItemView.InternalMove)  # Enable drag-and-drop
         main_layout.addWidget(self.stepsList)
@@ -304,26 +314,20 @@ class PatternEditor(QMainWindow):
         main_layout.addLayout(buttons_layout)
 
 
-    def dropEvent(self, event):
-        super().dropEvent(event)
-        self.update_steps_order()
+    def set_discovered_lights(self, lights):
+        """Use an updated list of lights (e.g. after a new discovery) for the steps edited from now on."""
+        self.discovered_lights = lights
 
-    def update_steps_order(self):
-        new_order = []
-        for index in range(self.stepsList.count()):
-            item = self.stepsList.item(index)
-            step = item.data(Qt.UserRole)
-            new_order.append(step)
-        self.pattern_steps = new_order
+    def set_pattern_library(self, library):
+        """Use the main program's PatternLibrary, so files it has loaded are released before they are saved over."""
+        self.pattern_library = library
 
     def duplicate_step(self):
-        selected_items = self.stepsList.selectedItems()
-        if selected_items:
-            row = self.stepsList.row(selected_items[0])
+        row = self.stepsList.current_row()
+        if row >= 0:
             step = self.pattern_steps[row]
             new_step = step.copy()  # Create a copy of the selected step
-            self.pattern_steps.insert(row + 1, new_step)  # Insert the copy right after the original
-            self.update_steps_display()
+            self.stepsModel.insert(row + 1, new_step)  # Insert the copy right after the original
 
 
     def clear_pattern(self):
@@ -348,11 +352,20 @@ class PatternEditor(QMainWindow):
 
     def open_pattern_file(self):
         options = QFileDialog.Options()
-        filepath, _ = QFileDialog.getOpenFileName(self, "Open Pattern", "", "JSON Files (*.json);;All Files (*)", options=options)
+        filepath, _ = QFileDialog.getOpenFileName(self, "Open Pattern", "", PATTERN_FILE_FILTERS, options=options)
         if filepath:
             try:
-                with open(filepath, 'r') as f:
-                    pattern_data = json.load(f)
+                if filepath.endswith(pattern_binary.EXTENSION):
+                    pattern_data = pattern_binary.load_pattern(filepath)
+                else:
+                    with open(filepath, 'r') as f:
+                        pattern_data = json.load(f)
+
+                if "effect" in pattern_data:
+                    # Procedural patterns are generated while they run, they have no steps to edit
+                    QMessageBox.information(self, "Open Pattern", f"'{pattern_data.get('name', filepath)}' is a procedural "
+                                            f"pattern (effect '{pattern_data['effect']}') and can't be edited step by step.")
+                    return
 
                 # Extract name and description
                 self.pattern_name = pattern_data.get("name", "")
@@ -362,7 +375,7 @@ class PatternEditor(QMainWindow):
                 self.pattern_steps = pattern_data.get("steps", [])
 
                 # Debugging line to check the pattern name loaded
-                print(f"Pattern Name Loaded: {self.pattern_name}")
+                log.debug("Pattern Name Loaded: %s", self.pattern_name)
 
                 # Determine format and normalize to a common structure
                 if self.pattern_steps and isinstance(self.pattern_steps[0], dict) and "lights" in self.pattern_steps[0]:  # Format 2
@@ -371,24 +384,44 @@ class PatternEditor(QMainWindow):
                 # Update display with the loaded pattern
                 self.update_steps_display()
             except Exception as e:
-                print(f"Error loading pattern file: {e}")
+                log.error("Error loading pattern file: %s", e)
 
 
 
     def save_pattern(self):
         options = QFileDialog.Options()
-        filepath, _ = QFileDialog.getSaveFileName(self, "Save Pattern", "", "JSON Files (*.json);;All Files (*)", options=options)
+        filepath, selected_filter = QFileDialog.getSaveFileName(self, "Save Pattern", "", "JSON Files (*.json);;Binary Pattern Files (*.wizp)", options=options)
         if filepath:
-            if not filepath.endswith('.json'):
-                filepath += '.json'
+            binary = filepath.endswith(pattern_binary.EXTENSION) or (selected_filter.startswith("Binary") and not filepath.endswith('.json'))
+            extension = pattern_binary.EXTENSION if binary else '.json'
+            if not filepath.endswith(extension):
+                filepath += extension
             self.pattern_name = self.nameEdit.text()
             self.pattern_description = self.descriptionEdit.text()
-            with open(filepath, 'w') as f:
-                json.dump({
-                    "name": self.pattern_name,
-                    "description": self.pattern_description,
-                    "steps": self.pattern_steps
-                }, f, indent=4)
+            pattern_data = {
+                "name": self.pattern_name,
+                "description": self.pattern_description,
+                "steps": self.pattern_steps
+            }
+            if self.pattern_library is not None:
+                # A loaded .wizp keeps its file mapped, and Windows can't replace a mapped file
+                target = os.path.normcase(os.path.abspath(filepath))
+                for path in self.pattern_library.paths():
+                    if os.path.normcase(os.path.abspath(path)) == target:
+                        self.pattern_library.unload(path)
+            try:
+                if binary:
+                    pattern_binary.save_pattern(pattern_data, filepath)
+                else:
+                    with open(filepath, 'w') as f:
+                        json.dump(pattern_data, f, indent=4)
+            except OSError as e:
+                log.error("Error saving pattern file: %s", e)
+                QMessageBox.warning(self, "Save Pattern", f"The pattern could not be saved: {e}")
+                return False
+            except ValueError as e:
+                QMessageBox.warning(self, "Save Pattern", f"This pattern can't be saved as a binary pattern: {e}")
+                return False
             return True  # Indicate that the pattern was saved
         return False  # Indicate that the save operation was canceled
 
@@ -434,143 +467,41 @@ class PatternEditor(QMainWindow):
         step = {"light_ip": "all", "action": "set_color", "color": {"r": 255, "g": 255, "b": 255}, "brightness": 255, "duration": 1000}
         dialog = StepDialog(step, available_lights=self.available_lights, discovered_lights=self.discovered_lights)
         if dialog.exec_() == QDialog.Accepted:
-            self.pattern_steps.append(dialog.step)
-            self.update_steps_display()
+            self.stepsModel.append(dialog.step)
 
     def edit_step(self):
-        selected_items = self.stepsList.selectedItems()
-        if selected_items:
-            row = self.stepsList.row(selected_items[0])
+        row = self.stepsList.current_row()
+        if row >= 0:
             step = self.pattern_steps[row]
             dialog = StepDialog(step, available_lights=self.available_lights, discovered_lights=self.discovered_lights)
             if dialog.exec_() == QDialog.Accepted:
-                self.pattern_steps[row] = dialog.step
-                self.update_steps_display()
+                self.stepsModel.replace(row, dialog.step)
 
 
     def remove_step(self):
-        selected_items = self.stepsList.selectedItems()
-        if selected_items:
-            row = self.stepsList.row(selected_items[0])
-            del self.pattern_steps[row]
-            self.update_steps_display()
+        row = self.stepsList.current_row()
+        if row >= 0:
+            self.stepsModel.remove(row)
 
 
     def move_step_up(self):
-        current_row = self.stepsList.currentRow()
+        current_row = self.stepsList.current_row()
         if current_row > 0:
-            self.pattern_steps.insert(current_row - 1, self.pattern_steps.pop(current_row))
-            self.update_steps_display()
-            self.stepsList.setCurrentRow(current_row - 1)
+            self.stepsModel.move(current_row, current_row - 1)
+            self.stepsList.set_current_row(current_row - 1)
 
 
     def move_step_down(self):
-        current_row = self.stepsList.currentRow()
-        if current_row < len(self.pattern_steps) - 1:
-            self.pattern_steps.insert(current_row + 1, self.pattern_steps.pop(current_row))
-            self.update_steps_display()
-            self.stepsList.setCurrentRow(current_row + 1)
+        current_row = self.stepsList.current_row()
+        if 0 <= current_row < len(self.pattern_steps) - 1:
+            self.stepsModel.move(current_row, current_row + 1)
+            self.stepsList.set_current_row(current_row + 1)
 
 
 
     def update_steps_display(self):
-        self.stepsList.clear()
-        palette = self.stepsList.palette()
-
-        # Retrieve theme colors
-        background_color = palette.color(QPalette.Base).name()
-        alternate_background_color = palette.color(QPalette.AlternateBase).name()
-        text_color = palette.color(QPalette.Text).name()
-        selection_color = palette.color(QPalette.Highlight).name()
-        selection_text_color = palette.color(QPalette.HighlightedText).name()
-
-        for index, step in enumerate(self.pattern_steps):
-            light_info = step.get("light_ip", "Unknown Light")
-            action = step.get("action", "Unknown Action")
-            color = step.get("color", [255, 255, 255])
-            print(f"Step Action: {action}, Color before applying: {color}")
-            brightness = step.get("brightness", 255)
-            duration = step.get("duration", 0)
-
-            # Format color
-            if action == "turn_off":
-                color_rgb = "rgba(0, 0, 0, 0)"  # Fully transparent
-                color_text = "(0, 0, 0)"
-            elif isinstance(color, list):
-                color_text = f"({color[0]}, {color[1]}, {color[2]})"
-                color_rgb = f"rgb({color[0]}, {color[1]}, {color[2]})"
-            elif isinstance(color, dict):
-                color_text = f"({color.get('r', 255)}, {color.get('g', 255)}, {color.get('b', 255)})"
-                color_rgb = f"rgb({color.get('r', 255)}, {color.get('g', 255)}, {color.get('b', 255)})"
-            else:
-                color_text = "(255, 255, 255)"  # Default to white if unexpected
-                color_rgb = "rgb(255, 255, 255)"
-
-            # Create formatted text with HTML
-            step_text = (f"Light: <b>{light_info}</b>, Action: <b>{action}</b>, "
-                        f"Color: <b>{color_text}</b>, Brightness: <b>{brightness}</b>, Duration: <b>{duration}ms</b>")
-
-            # Create a QWidget for the item
-            item_widget = QWidget()
-            item_layout = QHBoxLayout(item_widget)
-
-            # Add the step number as a label before the color display
-            step_number_label = QLabel(f"{index + 1}")  # Step numbers start from 1
-            step_number_label.setFont(QFont("Arial", 10, QFont.Bold))
-            item_layout.addWidget(step_number_label)
-
-            # Create a color indicator without a border
-            color_indicator = QLabel()
-            color_indicator.setFixedSize(20, 20)
-            color_indicator.setStyleSheet(f"background-color: {color_rgb}; border-radius: 10px;")
-            item_layout.addWidget(color_indicator)
-
-            # Create a label for step text
-            item_label = QLabel(step_text)
-            item_label.setTextFormat(Qt.RichText)
-            item_label.setStyleSheet(f"color: {text_color};")  # Use theme's text color
-            item_layout.addWidget(item_label)
-            item_layout.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-            item_widget.setLayout(item_layout)
-
-            # Alternate background color
-            if index % 2 == 0:
-                item_widget.setStyleSheet(f"background-color: {background_color}; color: {text_color};")
-            else:
-                item_widget.setStyleSheet(f"background-color: {alternate_background_color}; color: {text_color};")
-
-            # Create a QListWidgetItem and set the QWidget as the item
-            item = QListWidgetItem(self.stepsList)
-            item.setSizeHint(item_widget.sizeHint())
-            self.stepsList.addItem(item)
-            self.stepsList.setItemWidget(item, item_widget)
-
-            # Store step data for further use
-            item.setData(Qt.UserRole, step)
-
-        # Ensure the list widget has a visible selection mode
-        self.stepsList.setSelectionMode(QAbstractItemView.SingleSelection)
-        self.stepsList.setStyleSheet(f"""
-            QListWidget::item {{
-                padding: 5px;
-                border: none;
-            }}
-            QListWidget::item:selected {{
-                background-color: {selection_color};
-                color: {selection_text_color};
-            }}
-            QListWidget::item:selected:!active {{
-                background-color: {selection_color};
-                color: {selection_text_color};
-            }}
-            QListWidget::item:hover {{
-                background-color: {selection_color};
-                color: {selection_text_color};
-            }}
-        """)
-
-
-
+        """Show self.pattern_steps after it was replaced (new, cleared or loaded pattern)."""
+        self.stepsModel.set_steps(self.pattern_steps)
 
 
     def open_preview(self):
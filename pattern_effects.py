@@ -0,0 +1,191 @@
+import colorsys
+import itertools
+import random
+
+from pattern_timeline import PatternCompileError, compile_step
+
+
+# Effect name -> generator function, see register_effect
+EFFECTS = {}
+
+LOOKAHEAD = 64  # Most steps a generated timeline compiles ahead of the runner
+
+
+def register_effect(name):
+    """
+    Register a generator function as a procedural effect.
+
+    The function is called as effect(lights, **params) with the IPs of the lights to drive
+    and the "params" of the pattern, and yields ordinary pattern steps (the same dicts the
+    pattern editor writes). One pass of the generator is one cycle of the pattern; it may
+    also never end.
+
+        @register_effect("blink")
+        def blink(lights, color=(255, 255, 255), period=500):
+            yield {"light_ip": list(lights), "action": "set_color", "color": list(color), "duration": period}
+            yield {"light_ip": list(lights), "action": "turn_off", "duration": period}
+    """
+    def decorator(function):
+        EFFECTS[name] = function
+        return function
+    return decorator
+
+
+def hue_color(hue):
+    """Return the fully saturated [r, g, b] color for a hue between 0 and 1."""
+    return [round(channel * 255) for channel in colorsys.hsv_to_rgb(hue % 1.0, 1.0, 1.0)]
+
+
+def frame(colors, duration):
+    """
+    Yield the steps that set each light to its own color and then hold for duration ms.
+
+    colors maps IP -> ([r, g, b], brightness), or None to turn the light off. Lights that
+    get the same command share one step.
+    """
+    groups = {}
+    for ip, command in colors.items():
+        key = None if command is None else (tuple(command[0]), command[1])
+        groups.setdefault(key, []).append(ip)
+    for position, (key, ips) in enumerate(groups.items()):
+        hold = duration if position == len(groups) - 1 else 0
+        if key is None:
+            yield {"light_ip": ips, "action": "turn_off", "duration": hold}
+        else:
+            yield {"light_ip": ips, "action": "set_color", "color": list(key[0]), "brightness": key[1], "duration": hold}
+
+
+@register_effect("rainbow_chase")
+def rainbow_chase(lights, step_duration=100, frames=36, brightness=255, spread=None):
+    """A rainbow that moves across the lights; spread is the hue difference between neighbours."""
+    if spread is None:
+        spread = 1.0 / max(1, len(lights))
+    for index in range(frames):
+        base = index / frames
+        colors = {ip: (hue_color(base + position * spread), brightness) for position, ip in enumerate(lights)}
+        yield from frame(colors, step_duration)
+
+
+@register_effect("color_cycle")
+def color_cycle(lights, colors=([255, 0, 0], [0, 255, 0], [0, 0, 255]), hold=1000, brightness=255):
+    """All lights go through a list of colors together."""
+    for color in colors:
+        yield {"light_ip": list(lights), "action": "set_color", "color": list(color), "brightness": brightness, "duration": hold}
+
+
+@register_effect("chase")
+def chase(lights, color=(255, 255, 255), background=None, step_duration=200, brightness=255):
+    """One light at a time is lit, the others are off (or show the background color)."""
+    for lit in lights:
+        colors = {
+            ip: (color, brightness) if ip == lit else ((background, brightness) if background else None)
+            for ip in lights
+        }
+        yield from frame(colors, step_duration)
+
+
+@register_effect("breathe")
+def breathe(lights, color=(255, 255, 255), period=4000, frames=20, minimum=10, maximum=255):
+    """All lights fade up and down between two brightness levels."""
+    for index in range(frames):
+        level = abs(1 - 2 * index / frames)  # 1 -> 0 -> 1
+        brightness = round(maximum - (maximum - minimum) * level)
+        yield {"light_ip": list(lights), "action": "set_color", "color": list(color), "brightness": brightness, "duration": period // frames}
+
+
+@register_effect("twinkle")
+def twinkle(lights, step_duration=150, brightness=255, seed=None):
+    """Random lights change to random colors; never ends."""
+    rng = random.Random(seed)
+    while True:
+        ip = rng.choice(lights)
+        yield {"light_ip": ip, "action": "set_color", "color": hue_color(rng.random()), "brightness": brightness, "duration": step_duration}
+
+
+class GeneratedSteps:
+    """
+    The steps of a procedural pattern, compiled while they are iterated.
+
+    Every iteration starts a new pass of the effect generator, so nothing but the lookahead
+    buffer of compiled steps is ever held in memory.
+    """
+
+    def __init__(self, effect, lights, params, available):
+        self.effect = effect
+        self.lights = lights
+        self.params = params
+        self.available = available
+
+    def __iter__(self):
+        index = 0
+        elapsed = 0  # Milliseconds
+        raw_steps = self.effect(self.lights, **self.params)
+        while True:
+            # Pull at most LOOKAHEAD steps from the effect ahead of the runner
+            try:
+                batch = list(itertools.islice(raw_steps, LOOKAHEAD))
+            except Exception as e:
+                raise PatternCompileError(f"Effect {self.effect.__name__!r} failed: {e}") from e
+            if not batch:
+                return
+            for step in batch:
+                timeline_step, _ = compile_step(index, step, elapsed / 1000, self.available)
+                elapsed += max(0, step.get("duration", 0))
+                index += 1
+                yield timeline_step
+
+
+class GeneratedTimeline:
+    """
+    A timeline backed by an effect generator.
+
+    Offers steps and missing like PatternTimeline; cycle_duration is None because the
+    length of a generated cycle is only known once it has been played.
+    """
+
+    cycle_duration = None
+
+    def __init__(self, name, steps, missing):
+        self.name = name
+        self.steps = steps
+        self.missing = tuple(missing)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+
+def compile_effect(pattern, available_ips):
+    """
+    Return a GeneratedTimeline for a pattern with an "effect" (and optional "params" and "lights").
+
+    The first step is generated right away, so unknown effects and bad parameters raise
+    PatternCompileError before the pattern starts.
+    """
+    name = pattern.get("effect")
+    effect = EFFECTS.get(name)
+    if effect is None:
+        raise PatternCompileError(f"Unknown effect {name!r}")
+    params = pattern.get("params", {})
+    if not isinstance(params, dict):
+        raise PatternCompileError("params must be an object")
+
+    available = dict.fromkeys(available_ips)
+    lights = pattern.get("lights", "all")
+    if lights == "all":
+        lights, missing = tuple(available), ()
+    elif isinstance(lights, list) and all(isinstance(ip, str) for ip in lights):
+        missing = tuple(ip for ip in lights if ip not in available)
+        lights = tuple(ip for ip in lights if ip in available)
+    else:
+        raise PatternCompileError(f"Unsupported lights {lights!r}")
+    if not lights:
+        raise PatternCompileError("None of the pattern's lights are available")
+
+    steps = GeneratedSteps(effect, lights, params, available)
+    try:
+        first = next(iter(steps), None)
+    except TypeError as e:  # Raised when the effect is called with parameters it doesn't take
+        raise PatternCompileError(f"Effect {name!r}: {e}") from e
+    if first is None:
+        raise PatternCompileError(f"Effect {name!r} produced no steps")
+    return GeneratedTimeline(pattern.get("name", "Unnamed Pattern"), steps, missing)
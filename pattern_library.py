@@ -0,0 +1,290 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import pattern_binary
+
+
+log = logging.getLogger(__name__)
+
+
+HEADER_KEYS = ("name", "description")
+HEADER_CHUNK = 4096  # Bytes read at a time while looking for the header
+MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes of pattern files whose full contents stay loaded
+
+
+def read_header(path, chunk_size=HEADER_CHUNK):
+    """
+    Return {"name": ..., "description": ...} of a pattern file without parsing its steps.
+
+    The top-level object is decoded one member at a time and reading stops as soon as both
+    keys were found or the first other member (normally "steps") starts. Files that don't put
+    the header first, like ones that were written by hand, are parsed in full instead. Raises
+    ValueError (json.JSONDecodeError) if the file is not a JSON object, the header is malformed
+    or the file ends before the object is closed, and ValueError if the name or description is
+    not a string; a file cut off in its steps is only caught when the pattern is loaded.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8-sig") as f:
+        text = f.read(chunk_size)
+        eof = len(text) < chunk_size
+
+        def decode(pos):
+            # Decode one value at pos, reading more of the file if it is cut off
+            nonlocal text, eof
+            while True:
+                try:
+                    value, end = decoder.raw_decode(text, pos)
+                    if end < len(text) or eof:  # A number at the very end may continue
+                        return value, end
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                more = f.read(chunk_size)
+                eof = len(more) < chunk_size
+                text += more
+
+        def skip_space(pos):
+            nonlocal text, eof
+            while True:
+                while pos < len(text) and text[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(text) or eof:
+                    return pos
+                more = f.read(chunk_size)
+                eof = len(more) < chunk_size
+                text += more
+
+        pos = skip_space(0)
+        if text[pos:pos + 1] != "{":
+            raise json.JSONDecodeError("Expecting a pattern object", text, pos)
+        header = {}
+        pos = skip_space(pos + 1)
+        while text[pos:pos + 1] != "}":
+            if text[pos:pos + 1] != '"':  # Also where the file ends inside the object
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, pos)
+            key, pos = decode(pos)
+            pos = skip_space(pos)
+            if text[pos:pos + 1] != ":":
+                raise json.JSONDecodeError("Expecting ':' delimiter", text, pos)
+            pos = skip_space(pos + 1)
+            if key not in HEADER_KEYS:
+                break  # The steps, the header (if any) may still follow them
+            value, pos = decode(pos)
+            header[key] = _header_value(key, value)
+            pos = skip_space(pos)
+            if text[pos:pos + 1] == "}":
+                return header  # The whole object was read
+            if text[pos:pos + 1] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, pos)
+            pos = skip_space(pos + 1)
+            if text[pos:pos + 1] != '"':
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, pos)
+            if len(header) == len(HEADER_KEYS):
+                return header
+        else:
+            return header  # The object is empty
+
+    with open(path, encoding="utf-8-sig") as f:
+        pattern = json.load(f)
+    if not isinstance(pattern, dict):
+        raise json.JSONDecodeError("Expecting a pattern object", "", 0)
+    return {key: _header_value(key, pattern[key]) for key in HEADER_KEYS if key in pattern}
+
+
+def _header_value(key, value):
+    if not isinstance(value, str):
+        raise ValueError(f"The pattern's {key} must be a string, not {value!r}")
+    return value
+
+
+class PatternEntry:
+    """One pattern file in the library, with just the header needed to list it."""
+
+    __slots__ = ("path", "mtime", "size", "header")
+
+    def __init__(self, path, mtime, size, header):
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.header = header
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+    @property
+    def name(self):
+        return self.header.get("name", "Unnamed Pattern")
+
+    @property
+    def description(self):
+        return self.header.get("description", "No description available.")
+
+
+class PatternLibrary:
+    """
+    Pattern files of one directory, keyed by path.
+
+    Each file is remembered with its mtime and size, so reload() only reads files that were
+    added or changed since the last reload and an unchanged directory costs a single stat
+    pass. Listing only needs the name and description of a pattern, so reload() reads just
+    that header; pattern() loads the full pattern when it is run or edited and keeps recently
+    used ones while their file sizes add up to less than memory_budget bytes.
+    """
+
+    def __init__(self, directory, extensions=(".json", pattern_binary.EXTENSION), memory_budget=MEMORY_BUDGET):
+        self.directory = directory
+        self.extensions = extensions
+        self.memory_budget = memory_budget
+        self._entries = {}  # path -> PatternEntry
+        self._loaded = OrderedDict()  # path -> full pattern, least recently used first
+        self._loaded_size = 0
+        self._lock = threading.Lock()  # pattern() may be called from a worker thread
+
+    def reload(self):
+        """
+        Bring the library in line with the directory.
+
+        Returns (added, changed, removed) lists of paths. Files that can't be read are
+        reported and left out, as if they were not there. Raises FileNotFoundError (and
+        forgets every pattern) if the directory does not exist.
+        """
+        added, changed = [], []
+        seen = set()
+        try:
+            it = os.scandir(self.directory)
+        except FileNotFoundError:
+            self._entries.clear()
+            self.unload()
+            raise
+        with it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith(self.extensions) or not dir_entry.is_file():
+                    continue
+                path = dir_entry.path
+                stat = dir_entry.stat()
+                entry = self._entries.get(path)
+                if entry is not None and entry.mtime == stat.st_mtime_ns and entry.size == stat.st_size:
+                    seen.add(path)
+                    continue
+
+                self.unload(path)  # Whatever was loaded is out of date
+                header = self.parse_header(path)
+                if header is None:
+                    continue  # Treated as removed below if it was listed before
+                seen.add(path)
+                (added if entry is None else changed).append(path)
+                self._entries[path] = PatternEntry(path, stat.st_mtime_ns, stat.st_size, header)
+
+        removed = [path for path in self._entries if path not in seen]
+        for path in removed:
+            self.unload(path)
+            del self._entries[path]
+        return sorted(added, key=os.path.basename), changed, removed
+
+    def parse_header(self, path):
+        """Read the header of one pattern file, returning None (after reporting why) if it can't be used."""
+        try:
+            if path.endswith(pattern_binary.EXTENSION):
+                binary = pattern_binary.BinaryPattern(path)
+                binary.close()
+                return binary.header
+            return read_header(path)
+        except ValueError as e:  # Also JSONDecodeError and PatternFormatError
+            log.error("Error loading %s: %s", os.path.basename(path), e)
+        except Exception as e:
+            log.error("Unexpected error with %s: %s", os.path.basename(path), e)
+        return None
+
+    def parse(self, path):
+        """
+        Parse one pattern file in full, returning None (after reporting why) if it can't be used.
+
+        Binary patterns are memory-mapped rather than parsed; their steps are read while they play.
+        """
+        try:
+            if path.endswith(pattern_binary.EXTENSION):
+                return pattern_binary.BinaryPattern(path)
+            with open(path, encoding="utf-8-sig") as f:
+                pattern = json.load(f)
+        except (json.JSONDecodeError, pattern_binary.PatternFormatError) as e:
+            log.error("Error loading %s: %s", os.path.basename(path), e)
+            return None
+        except Exception as e:
+            log.error("Unexpected error with %s: %s", os.path.basename(path), e)
+            return None
+        if not isinstance(pattern, dict):
+            log.error("Error loading %s: not a pattern", os.path.basename(path))
+            return None
+        return pattern
+
+    def get(self, path):
+        return self._entries.get(path)
+
+    def pattern(self, path):
+        """
+        Return the full pattern of a file, loading it if needed, or None if it is not in the
+        library or can't be parsed.
+        """
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        with self._lock:
+            pattern = self._loaded.get(path)
+            if pattern is not None:
+                self._loaded.move_to_end(path)
+                return pattern
+
+            pattern = self.parse(path)
+            if pattern is None:
+                return None
+            self._loaded[path] = pattern
+            self._loaded_size += self._cost(entry)
+            # Evict the least recently used patterns, but always keep the one just loaded
+            while self._loaded_size > self.memory_budget and len(self._loaded) > 1:
+                self._evict(next(iter(self._loaded)))
+            return pattern
+
+    def unload(self, path=None):
+        """
+        Drop the loaded steps of one pattern (or of every pattern); its header stays listed.
+
+        Binary patterns are closed, which releases their file (Windows can't replace a file
+        that is mapped) and stops a run that is still playing them.
+        """
+        with self._lock:
+            if path is None:
+                for loaded in list(self._loaded):
+                    self._evict(loaded)
+                self._loaded_size = 0
+            elif path in self._loaded:
+                self._evict(path)
+
+    def _evict(self, path):
+        pattern = self._loaded.pop(path)
+        if isinstance(pattern, pattern_binary.BinaryPattern):
+            pattern.close()
+        entry = self._entries.get(path)
+        self._loaded_size = max(0, self._loaded_size - (self._cost(entry) if entry is not None else 0))
+
+    def _cost(self, entry):
+        # Binary patterns count too: their mapping holds the file open until they are evicted
+        return entry.size
+
+    @property
+    def loaded_size(self):
+        """Bytes of pattern files whose full contents are currently loaded."""
+        return self._loaded_size
+
+    def paths(self):
+        """Return the paths of every pattern, sorted by file name."""
+        return sorted(self._entries, key=os.path.basename)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+from metrics import get_registry
+from wiz_transport import encode_pilot
+
+
+# What to do with a step whose deadline has already passed when the runner gets to it
+CATCH_UP = "catch_up"  # Fire it right away and keep the original schedule
+SKIP = "skip"  # Drop it if the next step is due as well
+STRETCH = "stretch"  # Fire it right away and shift the rest of the schedule back
+LATE_POLICIES = (CATCH_UP, SKIP, STRETCH)
+
+LATE_THRESHOLD = 0.005  # Seconds a step may fire after its deadline before it counts as late
+EARLY_TOLERANCE = 0.001  # Event loop timers may wake up this much early without sleeping again
+IDLE_CYCLE = 0.05  # Pause after a cycle that takes no time, so it can't starve the loop
+RESYNC_LATENESS = 5.0  # Seconds behind after which a timeline of unknown length starts over
+FULL_REFRESH_INTERVAL = 30  # Seconds between full pattern commands to every light (0 = never)
+
+# Dispatcher keys for pattern commands: a full setPilot, or only the part of it that changed
+PILOT_KEY = "pilot"
+PILOT_COLOR_KEY = "pilot_color"
+PILOT_DIMMING_KEY = "pilot_dimming"
+PILOT_KEYS = (PILOT_KEY, PILOT_COLOR_KEY, PILOT_DIMMING_KEY)
+
+
+class RunStats:
+    """Counters for one pattern run."""
+
+    def __init__(self):
+        self.cycles = 0
+        self.steps_fired = 0
+        self.steps_skipped = 0
+        self.late_steps = 0
+        self.total_lateness = 0.0  # Seconds, summed over the late steps
+        self.max_lateness = 0.0
+        self.resyncs = 0  # Times the schedule was restarted after falling a whole cycle behind
+
+    def record_lateness(self, lateness):
+        self.late_steps += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def summary(self):
+        mean = self.total_lateness / self.late_steps if self.late_steps else 0.0
+        return (
+            f"{self.cycles} cycles, {self.steps_fired} steps fired, {self.steps_skipped} skipped, "
+            f"{self.late_steps} late (mean {mean * 1000:.1f} ms, max {self.max_lateness * 1000:.1f} ms)"
+        )
+
+
+class PatternRunner:
+    """
+    Plays a PatternTimeline against a monotonic clock.
+
+    Each step is fired at its planned deadline (cycle start + step offset) through fire(step),
+    which must not block: the runner never waits for lights to answer, so network time doesn't
+    add to the step durations and the pattern doesn't drift. Steps that are late are handled
+    according to the late-step policy.
+    """
+
+    def __init__(self, timeline, fire, policy=CATCH_UP, clock=time.monotonic, late_threshold=LATE_THRESHOLD):
+        if policy not in LATE_POLICIES:
+            raise ValueError(f"Unknown late-step policy: {policy}")
+        self.timeline = timeline
+        self.fire = fire
+        self.policy = policy
+        self.clock = clock
+        self.late_threshold = late_threshold
+        self.stats = RunStats()
+        self.metrics = get_registry()
+
+    async def sleep_until(self, deadline):
+        """Sleep until the clock reaches deadline, even if the loop's timers wake up early."""
+        remaining = deadline - self.clock()
+        while remaining > EARLY_TOLERANCE:
+            await asyncio.sleep(remaining)
+            remaining = deadline - self.clock()
+
+    async def run(self, refresh=None, cycles=None):
+        """
+        Play the timeline in a loop until cancelled (or for `cycles` cycles).
+
+        refresh() is called at the start of every cycle and may return a new timeline
+        (e.g. after the set of lights changed) or None to keep the current one. The steps
+        are only iterated, one step ahead, so generated timelines are pulled lazily.
+        """
+        stats = self.stats
+        metrics = self.metrics
+        cycle_start = self.clock()
+        while cycles is None or stats.cycles < cycles:
+            if refresh is not None:
+                self.timeline = refresh() or self.timeline
+            # Generated timelines don't know their length, fall back to a fixed resync threshold
+            resync_after = self.timeline.cycle_duration or RESYNC_LATENESS
+            cycle_end = 0.0
+
+            steps = iter(self.timeline.steps)
+            step = next(steps, None)
+            while step is not None:
+                following = next(steps, None)  # Lookahead of one step
+                cycle_end = step.offset + step.duration
+                deadline = cycle_start + step.offset
+                now = self.clock()
+                lateness = now - deadline
+
+                if lateness <= 0:
+                    await self.sleep_until(deadline)
+                elif lateness > self.late_threshold:
+                    stats.record_lateness(lateness)
+                    if lateness > resync_after:
+                        # A whole cycle behind (e.g. the machine was suspended), start over from now
+                        stats.resyncs += 1
+                        cycle_start = now - step.offset
+                    elif self.policy == SKIP:
+                        next_offset = following.offset if following is not None else cycle_end
+                        if now >= cycle_start + next_offset:
+                            stats.steps_skipped += 1
+                            metrics.count("pattern.steps_skipped")
+                            step = following
+                            continue
+                    elif self.policy == STRETCH:
+                        cycle_start += lateness
+
+                # How late the step really starts (after the sleep), 0 if on time
+                metrics.observe("pattern.step_lateness", max(0.0, self.clock() - (cycle_start + step.offset)))
+                self.fire(step)
+                stats.steps_fired += 1
+                step = following
+                if lateness > 0:
+                    # Behind schedule nothing above awaited, let the loop run (GUI, answers, cancellation)
+                    await asyncio.sleep(0)
+
+            cycle_start += cycle_end
+            stats.cycles += 1
+            if cycle_end <= 0:
+                await asyncio.sleep(IDLE_CYCLE)
+                cycle_start = self.clock()
+
+
+class PilotTracker:
+    """
+    Remembers what the pattern last commanded each light, so a step only sends what changes.
+
+    A step that would leave a light as it is sends nothing, and a step that only changes the
+    color or only the brightness of a light that is on sends just that. Every
+    refresh_interval seconds the tracked states are forgotten, so the next steps send full
+    commands and lights that missed a packet (or were power cycled) catch up.
+    """
+
+    def __init__(self, refresh_interval=FULL_REFRESH_INTERVAL, clock=time.monotonic):
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._states = {}  # ip -> (on, rgb, brightness) last commanded
+        self._next_refresh = clock() + refresh_interval if refresh_interval else None
+        self.full = 0
+        self.partial = 0
+        self.suppressed = 0
+
+    def plan(self, ip, step):
+        """Return the (key, payload) to send for step to one light, or None if nothing changes."""
+        if self._next_refresh is not None and self.clock() >= self._next_refresh:
+            self._states.clear()
+            self._next_refresh = self.clock() + self.refresh_interval
+
+        target = (True, step.rgb, step.brightness) if step.action == "set_color" else (False, None, None)
+        last = self._states.get(ip)
+        self._states[ip] = target
+        if last == target:
+            self.suppressed += 1
+            return None
+        if last is not None and last[0] and target[0]:
+            if last[1] == target[1]:
+                self.partial += 1
+                return PILOT_DIMMING_KEY, encode_pilot(brightness=target[2], state=None)
+            if last[2] == target[2]:
+                self.partial += 1
+                return PILOT_COLOR_KEY, encode_pilot(rgb=target[1], state=None)
+        self.full += 1
+        return PILOT_KEY, step.payload
+
+    def forget(self, ip):
+        """Drop what we know about a light (e.g. it missed a command), so it gets a full one next."""
+        self._states.pop(ip, None)
+
+    def summary(self):
+        return f"{self.full} full, {self.partial} partial, {self.suppressed} suppressed commands"
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+from collections import deque
+
+import pattern_binary
+from pattern_runner import FULL_REFRESH_INTERVAL, PilotTracker
+from pattern_timeline import compile_pattern
+from rate_limit import DEFAULT_RATE
+
+
+BULB_RATE_LIMIT = DEFAULT_RATE  # Commands per second a bulb takes before it starts dropping UDP packets
+PEAK_WINDOW = 1.0  # Seconds over which the commands to a bulb are counted
+MAX_STEPS = 200000  # Most steps simulate() plays, so generated patterns that never end still finish
+PREFLIGHT_STEPS = 5000  # Steps checked before a pattern starts
+PREFLIGHT_COMMANDS = 5000  # Step x light commands planned before a pattern starts; keeps the check to milliseconds
+PREFLIGHT_SECONDS = 10.0  # Pattern time checked before a pattern starts
+PREFLIGHT_CYCLES = 2  # So a burst where the pattern wraps around is seen too
+
+
+class SimulationReport:
+    """What a simulated pattern run would send to each light."""
+
+    def __init__(self, name, schedule, cycle_duration, missing, steps, cycles, truncated, window=PEAK_WINDOW):
+        self.name = name
+        self.schedule = schedule  # ip -> [(seconds, dispatcher key, payload), ...] in send order
+        self.cycle_duration = cycle_duration  # Seconds, as played (also for generated patterns)
+        self.missing = tuple(missing)
+        self.steps = steps  # Steps played
+        self.cycles = cycles  # Cycles played in full
+        self.truncated = truncated  # True if the run stopped at the step or time limit
+        self.window = window
+        self.peaks = {ip: peak_rate(commands, window) for ip, commands in schedule.items()}
+
+    @property
+    def commands(self):
+        return sum(len(commands) for commands in self.schedule.values())
+
+    def peak(self, ip):
+        """Return the highest commands per second sent to a light."""
+        return self.peaks.get(ip, (0.0, 0.0))[0]
+
+    def overloaded(self, limit=BULB_RATE_LIMIT):
+        """Return {ip: peak commands/sec} of the lights the pattern would send more than limit commands/sec."""
+        return {ip: rate for ip, (rate, _) in self.peaks.items() if rate > limit}
+
+    def summary(self, limit=BULB_RATE_LIMIT):
+        """Return a readable multi-line report."""
+        if self.cycle_duration is None:
+            duration = "unknown (did not finish a cycle)"
+        else:
+            duration = f"{self.cycle_duration:.3f} s"
+        lines = [
+            f"Pattern: {self.name}",
+            f"Cycle duration: {duration}",
+            f"Simulated: {self.steps} steps, {self.cycles} cycles, {self.commands} commands"
+            + (" (stopped at the limit)" if self.truncated else ""),
+        ]
+        if self.missing:
+            lines.append(f"Lights not present: {', '.join(self.missing)}")
+        lines.append(f"Peak commands/sec per light (limit {limit:g}):")
+        for ip in sorted(self.peaks, key=lambda ip: -self.peaks[ip][0]):
+            rate, start = self.peaks[ip]
+            flag = "  OVERLOADED" if rate > limit else ""
+            lines.append(f"  {ip:<16} {rate:6.1f} at {start:.3f} s, {len(self.schedule[ip])} commands{flag}")
+        return "\n".join(lines)
+
+
+def peak_rate(commands, window=PEAK_WINDOW):
+    """Return (commands per second, start time) of the busiest window of a light's schedule."""
+    best, best_start = 0, 0.0
+    recent = deque()
+    for time, _, _ in commands:
+        recent.append(time)
+        while recent[0] <= time - window:
+            recent.popleft()
+        if len(recent) > best:
+            best, best_start = len(recent), recent[0]
+    return best / window, best_start
+
+
+def simulate(timeline, cycles=1, max_steps=MAX_STEPS, until=None, refresh_interval=FULL_REFRESH_INTERVAL, window=PEAK_WINDOW,
+             max_commands=None):
+    """
+    Play a compiled timeline at full speed and return a SimulationReport.
+
+    Every step fires exactly at its deadline and goes through a PilotTracker the way
+    LightApp.fireStep sends it, so the schedule holds the commands the lights would really
+    get, and steps that change nothing are left out. Stops after `cycles` cycles,
+    max_steps steps, max_commands commands planned (one per step and light it targets) or
+    at `until` seconds into the pattern, whichever comes first.
+    """
+    now = 0.0
+    tracker = PilotTracker(refresh_interval, clock=lambda: now)
+    schedule = {}
+    played = 0
+    planned = 0
+    finished = 0
+    cycle_duration = timeline.cycle_duration
+    cycle_start = 0.0
+    truncated = False
+
+    while finished < cycles and not truncated:
+        cycle_end = 0.0
+        for step in timeline.steps:
+            now = cycle_start + step.offset
+            planned += len(step.targets)
+            if played >= max_steps or (until is not None and now >= until) or (
+                    max_commands is not None and played and planned > max_commands):
+                truncated = True
+                break
+            for ip in step.targets:
+                command = tracker.plan(ip, step)
+                if command is not None:
+                    schedule.setdefault(ip, []).append((now, command[0], command[1]))
+            cycle_end = step.offset + step.duration
+            played += 1
+        else:
+            finished += 1
+            if cycle_duration is None:
+                cycle_duration = cycle_end  # Generated patterns only know their length once played
+            if cycle_end <= 0:
+                break  # Repeating a cycle that takes no time changes nothing
+        cycle_start += cycle_end
+
+    return SimulationReport(timeline.name, schedule, cycle_duration, timeline.missing, played, finished, truncated, window)
+
+
+def referenced_lights(pattern):
+    """Return the IPs a pattern names, in the order they first appear (without "all")."""
+    if isinstance(pattern, pattern_binary.BinaryPattern):
+        targets = pattern.targets
+    elif "effect" in pattern:
+        targets = [pattern.get("lights", [])]
+    else:
+        targets = [step.get("light_ip") for step in pattern.get("steps", []) if isinstance(step, dict)]
+    ips = {}
+    for light_ip in targets:
+        for ip in light_ip if isinstance(light_ip, list) else [light_ip]:
+            if isinstance(ip, str) and ip != "all":
+                ips[ip] = None
+    return list(ips)
+
+
+def load(path):
+    """Return the pattern stored in a .json or .wizp file."""
+    if path.endswith(pattern_binary.EXTENSION):
+        return pattern_binary.BinaryPattern(path)
+    with open(path, encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a pattern at full speed and report the load on each bulb.")
+    parser.add_argument("pattern", help="pattern file (.json or .wizp)")
+    parser.add_argument("lights", nargs="*", help="IPs of the lights that are present (default: every light the pattern names)")
+    parser.add_argument("--cycles", type=int, default=1, help="cycles to simulate (default 1)")
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS, help=f"stop after this many steps (default {MAX_STEPS})")
+    parser.add_argument("--until", type=float, help="stop this many seconds into the pattern")
+    parser.add_argument("--limit", type=float, default=BULB_RATE_LIMIT, help=f"commands/sec a bulb can take (default {BULB_RATE_LIMIT:g})")
+    parser.add_argument("--schedule", action="store_true", help="also print every command sent to each light")
+    args = parser.parse_args(argv)
+
+    try:
+        pattern = load(args.pattern)
+        lights = args.lights or referenced_lights(pattern)
+        report = simulate(compile_pattern(pattern, lights), cycles=args.cycles, max_steps=args.max_steps, until=args.until)
+    except (OSError, ValueError) as e:  # Includes PatternCompileError and broken files
+        print(f"Could not simulate {os.path.basename(args.pattern)}: {e}")
+        return 1
+
+    print(report.summary(args.limit))
+    if args.schedule:
+        for ip, commands in report.schedule.items():
+            print(f"\n{ip}:")
+            for time, key, payload in commands:
+                print(f"  {time:10.3f}  {key:<14} {payload.decode()}")
+    return 2 if report.overloaded(args.limit) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,131 @@
+from collections import namedtuple
+
+from wiz_transport import encode_pilot
+
+
+ACTIONS = ("set_color", "turn_off")
+
+
+class PatternCompileError(ValueError):
+    """Raised when a pattern contains a step that can't be run."""
+
+
+# One compiled step. offset and duration are in seconds, targets is a tuple of light IPs and
+# payload holds the setPilot bytes that are sent to every target.
+TimelineStep = namedtuple("TimelineStep", "index offset duration targets action rgb brightness payload")
+
+
+class PatternTimeline:
+    """
+    A pattern compiled once into immutable steps with absolute offsets, resolved target
+    IPs and pre-encoded payloads, so running it doesn't re-interpret the pattern JSON.
+    """
+
+    def __init__(self, name, steps, missing):
+        self.name = name
+        self.steps = tuple(steps)
+        self.missing = tuple(missing)  # IPs referenced by the pattern but not present
+        last = self.steps[-1] if self.steps else None
+        self.cycle_duration = last.offset + last.duration if last else 0.0
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+
+def normalize_color(color):
+    """
+    Return a step color as an (r, g, b) tuple of ints.
+
+    Accepts both {"r": .., "g": .., "b": ..} dicts and [r, g, b] lists; raises ValueError otherwise.
+    """
+    if isinstance(color, dict):
+        rgb = (color["r"], color["g"], color["b"])
+    elif isinstance(color, (list, tuple)) and len(color) >= 3:
+        rgb = tuple(color[:3])
+    else:
+        raise ValueError(f"unsupported color {color!r}")
+    rgb = tuple(int(value) for value in rgb)
+    if not all(0 <= value <= 255 for value in rgb):
+        raise ValueError(f"color {color!r} is out of range")
+    return rgb
+
+
+def resolve_targets(light_ip, available):
+    """
+    Return (targets, missing) for a step's light_ip ("all", one IP or a list of IPs).
+
+    available is an ordered collection of the IPs of the lights that are present.
+    """
+    if light_ip == "all":
+        return tuple(available), ()
+    if isinstance(light_ip, str):
+        light_ip = [light_ip]
+    elif not isinstance(light_ip, (list, tuple)) or not all(isinstance(ip, str) for ip in light_ip):
+        raise ValueError(f"unsupported light_ip {light_ip!r}")
+    targets = tuple(dict.fromkeys(ip for ip in light_ip if ip in available))
+    missing = tuple(ip for ip in light_ip if ip not in available)
+    return targets, missing
+
+
+def compile_step(index, step, offset, available):
+    """Compile one raw pattern step; returns (TimelineStep, missing IPs)."""
+    if not isinstance(step, dict):
+        raise PatternCompileError(f"Step {index + 1}: expected an object, got {step!r}")
+    try:
+        action = step.get("action")
+        if action not in ACTIONS:
+            raise ValueError(f"unknown action {action!r}")
+        duration = step.get("duration", 0)
+        if isinstance(duration, bool) or not isinstance(duration, (int, float)):
+            raise ValueError(f"unsupported duration {duration!r}")
+        duration = max(0, duration) / 1000  # Convert milliseconds to seconds
+
+        targets, missing = resolve_targets(step.get("light_ip"), available)
+
+        rgb = brightness = None
+        if action == "set_color":
+            rgb = normalize_color(step.get("color", [255, 255, 255]))
+            brightness = step.get("brightness", 255)
+            if isinstance(brightness, bool) or not isinstance(brightness, (int, float)) or not 0 <= brightness <= 255:
+                raise ValueError(f"unsupported brightness {brightness!r}")
+            brightness = int(brightness)
+            payload = encode_pilot(rgb=rgb, brightness=brightness)
+        else:
+            payload = encode_pilot(state=False)
+    except (KeyError, TypeError, ValueError) as e:
+        raise PatternCompileError(f"Step {index + 1}: {e}") from e
+
+    return TimelineStep(index, offset, duration, targets, action, rgb, brightness, payload), missing
+
+
+def compile_pattern(pattern, available_ips):
+    """
+    Compile a pattern dict into a PatternTimeline for the lights in available_ips.
+
+    Raises PatternCompileError for malformed patterns, so problems show up before the
+    pattern starts rather than in the middle of a show. Binary patterns (anything with a
+    timeline() method) provide their own, streamed timeline, and procedural patterns (with
+    an "effect") get a generated one.
+    """
+    if hasattr(pattern, "timeline"):
+        return pattern.timeline(available_ips)
+    if isinstance(pattern, dict) and "effect" in pattern:
+        from pattern_effects import compile_effect  # pattern_effects builds on this module
+        return compile_effect(pattern, available_ips)
+    steps = pattern.get("steps") if isinstance(pattern, dict) else None
+    if not isinstance(steps, list) or not steps:
+        raise PatternCompileError("Pattern has no steps")
+
+    available = dict.fromkeys(available_ips)  # Ordered, with O(1) membership
+    compiled = []
+    missing = {}
+    elapsed = 0  # Milliseconds, summed exactly so long patterns don't pick up rounding errors
+    for index, step in enumerate(steps):
+        timeline_step, step_missing = compile_step(index, step, elapsed / 1000, available)
+        compiled.append(timeline_step)
+        missing.update(dict.fromkeys(step_missing))
+        elapsed += max(0, step.get("duration", 0))
+    return PatternTimeline(pattern.get("name", "Unnamed Pattern"), compiled, missing)
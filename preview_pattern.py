@@ -1,12 +1,19 @@
 import sys
 import os
+import time
+import logging
 from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, 
-                             QHBoxLayout, QPushButton, QFrame, QListWidget, 
-                             QListWidgetItem, QAbstractItemView, QGraphicsView, 
+                             QHBoxLayout, QPushButton, QAbstractItemView, QGraphicsView, 
                              QGraphicsScene, QGraphicsEllipseItem, QGraphicsTextItem, QGraphicsRectItem)
-from PyQt5.QtGui import QBrush, QColor, QFont, QPalette, QPainter, QPen, QIcon
+from PyQt5.QtGui import QBrush, QColor, QFont, QPainter, QPen, QIcon
 from PyQt5.QtCore import Qt, QTimer
 
+from step_list_view import StepListModel, StepListView, step_rgb
+
+
+log = logging.getLogger(__name__)
+
+
 def load_icon():
     """
     Load the program's icon dynamically, considering both development and packaged environments.
@@ -17,13 +24,14 @@ def load_icon():
         base_path = os.path.abspath(".")
 
     icon_path = os.path.join(base_path, 'icon', 'pattern.ico')
-    print(f"Trying to load icon from: {icon_path}")  # Debug statement
+    log.debug("Trying to load icon from: %s", icon_path)
 
     return QIcon(icon_path)
 
 class LightIcon(QGraphicsEllipseItem):
     def __init__(self, light_name, color=(128, 128, 128)):
         super().__init__(0, 0, 50, 50)  # Initialize as a 50x50 ellipse
+        self.color = tuple(color)
         self.setBrush(QBrush(QColor(*color)))  # Set the icon's color
         self.setFlag(QGraphicsEllipseItem.ItemIsMovable)  # Make it movable
 
@@ -50,6 +58,10 @@ class LightIcon(QGraphicsEllipseItem):
 
 
     def set_color(self, color):
+        color = tuple(color)
+        if color == self.color:
+            return  # Unchanged, don't make the scene repaint the icon
+        self.color = color
         if len(color) == 4:  # RGBA color
             self.setBrush(QBrush(QColor(color[0], color[1], color[2], color[3])))
         elif len(color) == 3:  # RGB color without alpha
@@ -61,13 +73,18 @@ class LightIcon(QGraphicsEllipseItem):
 class PatternPreview(QWidget):
     def __init__(self, lights, pattern_steps, pattern_name="Pattern"):
         super().__init__()
-        print(f"Pattern Name: {pattern_name}")  # Debugging print statement
+        log.debug("Pattern Name: %s", pattern_name)
         self.lights = lights
         self.pattern_steps = pattern_steps
         self.pattern_name = pattern_name  # Store the pattern name
         self.current_step = 0
         self.is_playing = False  # Track if the preview is playing
+        self.next_deadline = None  # time.monotonic() at which the next step is due while playing
+        self.frames_behind = 0  # Steps that were due but never shown because playback fell behind
         self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.update_pattern_step)
         self.setWindowIcon(load_icon())  # Load the icon dynamically
 
         # Check if the entire pattern uses "all"
@@ -114,12 +131,14 @@ class PatternPreview(QWidget):
         # Right side for steps display and controls
         right_layout = QVBoxLayout()
 
-        # Step list display
-        self.stepsList = QListWidget()
-        self.stepsList.setSelectionMode(QAbstractItemView.SingleSelection)
-        self.stepsList.currentRowChanged.connect(self.update_preview_from_selection)  # Connect row change
+        # Step list display, the same model/view list as the editor; playback only moves the highlight
+        self.stepsModel = StepListModel(self.pattern_steps, self)
+        self.stepsList = StepListView(self.stepsModel)
+        self.stepsList.setDragDropMode(QAbstractItemView.NoDragDrop)
+        self.stepsList.selectionModel().currentRowChanged.connect(
+            lambda current, previous: self.update_preview_from_selection(current.row())
+        )
         right_layout.addWidget(self.stepsList)
-        self.update_steps_display()
 
         # Step number display
         self.step_number_label = QLabel(f"Step {self.current_step + 1}", self)  # Display step number (1-based)
@@ -156,173 +175,95 @@ class PatternPreview(QWidget):
         """Apply the main program theme to the preview."""
         self.setPalette(palette)
 
-        # Apply theme colors to stepsList
+        # Apply theme colors to stepsList, its delegate paints with the palette
         self.stepsList.setPalette(palette)
-        self.update_steps_display()
 
     def update_steps_display(self):
-        self.stepsList.clear()
-        palette = self.stepsList.palette()
-
-        # Retrieve theme colors
-        background_color = palette.color(QPalette.Base).name()
-        alternate_background_color = palette.color(QPalette.AlternateBase).name()
-        text_color = palette.color(QPalette.Text).name()
-        selection_color = palette.color(QPalette.Highlight).name()
-        selection_text_color = palette.color(QPalette.HighlightedText).name()
-
-        for index, step in enumerate(self.pattern_steps):
-            # Configure light, action, color, and other information
-            light_info = step.get("light_ip", "Unknown Light")
-            action = step.get("action", "Unknown Action")
-            color = step.get("color", [255, 255, 255])
-            brightness = step.get("brightness", 255)
-            duration = step.get("duration", 0)
-            
-            # Format color information
-            color_rgb = f"rgb({color[0]}, {color[1]}, {color[2]})" if isinstance(color, list) else "rgb(255, 255, 255)"
-            color_text = f"({color[0]}, {color[1]}, {color[2]})" if isinstance(color, list) else "(255, 255, 255)"
-
-            step_text = f"Light: <b>{light_info}</b>, Action: <b>{action}</b>, Color: <b>{color_text}</b>, Brightness: <b>{brightness}</b>, Duration: <b>{duration}ms</b>"
-            
-            # Create QWidget and layout for displaying step
-            item_widget = QWidget()
-            item_layout = QHBoxLayout(item_widget)
-
-            # Step number label
-            step_number_label = QLabel(f"{index + 1}")
-            step_number_label.setFont(QFont("Arial", 10, QFont.Bold))
-            item_layout.addWidget(step_number_label)
-
-            # Color indicator
-            color_indicator = QLabel()
-            color_indicator.setFixedSize(20, 20)
-            color_indicator.setStyleSheet(f"background-color: {color_rgb}; border-radius: 10px;")
-            item_layout.addWidget(color_indicator)
-
-            # Step text label
-            item_label = QLabel(step_text)
-            item_label.setTextFormat(Qt.RichText)
-            item_label.setStyleSheet(f"color: {text_color};")
-            item_layout.addWidget(item_label)
-            item_layout.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-
-            # Alternate background color
-            background = background_color if index % 2 == 0 else alternate_background_color
-            item_widget.setStyleSheet(f"background-color: {background}; color: {text_color};")
-            
-            # Add widget to stepsList
-            item = QListWidgetItem(self.stepsList)
-            item.setSizeHint(item_widget.sizeHint())
-            self.stepsList.addItem(item)
-            self.stepsList.setItemWidget(item, item_widget)
-
-            # Store step data for further use
-            item.setData(Qt.UserRole, step)
-
-        # Ensure consistent selection and hover styling
-        self.stepsList.setSelectionMode(QAbstractItemView.SingleSelection)
-        self.stepsList.setStyleSheet(f"""
-            QListWidget::item {{
-                padding: 5px;
-                border: none;
-            }}
-            QListWidget::item:selected {{
-                background-color: {selection_color};
-                color: {selection_text_color};
-            }}
-            QListWidget::item:hover {{
-                background-color: {selection_color};
-                color: {selection_text_color};
-            }}
-        """)
-
-
-
-
+        """Show self.pattern_steps after it was replaced."""
+        self.stepsModel.set_steps(self.pattern_steps)
 
     def update_preview_from_selection(self, row):
         """Update preview to start from the selected step."""
         if row >= 0 and row < len(self.pattern_steps):
             self.current_step = row
             if self.is_playing:  # If playing, continue from the current step
+                self.next_deadline = None
                 self.update_pattern_step()
 
-    def update_pattern_step(self):
-        """Update the current step and display the changes."""
-        # Stop the timer to prevent overlap
-        if self.timer.isActive():
-            print(f"Stopping timer at step {self.current_step}")
-            self.timer.stop()
-
-        # Get the current step data
-        if self.current_step < len(self.pattern_steps):
-            step_data = self.pattern_steps[self.current_step]
-        else:
-            # If we've reached the end, reset to start
-            print("Resetting to start")
-            self.current_step = 0
-            step_data = self.pattern_steps[self.current_step]
-
-        # Display the current step in the GUI
-        self.stepsList.setCurrentRow(self.current_step)
-        self.step_number_label.setText(f"Step {self.current_step + 1}")
-
-        # Determine color and action for lights
-        action = step_data.get("action", "set_color")
-        if action == "turn_off":
-            rgba_color = [0, 0, 0, 0]  # Transparent
+    def step_colors(self, step_data, colors):
+        """Add the icon -> color changes of one step to colors."""
+        rgb = step_rgb(step_data)
+        if rgb is None:
+            rgba_color = (0, 0, 0, 0)  # Transparent
         else:
-            color = step_data.get("color", [255, 255, 255])
-            if isinstance(color, dict):
-                color = [color.get("r", 255), color.get("g", 255), color.get("b", 255)]
             brightness = step_data.get("brightness", 255)
-            alpha = int(brightness / 255 * 255)
-            rgba_color = color + [alpha]
+            rgba_color = tuple(rgb) + (int(brightness / 255 * 255),)
 
-        # Apply color to specified lights
         light_ip = step_data.get("light_ip")
         if light_ip == "all":
-            for icon in self.light_icons.values():
-                icon.set_color(rgba_color)
+            icons = self.light_icons.values()
         elif isinstance(light_ip, list):
-            for ip in light_ip:
-                if ip in self.light_icons:
-                    self.light_icons[ip].set_color(rgba_color)
-        elif light_ip in self.light_icons:
-            self.light_icons[light_ip].set_color(rgba_color)
-
-        print(f"Current step: {self.current_step}, Action: {action}, Duration: {step_data.get('duration', 1000)}ms")
-
-        # Ensure GUI updates are processed
-        self.repaint()
-
-        # Start the timer for the next step's duration
-        duration = step_data.get("duration", 1000)
-        self.start_timer(duration)
-
-        # Increment the current step for the next cycle
-        self.current_step += 1
-        if self.current_step >= len(self.pattern_steps):
-            print("Reached the end of steps, looping back to 0")
-            self.current_step = 0
-
-    def start_timer(self, duration):
-        """Start the timer for the current step's duration."""
-        print(f"Starting timer for step {self.current_step} with duration {duration}ms")
-        try:
-            self.timer.timeout.disconnect(self.update_pattern_step)
-        except TypeError:
-            pass
-        self.timer.timeout.connect(self.update_pattern_step)
-        self.timer.setSingleShot(True)
-        self.timer.start(duration)
+            icons = [self.light_icons[ip] for ip in light_ip if ip in self.light_icons]
+        else:
+            icons = [self.light_icons[light_ip]] if light_ip in self.light_icons else []
+        for icon in icons:
+            colors[icon] = rgba_color
+
+    def update_pattern_step(self):
+        """
+        Show the step that is due and schedule the next one.
+
+        Steps are timed against the clock rather than one after the other, so slow ticks don't
+        stretch the pattern. If more than one step is due, only the last is shown (the lights
+        end up as if every step ran) and the ones in between count as frames behind. Only the
+        highlighted row and the icons whose color changes are repainted.
+        """
+        self.timer.stop()
+        if not self.pattern_steps:
+            return
+        now = time.monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        colors = {}
+        due = 0  # Steps with a duration that were due
+        passed = 0
+        while True:
+            if self.current_step >= len(self.pattern_steps):
+                self.current_step = 0  # Loop back to the start
+            shown = self.current_step
+            step_data = self.pattern_steps[shown]
+            self.step_colors(step_data, colors)
+            duration = step_data.get("duration", 1000)
+            self.next_deadline += max(0, duration) / 1000
+            self.current_step += 1
+            passed += 1
+            if duration > 0:
+                due += 1
+            if self.next_deadline > now:
+                break
+            if passed > len(self.pattern_steps):
+                self.next_deadline = now  # A whole loop behind (e.g. the window was blocked), start over from now
+                break
+        self.frames_behind += max(0, due - 1)
+
+        self.stepsModel.set_highlight(shown)
+        for icon, rgba_color in colors.items():
+            icon.set_color(rgba_color)
+        if self.frames_behind:
+            self.step_number_label.setText(f"Step {shown + 1} ({self.frames_behind} frames behind)")
+        else:
+            self.step_number_label.setText(f"Step {shown + 1}")
+
+        # Start the timer for the next step's deadline
+        self.timer.start(max(0, round((self.next_deadline - time.monotonic()) * 1000)))
 
     def start_preview(self):
         """Start preview and play from the selected step."""
         if not self.is_playing:
             self.is_playing = True
             if not self.timer.isActive():
+                self.next_deadline = None
                 self.update_pattern_step()
 
     def pause_preview(self):
@@ -333,6 +274,10 @@ class PatternPreview(QWidget):
     def restart_preview(self):
         """Restart the preview from the first step."""
         self.current_step = 0
+        self.frames_behind = 0
+        self.next_deadline = None
+        self.stepsModel.set_highlight(-1)
+        self.step_number_label.setText("Step 1")
         if self.is_playing:
             self.update_pattern_step()
 
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# Default limit for a bulb whose model has no entry of its own
+DEFAULT_BURST = 10  # Commands a bulb may get back to back after a quiet period
+DEFAULT_RATE = 5.0  # Sustained commands per second (0 = no limit)
+RATE_LIMITS_FILE = "rate_limits.json"
+
+
+class TokenBucket:
+    """
+    Token bucket for one light: holds up to burst tokens and gains rate tokens per second.
+
+    Every command takes a token; when none is left the next command has to wait for one.
+    A rate of 0 (or less) turns the limit off.
+    """
+
+    __slots__ = ("burst", "rate", "tokens", "updated", "clock", "throttled")
+
+    def __init__(self, burst=DEFAULT_BURST, rate=DEFAULT_RATE, clock=time.monotonic):
+        self.burst = max(1, burst)
+        self.rate = rate
+        self.tokens = float(self.burst)
+        self.clock = clock
+        self.updated = clock()
+        self.throttled = 0  # Times a command had to wait for a token
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Return the seconds until a token is available (0 if one is available now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Use up a token (call after delay() returned 0)."""
+        if self.rate > 0:
+            self._refill()
+            self.tokens = max(0.0, self.tokens - 1)
+
+
+class RateLimits:
+    """
+    (burst, rate) limits by bulb model.
+
+    Models are matched by the start of their moduleName (as reported by getSystemConfig,
+    e.g. "ESP01_SHRGB1C_31"), the longest matching prefix wins; lights whose model is unknown
+    or not listed get the default. Limits can be set in rate_limits.json:
+
+        {"default": [10, 5.0], "models": {"ESP03_SHRGB3": [20, 10.0]}}
+    """
+
+    def __init__(self, default=(DEFAULT_BURST, DEFAULT_RATE), models=None):
+        self.default = tuple(default)
+        self.models = {prefix: tuple(limit) for prefix, limit in (models or {}).items()}
+
+    def for_model(self, model):
+        """Return the (burst, rate) for a moduleName (or None for an unknown model)."""
+        if model:
+            matches = [prefix for prefix in self.models if model.startswith(prefix)]
+            if matches:
+                return self.models[max(matches, key=len)]
+        return self.default
+
+    @classmethod
+    def load(cls, path):
+        """Read limits from a JSON file; returns the built-in defaults if the file doesn't exist or is broken."""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path) as f:
+                config = json.load(f)
+            default = config.get("default", (DEFAULT_BURST, DEFAULT_RATE))
+            burst, rate = default
+            models = {str(prefix): (int(b), float(r)) for prefix, (b, r) in config.get("models", {}).items()}
+            return cls((int(burst), float(rate)), models)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            log.warning("Error loading %s, using the default rate limits: %s", os.path.basename(path), e)
+            return cls()
@@ -0,0 +1,237 @@
+from PyQt5.QtWidgets import QAbstractItemView, QListView, QStyle, QStyledItemDelegate
+from PyQt5.QtGui import QColor, QFont, QFontMetrics, QPainter, QPalette
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QSize, Qt
+
+
+STEP_ROLE = Qt.UserRole  # The step dict of a row
+HIGHLIGHT_ROLE = Qt.UserRole + 1  # True for the row that is playing in a preview
+
+ROW_PADDING = 5
+COLOR_DOT = 20
+
+
+def step_rgb(step):
+    """Return the (r, g, b) a step shows, or None for a turn_off step."""
+    if step.get("action") == "turn_off":
+        return None
+    color = step.get("color", [255, 255, 255])
+    if isinstance(color, dict):
+        return (color.get("r", 255), color.get("g", 255), color.get("b", 255))
+    if isinstance(color, (list, tuple)) and len(color) >= 3:
+        return tuple(color[:3])
+    return (255, 255, 255)  # Default to white if unexpected
+
+
+def step_fields(step):
+    """Return the (label, value) pairs shown for a step."""
+    rgb = step_rgb(step) or (0, 0, 0)
+    return (
+        ("Light: ", str(step.get("light_ip", "Unknown Light"))),
+        (", Action: ", str(step.get("action", "Unknown Action"))),
+        (", Color: ", f"({rgb[0]}, {rgb[1]}, {rgb[2]})"),
+        (", Brightness: ", str(step.get("brightness", 255))),
+        (", Duration: ", f"{step.get('duration', 0)}ms"),
+    )
+
+
+class StepListModel(QAbstractListModel):
+    """
+    List model over a list of pattern step dicts.
+
+    The model works on the list it was given (it is not copied), and every change goes
+    through a method that tells the views exactly which rows changed, so editing one step
+    of a long pattern doesn't rebuild the whole list.
+    """
+
+    def __init__(self, steps=None, parent=None):
+        super().__init__(parent)
+        self._steps = steps if steps is not None else []
+        self._highlight = -1
+
+    def steps(self):
+        return self._steps
+
+    def set_steps(self, steps):
+        """Show another list of steps."""
+        self.beginResetModel()
+        self._steps = steps
+        self._highlight = -1
+        self.endResetModel()
+
+    def step(self, row):
+        return self._steps[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._steps)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._steps):
+            return None
+        step = self._steps[index.row()]
+        if role == STEP_ROLE:
+            return step
+        if role == HIGHLIGHT_ROLE:
+            return index.row() == self._highlight
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return "".join(label + value for label, value in step_fields(step))
+        if role == Qt.DecorationRole:
+            rgb = step_rgb(step)
+            return QColor(*rgb) if rgb else QColor(0, 0, 0, 0)
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled  # Drops land between rows
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsDragEnabled
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def append(self, step):
+        self.insert(len(self._steps), step)
+
+    def insert(self, row, step):
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._steps.insert(row, step)
+        if row <= self._highlight:
+            self._highlight += 1
+        self.endInsertRows()
+
+    def replace(self, row, step):
+        self._steps[row] = step
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def refresh(self, row):
+        """Repaint one row after its step dict was changed in place."""
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def remove(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._steps[row]
+        if row == self._highlight:
+            self._highlight = -1
+        elif row < self._highlight:
+            self._highlight -= 1
+        self.endRemoveRows()
+
+    def move(self, source, destination):
+        """Move the step at row source so it ends up at row destination."""
+        if source == destination:
+            return False
+        # Qt counts the destination before the row is taken out
+        return self.moveRows(QModelIndex(), source, 1, QModelIndex(), destination + 1 if destination > source else destination)
+
+    def moveRows(self, source_parent, source_row, count, destination_parent, destination_child):
+        """Move rows, as Qt's drag and drop does; destination_child counts rows before the move."""
+        if source_parent.isValid() or destination_parent.isValid() or count < 1:
+            return False
+        if source_row <= destination_child <= source_row + count:
+            return False  # Dropped onto itself
+        if not self.beginMoveRows(QModelIndex(), source_row, source_row + count - 1, QModelIndex(), destination_child):
+            return False
+        moved = self._steps[source_row:source_row + count]
+        highlighted = self._steps[self._highlight] if 0 <= self._highlight < len(self._steps) else None
+        del self._steps[source_row:source_row + count]
+        insert_at = destination_child - count if destination_child > source_row else destination_child
+        self._steps[insert_at:insert_at] = moved
+        if highlighted is not None:
+            self._highlight = next(row for row, step in enumerate(self._steps) if step is highlighted)
+        self.endMoveRows()
+        return True
+
+    def highlight(self):
+        return self._highlight
+
+    def set_highlight(self, row):
+        """Mark the playing row; only the old and the new row are repainted."""
+        previous, self._highlight = self._highlight, row
+        for changed in {previous, row}:
+            if 0 <= changed < len(self._steps):
+                index = self.index(changed)
+                self.dataChanged.emit(index, index, [HIGHLIGHT_ROLE])
+
+
+class StepDelegate(QStyledItemDelegate):
+    """
+    Paints a step row: its number, a dot in the step's color and the step details with the
+    values in bold. Only the rows that are visible get painted.
+    """
+
+    def sizeHint(self, option, index):
+        height = max(QFontMetrics(option.font).height(), COLOR_DOT) + 2 * ROW_PADDING
+        return QSize(0, height)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        palette = option.palette
+        highlighted = option.state & (QStyle.State_Selected | QStyle.State_MouseOver) or index.data(HIGHLIGHT_ROLE)
+        if highlighted:
+            painter.fillRect(option.rect, palette.color(QPalette.Highlight))
+            text_color = palette.color(QPalette.HighlightedText)
+        else:
+            background = QPalette.Base if index.row() % 2 == 0 else QPalette.AlternateBase
+            painter.fillRect(option.rect, palette.color(background))
+            text_color = palette.color(QPalette.Text)
+
+        font = QFont(option.font)
+        bold = QFont(option.font)
+        bold.setBold(True)
+        bold_metrics = QFontMetrics(bold)
+        rect = option.rect.adjusted(ROW_PADDING, 0, -ROW_PADDING, 0)
+        painter.setPen(text_color)
+
+        # Step number
+        painter.setFont(bold)
+        number = str(index.row() + 1)
+        painter.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter, number)
+        x = rect.left() + bold_metrics.horizontalAdvance(number) + ROW_PADDING * 2
+
+        # Color dot (nothing for steps that turn the light off)
+        color = index.data(Qt.DecorationRole)
+        if color is not None and color.alpha():
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(color)
+            painter.drawEllipse(x, rect.top() + (rect.height() - COLOR_DOT) // 2, COLOR_DOT, COLOR_DOT)
+            painter.setPen(text_color)
+        x += COLOR_DOT + ROW_PADDING * 2
+
+        # Details, labels in the normal font and values in bold, cut off at the right edge
+        for label, value in step_fields(index.data(STEP_ROLE)):
+            for text, text_font in ((label, font), (value, bold)):
+                if x >= rect.right():
+                    break
+                painter.setFont(text_font)
+                metrics = QFontMetrics(text_font)
+                text = metrics.elidedText(text, Qt.ElideRight, rect.right() - x)
+                painter.drawText(x, rect.top(), rect.right() - x, rect.height(), Qt.AlignLeft | Qt.AlignVCenter, text)
+                x += metrics.horizontalAdvance(text)
+        painter.restore()
+
+
+class StepListView(QListView):
+    """QListView set up for step lists: uniform rows painted by StepDelegate, one selection."""
+
+    def __init__(self, model=None, parent=None):
+        super().__init__(parent)
+        self.setUniformItemSizes(True)  # Lets the view skip measuring every row
+        self.setItemDelegate(StepDelegate(self))
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setMouseTracking(True)  # For the hover highlight
+        if model is not None:
+            self.setModel(model)
+
+    def dataChanged(self, top_left, bottom_right, roles=()):
+        # QListView lays out every row again on any data change; rows here all have the same
+        # height, so a change can't move other rows and repainting the changed ones is enough
+        QAbstractItemView.dataChanged(self, top_left, bottom_right, list(roles))
+
+    def current_row(self):
+        """Return the selected row, or -1."""
+        selected = self.selectionModel().selectedRows() if self.selectionModel() else []
+        return selected[0].row() if selected else -1
+
+    def set_current_row(self, row):
+        self.setCurrentIndex(self.model().index(row, 0))
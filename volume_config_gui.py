@@ -2,17 +2,27 @@ import sys
 import json
 import subprocess
 import threading
-import asyncio
 import ast
 import os
 import psutil 
 import pyaudio
-import pyi_splash
+import logging
+
+try:
+    import pyi_splash  # Only there in the packaged app
+except ImportError:
+    pyi_splash = None
 
 from PyQt5.QtGui import QColor, QIcon
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QComboBox, QGraphicsDropShadowEffect, QGraphicsBlurEffect, QColorDialog, QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit, QCheckBox, QPushButton, QLabel, QGroupBox, QScrollArea, QMessageBox, QListWidget, QSizePolicy
-from pywizlight import discovery
+from qasync import asyncSlot
+from app_logging import setup_logging
+from light_io import run_event_loop
+from light_discovery import discover, load_settings as load_discovery_settings
+
+
+log = logging.getLogger("volume_config_gui")
 
 
 def load_icon():
@@ -25,7 +35,7 @@ def load_icon():
         base_path = os.path.abspath(".")
 
     icon_path = os.path.join(base_path, 'icon', 'volume.ico')
-    print(f"Trying to load icon from: {icon_path}")  # Debug statement
+    log.debug("Trying to load icon from: %s", icon_path)
 
     return QIcon(icon_path)
 
@@ -38,10 +48,10 @@ def get_default_input_device():
         # Get default input device info (recording device)
         default_device_index = p.get_default_input_device_info()["index"]
         default_device_info = p.get_device_info_by_index(default_device_index)
-        print("Default input device info:", default_device_info)  # Debug statement
+        log.debug("Default input device info: %s", default_device_info)
         return default_device_index, default_device_info["name"]
     except Exception as e:
-        print(f"Error retrieving default input device: {e}")
+        log.error("Error retrieving default input device: %s", e)
         return None, "Unknown"
     finally:
         p.terminate()
@@ -52,25 +62,7 @@ def stop_visualizer():
     if visualizer_process:
         visualizer_process.terminate()
         visualizer_process = None
-        print("Visualizer stopped.")
-
-class DiscoveryThread(QThread):
-    # Signal to emit the discovered lights
-    discovered = pyqtSignal(list)
-
-    def __init__(self, discover_lights_async, parent=None):
-        super().__init__(parent)
-        self.discover_lights_async = discover_lights_async
-
-    def run(self):
-        # Run the discovery in a new event loop
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            discovered_lights = loop.run_until_complete(self.discover_lights_async())
-            self.discovered.emit(discovered_lights)  # Emit the discovered lights
-        finally:
-            loop.close()
+        log.info("Visualizer stopped.")
 
 # Define the path to the theme effects settings file dynamically
 if getattr(sys, 'frozen', False):  # If running as a packaged app
@@ -80,7 +72,7 @@ else:
 
 THEME_EFFECTS_PATH = os.path.join(base_path, "themes", "theme_effects.json")
 
-print(THEME_EFFECTS_PATH)  # For debugging purposes to verify the path
+log.debug("Theme effects path: %s", THEME_EFFECTS_PATH)
 
 def load_stylesheet(app, theme_name="dark"):
     """
@@ -92,14 +84,14 @@ def load_stylesheet(app, theme_name="dark"):
         base_path = os.path.join(os.path.abspath("."), 'themes')
 
     theme_path = os.path.join(base_path, f"{theme_name}.qss")
-    print(f"Trying to load stylesheet from: {theme_path}")  # Debug statement
+    log.debug("Trying to load stylesheet from: %s", theme_path)
 
     try:
         with open(theme_path, "r") as f:
             stylesheet = f.read()
             app.setStyleSheet(stylesheet)
     except FileNotFoundError:
-        print(f"Stylesheet not found: {theme_path}")
+        log.warning("Stylesheet not found: %s", theme_path)
 
 def load_theme_effects(theme_name):
     """
@@ -111,17 +103,17 @@ def load_theme_effects(theme_name):
         base_path = os.path.join(os.path.abspath("."), 'themes')
 
     effects_path = os.path.join(base_path, 'theme_effects.json')
-    print(f"Trying to load theme effects from: {effects_path}")  # Debug statement
+    log.debug("Trying to load theme effects from: %s", effects_path)
 
     try:
         with open(effects_path, "r") as f:
             effects = json.load(f)
             return effects.get(theme_name, {})
     except FileNotFoundError:
-        print("Theme effects file not found.")
+        log.warning("Theme effects file not found.")
         return {}
     except json.JSONDecodeError:
-        print("Error parsing theme effects file.")
+        log.error("Error parsing theme effects file.")
         return {}
 
 
@@ -156,7 +148,7 @@ class ConfigEditor(QWidget):
         try:
             self.config = load_config(self.config_file)
         except FileNotFoundError:
-            print(f"Configuration file not found: {self.config_file}")
+            log.warning("Configuration file not found: %s", self.config_file)
             QMessageBox.critical(self, "Error", "Configuration file is missing!")
             sys.exit(1)
 
@@ -234,7 +226,7 @@ class ConfigEditor(QWidget):
                 stylesheet = f.read()
                 app.setStyleSheet(stylesheet)
         except FileNotFoundError:
-            print(f"Stylesheet not found: {path}")
+            log.warning("Stylesheet not found: %s", path)
 
 
     def apply_theme(self, theme_name):
@@ -292,10 +284,10 @@ class ConfigEditor(QWidget):
         config_file = os.path.join(base_path, "volume_config.json")
 
         # Print paths for debugging
-        print(f"Current working directory: {os.getcwd()}")
-        print(f"Base path: {base_path}")
-        print(f"Visualizer executable: {visualizer_executable}")
-        print(f"Config file: {config_file}")
+        log.debug("Current working directory: %s", os.getcwd())
+        log.debug("Base path: %s", base_path)
+        log.debug("Visualizer executable: %s", visualizer_executable)
+        log.debug("Config file: %s", config_file)
 
         # Launch the visualizer process
         try:
@@ -313,7 +305,7 @@ class ConfigEditor(QWidget):
                 self.update_status.emit("WiZ Volume Visualizer Control")
         except Exception as e:
             self.update_status.emit(f"Error starting visualizer: {e}")
-            print(f"Error: {e}")
+            log.error("Error: %s", e)
 
 
 
@@ -677,24 +669,30 @@ class ConfigEditor(QWidget):
                 self.config['network']['light_ips'].remove(ip)
                 self.light_ip_list.takeItem(self.light_ip_list.row(item))
 
-    def add_discovered_lights(self):
-        # Create and start the discovery thread
-        self.discovery_thread = DiscoveryThread(self.discover_lights_async)
-        self.discovery_thread.discovered.connect(self.handle_discovered_lights)
-        self.discovery_thread.start()
+    @asyncSlot()
+    async def add_discovered_lights(self):
+        # Discovery runs on the app's asyncio loop, the results come straight back to the GUI
+        self.handle_discovered_lights(await self.discover_lights_async())
 
     def handle_discovered_lights(self, discovered_lights):
+        # Index the configured IPs once so each discovered light is checked in O(1)
+        known = set(self.config['network']['light_ips'])
+
         # Update the GUI with the discovered lights
         for light in discovered_lights:
-            if hasattr(light, 'ip') and light.ip not in self.config['network']['light_ips']:
+            if not hasattr(light, 'ip'):
+                continue
+            if light.ip not in known:
+                known.add(light.ip)
                 self.config['network']['light_ips'].append(light.ip)
                 self.light_ip_list.addItem(light.ip)
 
     async def discover_lights_async(self):
         self.statusLabel.setText("Searching for connected devices...")
         # Discover WiZ lights asynchronously
-        discovered_lights = await discovery.discover_lights()
-        print(f"Discovered lights: {discovered_lights}")  # Debugging line
+        settings = load_discovery_settings()  # The broadcast addresses saved in the main app
+        discovered_lights = await discover(settings["broadcast_addresses"], interfaces=settings["interfaces"])
+        log.debug("Discovered lights: %s", discovered_lights)
         self.statusLabel.setText("WiZ Volume Visualizer Control")
         return discovered_lights
   
@@ -725,7 +723,7 @@ class ConfigEditor(QWidget):
                                     rgb_values = text_value.replace('RGB(', '').replace(')', '').split(',')
                                     self.config[section][key] = [int(val.strip()) for val in rgb_values]
                                 except ValueError:
-                                    print(f"Error parsing color value: {text_value}")
+                                    log.error("Error parsing color value: %s", text_value)
                                     self.config[section][key] = text_value
                             else:
                                 self.config[section][key] = text_value
@@ -763,16 +761,16 @@ class ConfigEditor(QWidget):
                 self.config['audio']['device_index'] = selected_index
 
         # Debug print the final configuration
-        print(f"Saving configuration to: {self.config_file}")
-        print("Final configuration before saving:", json.dumps(self.config, indent=4))
+        log.info("Saving configuration to: %s", self.config_file)
+        log.debug("Final configuration before saving: %s", json.dumps(self.config, indent=4))
 
         # Save the updated configuration to the file
         try:
             save_config(self.config_file, self.config)
-            print("Configuration saved successfully!")
+            log.info("Configuration saved successfully!")
             self.statusLabel.setText("Configuration saved.")
         except Exception as e:
-            print(f"Error saving configuration: {e}")
+            log.error("Error saving configuration: %s", e)
             self.statusLabel.setText("Failed to save configuration.")
 
 
@@ -790,7 +788,7 @@ class ConfigEditor(QWidget):
             # Re-populate settings with the default config
             self.populate_settings(self.config)
 
-            print("Configuration reset to default.")
+            log.info("Configuration reset to default.")
 
     def populate_settings(self, config):
         # Clear current UI elements first
@@ -819,14 +817,16 @@ class ConfigEditor(QWidget):
             self.config['network']['light_ips'] = [self.config['network']['light_ips']]
             self.light_ip_list.addItems(self.config['network']['light_ips'])
 
-        print("Settings have been updated.")
+        log.info("Settings have been updated.")
 
 
 # Running the application
 if __name__ == "__main__":
+    setup_logging()
     app = QApplication(sys.argv)
     theme_name = sys.argv[1] if len(sys.argv) > 1 else "dark"
-    pyi_splash.close()
+    if pyi_splash is not None:
+        pyi_splash.close()
 
     # Determine the base path
     if getattr(sys, 'frozen', False):  # Packaged app
@@ -838,29 +838,29 @@ if __name__ == "__main__":
     config_file_path = os.path.join(base_path, 'volume_config.json')
     default_file_path = os.path.join(base_path, 'default_volume_config.json')
 
-    print(f"Config File Path: {config_file_path}")
-    print(f"Default File Path: {default_file_path}")
+    log.debug("Config File Path: %s", config_file_path)
+    log.debug("Default File Path: %s", default_file_path)
 
     # Validate default file existence
     if not os.path.exists(default_file_path):
-        print("Error: Default configuration file is missing.")
+        log.error("Error: Default configuration file is missing.")
         sys.exit(1)
 
     # Ensure config file exists by copying from the default
     if not os.path.exists(config_file_path):
-        print("Creating configuration file from default...")
+        log.info("Creating configuration file from default...")
         try:
             with open(default_file_path, 'r') as default_file:
                 with open(config_file_path, 'w') as config_file:
                     config_file.write(default_file.read())
         except Exception as e:
-            print(f"Error creating configuration file: {e}")
+            log.error("Error creating configuration file: %s", e)
             sys.exit(1)
 
     # Load and run the main window
     load_stylesheet(app, theme_name)
     window = ConfigEditor(config_file_path, default_file_path, theme_name=theme_name)
     window.show()
-    sys.exit(app.exec_())
+    sys.exit(run_event_loop(app))
 
 
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import random
+import socket
+import time
+from collections import deque
+
+from rate_limit import TokenBucket
+from wiz_transport import WIZ_PORT
+
+
+PUSH_PORT = 38900  # Where registered phones get syncPilot updates
+HEARTBEAT_INTERVAL = 5.0  # Seconds between the syncPilot heartbeats a bulb sends to registered phones
+LOG_LIMIT = 10000  # Commands each bulb keeps in its log
+MODULE_NAME = "ESP01_SHRGB1C_31"  # What a simulated bulb reports as its model
+DEFAULT_BASE = "127.0.1.1"  # First address of the simulated bulbs (all of 127/8 is loopback on Linux)
+
+# Pilot keys a setPilot can change, and what a bulb starts with
+PILOT_KEYS = ("state", "sceneId", "r", "g", "b", "c", "w", "dimming", "speed", "temp")
+INITIAL_PILOT = {"state": False, "sceneId": 0, "r": 255, "g": 255, "b": 255, "dimming": 100}
+
+
+class SimulatedBulb(asyncio.DatagramProtocol):
+    """
+    One fake WiZ bulb listening on its own address.
+
+    It answers registration (including discovery broadcasts), getPilot, setPilot and
+    getSystemConfig the way a real bulb does, pushes syncPilot to registered phones, and
+    keeps a log of (time, sender IP, method, params, dropped) for every packet it got.
+    Replies are delayed by latency +/- jitter; packets are lost with probability loss, and
+    packets beyond the bulb's token bucket (burst, rate) are dropped like an overloaded bulb
+    would. rate=0 means no limit.
+    """
+
+    def __init__(self, ip, mac, latency=0.0, jitter=0.0, loss=0.0, burst=0, rate=0.0, seed=None,
+                 module_name=MODULE_NAME, log_limit=LOG_LIMIT, clock=time.monotonic):
+        self.ip = ip
+        self.mac = mac
+        self.module_name = module_name
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.bucket = TokenBucket(burst or 1, rate, clock=clock)
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.pilot = dict(INITIAL_PILOT)
+        self.phones = set()  # IPs that registered for pushes
+        self.log = deque(maxlen=log_limit)
+        self.received = 0
+        self.dropped = 0  # Lost or over the rate limit
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.handle(data, addr)
+
+    def handle(self, data, addr):
+        try:
+            message = json.loads(data)
+            method = message["method"]
+            params = message.get("params") or {}
+        except (ValueError, KeyError, TypeError):
+            return  # Real bulbs ignore what they can't parse
+        self.received += 1
+        dropped = None
+        if self.loss and self.random.random() < self.loss:
+            dropped = "lost"
+        elif self.bucket.delay() > 0:
+            dropped = "rate"
+            self.bucket.throttled += 1
+        else:
+            self.bucket.take()
+        self.log.append((self.clock(), addr[0], method, params, dropped))
+        if dropped:
+            self.dropped += 1
+            return
+
+        result = self.answer(method, params)
+        if result is not None:
+            reply = json.dumps({"method": method, "env": "pro", "result": result}).encode()
+            self.later(reply, addr)
+
+    def answer(self, method, params):
+        """Apply a request and return its result (None for methods a bulb doesn't answer)."""
+        if method == "registration":
+            if params.get("register") and params.get("phoneIp"):
+                self.phones.add(params["phoneIp"])
+                self.push("udp")
+            return {"mac": self.mac, "success": True}
+        if method == "getPilot":
+            return dict(self.pilot, mac=self.mac, rssi=-50)
+        if method == "setPilot":
+            changed = False
+            for key in PILOT_KEYS:
+                if key in params and self.pilot.get(key) != params[key]:
+                    self.pilot[key] = params[key]
+                    changed = True
+            if "state" not in params and changed:
+                self.pilot["state"] = True
+            if changed:
+                self.push("udp")
+            return {"success": True}
+        if method == "getSystemConfig":
+            return {"mac": self.mac, "moduleName": self.module_name, "fwVersion": "1.25.0", "homeId": 0, "roomId": 0}
+        return None
+
+    def push(self, source):
+        """Send the current pilot to every registered phone (source is "udp" for changes, "hb" for heartbeats)."""
+        if not self.phones:
+            return
+        message = json.dumps({"method": "syncPilot", "env": "pro", "params": dict(self.pilot, mac=self.mac, rssi=-50, src=source)}).encode()
+        for phone in self.phones:
+            self.later(message, (phone, PUSH_PORT))
+
+    def later(self, data, addr):
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay <= 0:
+            self.send(data, addr)
+        else:
+            asyncio.get_running_loop().call_later(delay, self.send, data, addr)
+
+    def send(self, data, addr):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+    def commands(self, method=None):
+        """Return the log entries (optionally only one method's)."""
+        return [entry for entry in self.log if method is None or entry[2] == method]
+
+
+class BroadcastListener(asyncio.DatagramProtocol):
+    """Hands the discovery broadcasts (which sockets bound to one address never see) to every bulb."""
+
+    def __init__(self, bulbs):
+        self.bulbs = bulbs
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(message, dict) and message.get("method") == "registration":
+            for bulb in self.bulbs:
+                bulb.handle(data, addr)
+
+
+def bulb_addresses(count, base=DEFAULT_BASE):
+    """Return count consecutive IPv4 addresses starting at base."""
+    first = ipaddress.IPv4Address(base)
+    return [str(first + i) for i in range(count)]
+
+
+class Simulator:
+    """
+    Any number of SimulatedBulbs, one per address, on the WiZ port.
+
+    On Linux every 127.x.y.z address is loopback and works as is; elsewhere the
+    addresses must be aliased on an interface first. With broadcast=True the
+    simulator also listens on every address, so discovery broadcasts reach the bulbs.
+    """
+
+    def __init__(self, addresses, port=WIZ_PORT, broadcast=True, seed=0, **bulb_options):
+        self.port = port
+        self.broadcast = broadcast
+        self.bulbs = [
+            SimulatedBulb(ip, f"a8bb50{i:06x}", seed=seed + i, **bulb_options)
+            for i, ip in enumerate(addresses)
+        ]
+        self._by_ip = {bulb.ip: bulb for bulb in self.bulbs}
+        self._transports = []
+        self._heartbeat = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            for bulb in self.bulbs:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind((bulb.ip, self.port))
+                transport, _ = await loop.create_datagram_endpoint(lambda bulb=bulb: bulb, sock=sock)
+                self._transports.append(transport)
+            if self.broadcast:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(("", self.port))
+                transport, _ = await loop.create_datagram_endpoint(lambda: BroadcastListener(self.bulbs), sock=sock)
+                self._transports.append(transport)
+        except OSError:
+            self.close()
+            raise
+        self._heartbeat = loop.create_task(self._send_heartbeats())
+        return self
+
+    def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def _send_heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for bulb in self.bulbs:
+                bulb.push("hb")
+
+    def bulb(self, ip):
+        return self._by_ip.get(ip)
+
+    @property
+    def ips(self):
+        return [bulb.ip for bulb in self.bulbs]
+
+    def summary(self):
+        received = sum(bulb.received for bulb in self.bulbs)
+        dropped = sum(bulb.dropped for bulb in self.bulbs)
+        busiest = max(self.bulbs, key=lambda bulb: bulb.received, default=None)
+        lines = [f"{len(self.bulbs)} bulb(s), {received} packets received, {dropped} dropped"]
+        if busiest is not None and busiest.received:
+            lines.append(f"Busiest: {busiest.ip} with {busiest.received} packets ({busiest.dropped} dropped)")
+        return "\n".join(lines)
+
+    def write_log(self, path):
+        """Write every bulb's log as JSON lines: {"time", "bulb", "from", "method", "params", "dropped"}."""
+        entries = sorted((entry + (bulb.ip,) for bulb in self.bulbs for entry in bulb.log), key=lambda entry: entry[0])
+        with open(path, "w") as f:
+            for at, sender, method, params, dropped, ip in entries:
+                f.write(json.dumps({"time": at, "bulb": ip, "from": sender, "method": method,
+                                    "params": params, "dropped": dropped}) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate WiZ bulbs on local addresses, for testing without hardware.")
+    parser.add_argument("--count", type=int, default=10, help="number of bulbs (default 10)")
+    parser.add_argument("--base", default=DEFAULT_BASE, help=f"address of the first bulb, the others follow it (default {DEFAULT_BASE})")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before a bulb answers")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds the latency varies by, either way")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of packets lost (0-1)")
+    parser.add_argument("--rate", type=float, default=0.0, help="packets per second a bulb takes before dropping them (0 = no limit)")
+    parser.add_argument("--burst", type=int, default=10, help="packets a bulb takes back to back (with --rate)")
+    parser.add_argument("--no-broadcast", action="store_true", help="don't answer discovery broadcasts")
+    parser.add_argument("--seed", type=int, default=0, help="seed for loss and jitter")
+    parser.add_argument("--log", help="write every bulb's commands to this file (JSON lines) on exit")
+    args = parser.parse_args(argv)
+
+    simulator = Simulator(
+        bulb_addresses(args.count, args.base), broadcast=not args.no_broadcast, seed=args.seed,
+        latency=args.latency, jitter=args.jitter, loss=args.loss, burst=args.burst, rate=args.rate,
+    )
+
+    async def run():
+        await simulator.start()
+        print(f"Simulating {args.count} bulb(s) from {simulator.ips[0]} to {simulator.ips[-1]}, Ctrl+C to stop")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            simulator.close()
+
+    try:
+        asyncio.run(run())
+    except OSError as e:
+        print(f"Could not start the simulator: {e}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    print(simulator.summary())
+    if args.log:
+        simulator.write_log(args.log)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
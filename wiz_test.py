@@ -1,27 +1,75 @@
+import time
+
+STARTED = time.perf_counter()  # Before the other imports, so --profile-startup times them too
+
 import sys
 import os
 import json
 import asyncio
 import subprocess
-import random
-import tempfile
-import shutil
-import tempfile
-import pyi_splash
+import logging
+
+try:
+    import pyi_splash  # Only there in the packaged app
+except ImportError:
+    pyi_splash = None
 
 
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QListWidget, QPushButton,
+    QApplication, QMainWindow, QListWidget, QListWidgetItem, QPushButton,
     QInputDialog, QLabel, QColorDialog, QVBoxLayout, QWidget,
-    QComboBox, QGroupBox, QCheckBox, QTabWidget, QLineEdit, QGraphicsDropShadowEffect, QGraphicsBlurEffect, QSlider, QScrollArea
+    QComboBox, QGroupBox, QCheckBox, QTabWidget, QLineEdit, QGraphicsDropShadowEffect, QGraphicsBlurEffect, QSlider, QScrollArea, QSpinBox, QDoubleSpinBox,
+    QTableWidget, QTableWidgetItem, QHeaderView
 )
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal
-from pywizlight import wizlight, discovery, PilotBuilder
+from pywizlight import wizlight
 from qasync import QEventLoop, asyncSlot
 from PyQt5.QtCore import pyqtSlot
 from PyQt5.QtGui import QColor, QIcon
-from pattern_editor import PatternEditor
+from wiz_transport import close_transport, encode_pilot, get_pilot, get_system_config
+from command_dispatch import CommandDispatcher, fan_out, summarize, LIGHT_DEADLINE
+from light_registry import LightRegistry
+from light_cache import LightCache
+from light_state import StateSubscriptionService
+from metrics import SNAPSHOT_INTERVAL, get_registry
+from app_logging import dropped_records, setup_logging
+from light_discovery import (
+    BROADCAST, SWEEP, discover, is_valid_network, load_settings as load_discovery_settings,
+    save_settings as save_discovery_settings, sweep
+)
+from rate_limit import RATE_LIMITS_FILE, RateLimits
+from pattern_library import PatternLibrary, MEMORY_BUDGET
+from pattern_timeline import PatternCompileError, compile_pattern, normalize_color
+from pattern_simulator import PREFLIGHT_COMMANDS, PREFLIGHT_CYCLES, PREFLIGHT_SECONDS, PREFLIGHT_STEPS, simulate
+from pattern_runner import (
+    PatternRunner, PilotTracker, LATE_POLICIES, CATCH_UP, SKIP, STRETCH, FULL_REFRESH_INTERVAL, PILOT_KEYS
+)
+
+
+log = logging.getLogger("wiz_test")
+
 
+class StartupProfile:
+    """How long each phase of the start took, printed with --profile-startup."""
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = []  # (phase, seconds)
+
+    def mark(self, phase):
+        """End the current phase under the given name."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = [f"{phase:<32}{seconds * 1000:8.1f} ms" for phase, seconds in self.phases]
+        lines.append(f"{'Total':<32}{(self.last - self.started) * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+startup = StartupProfile(STARTED)
 
 
 # Define the supported bulb effects with scene IDs and names
@@ -115,7 +163,7 @@ def load_icon():
         base_path = os.path.abspath(".")
 
     icon_path = os.path.join(base_path, 'icon', 'main3.ico')
-    print(f"Trying to load icon from: {icon_path}")  # Debug statement
+    log.debug("Trying to load icon from: %s", icon_path)
 
     return QIcon(icon_path)
 
@@ -128,7 +176,7 @@ else:
 
 THEME_EFFECTS_PATH = os.path.join(base_path, "themes", "theme_effects.json")
 
-print(THEME_EFFECTS_PATH)  # For debugging purposes to verify the path
+log.debug("Theme effects path: %s", THEME_EFFECTS_PATH)
 
 
 
@@ -144,37 +192,36 @@ def load_stylesheet(app, theme_name="dark"):
         base_path = os.path.join(os.path.abspath("."), 'themes')
 
     theme_path = os.path.join(base_path, f"{theme_name}.qss")
-    print(f"Trying to load stylesheet from: {theme_path}")  # Debug statement
+    log.debug("Trying to load stylesheet from: %s", theme_path)
 
     try:
         with open(theme_path, "r") as f:
             stylesheet = f.read()
             app.setStyleSheet(stylesheet)
     except FileNotFoundError:
-        print(f"Stylesheet not found: {theme_path}")
+        log.warning("Stylesheet not found: %s", theme_path)
+
+
+_theme_effects = None  # Contents of the theme effects file, read once
+
 
 def load_theme_effects(theme_name):
     """
     Load theme effects from the JSON settings based on the theme name.
     """
-    if getattr(sys, '_MEIPASS', False):  # If running as a packaged app
-        base_path = os.path.join(sys._MEIPASS, 'themes')
-    else:
-        base_path = os.path.join(os.path.abspath("."), 'themes')
-
-    effects_path = os.path.join(base_path, 'theme_effects.json')
-    print(f"Trying to load theme effects from: {effects_path}")  # Debug statement
-
-    try:
-        with open(effects_path, "r") as f:
-            effects = json.load(f)
-            return effects.get(theme_name, {})
-    except FileNotFoundError:
-        print("Theme effects file not found.")
-        return {}
-    except json.JSONDecodeError:
-        print("Error parsing theme effects file.")
-        return {}
+    global _theme_effects
+    if _theme_effects is None:
+        log.debug("Trying to load theme effects from: %s", THEME_EFFECTS_PATH)
+        try:
+            with open(THEME_EFFECTS_PATH, "r") as f:
+                _theme_effects = json.load(f)
+        except FileNotFoundError:
+            log.warning("Theme effects file not found.")
+            _theme_effects = {}
+        except json.JSONDecodeError:
+            log.error("Error parsing theme effects file.")
+            _theme_effects = {}
+    return _theme_effects.get(theme_name, {})
 
 
 
@@ -184,41 +231,50 @@ class LightApp(QMainWindow):
     current_pattern_task = None
     pattern_timer = None  # Timer for pattern running
 
-    def change_theme(self, theme_name):
-        """
-        Change the application theme by loading the appropriate .qss file from the themes folder.
-        """
-        theme_path = os.path.join("themes", f"{theme_name}.qss")
-        load_stylesheet(QApplication.instance(), theme_path)  # Load and apply the theme
-
     def __init__(self):
         super().__init__()
         self.current_speed = 0  # Set initial value for speed
         self.current_dimming = 100  # Set initial value for dimming
+        # Latest-value-wins queue for every command, rate limited per light by bulb model
+        self.dispatcher = CommandDispatcher(limits=RateLimits.load(os.path.join(base_path, RATE_LIMITS_FILE)))
+        self.scene_lights = set()  # Lights currently running a scene from the Scenes tab
+        self.current_theme = "dark"  # Passed on to the visualizer config tools
         self.apply_theme_effects()  # Apply initial theme effects
-        self.lights = []
-        self.scenes_tab = QWidget(self)  # Create the QWidget for scenes_tab
-        self.setCentralWidget(self.scenes_tab)  # Optionally, set this as the central widget if necessary
+        self.registry = LightRegistry()  # Lights by IP and MAC, with names, state and list rows
+        self.light_cache = LightCache()  # Lights of the last session, shown before discovery finishes
+        # Light states, pushed by the lights themselves (the ones that don't push are polled slowly)
+        self.state_service = StateSubscriptionService()
+        self.state_service.add_listener(self.on_light_state_changed)
+        self.metrics = get_registry()  # Commands, latencies, step lateness and discovery times
+        self.metrics.gauge("dispatcher.coalesced", lambda: self.dispatcher.coalesced)
+        self.metrics.gauge("dispatcher.throttled", lambda: self.dispatcher.throttled)
+        self.metrics.gauge("state.pushes", lambda: self.state_service.pushes)
+        self.metrics.gauge("state.polls", lambda: self.state_service.polls)
+        self.metrics.gauge("lights", lambda: len(self.registry))
+        self.metrics.gauge("log.dropped", dropped_records)
+        # Metrics of the session are written to a file every now and then, for looking into problems later
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.timeout.connect(self.write_metrics_snapshot)
+        self.snapshot_timer.start(SNAPSHOT_INTERVAL * 1000)
+        self.discovery_settings = load_discovery_settings()  # Broadcast addresses, saved in the Settings tab
         self.discovered_lights = []  # This will store the discovered lights
-        self.light_names = {}  # For renaming lights
         self.lightCheckBoxes = {}  # For light checkboxes in UI
-        # Call the method to initialize the scenes tab UI elements
-        self.init_scenes_tab()
-        self.presets = []
-        self.groupBox = QGroupBox("Group Name", self)
-        self.groupBoxLayout = QVBoxLayout(self.groupBox)
-        self.groupBox.setLayout(self.groupBoxLayout)
-        self.applyPresetButton = QPushButton('Apply Preset to Group', self.groupBox)
-        self.groupBoxLayout.addWidget(self.applyPresetButton)
-        self.light_names = {}
-        self.patterns = []
+        self.pattern_library = None  # Parsed pattern files, created on the first load
+        self.pattern_items = {}  # Pattern file path -> its item in the pattern list
+        self.patterns_loading = False
+        self.pattern_memory_budget = MEMORY_BUDGET  # Bytes of pattern files kept loaded for running
         self.current_pattern_task = None  # Track the running task for presets
+        self.pattern_runner = None  # Runner of the current (or last) pattern, holds its stats
+        self.late_step_policy = CATCH_UP  # What the pattern runner does with late steps
+        self.full_refresh_interval = FULL_REFRESH_INTERVAL  # Seconds between full pattern commands
+        self.pilot_tracker = None  # What the running pattern last sent to each light
+        startup.mark("Window: services")
         self.initUI()
-        self.light_state_updated.connect(self.on_light_state_updated)
-        QTimer.singleShot(1000, self.refreshLights)
+        self.restore_cached_lights()
+        startup.mark("Window: cached lights")
+        QTimer.singleShot(0, self.startStateService)
         # Connect signal for updating light state
         self.light_state_updated.connect(self.on_light_state_updated)
-        self.patternListWidget.itemSelectionChanged.connect(self.display_selected_pattern_description)
 
         # Start discovery on initialization
         QTimer.singleShot(1000, self.refreshLights)
@@ -282,21 +338,53 @@ class LightApp(QMainWindow):
 
 
         self.groupBox.hide()  # Hide group box initially
+        startup.mark("Window: device and control tabs")
+
+        # The other tabs are built the first time they are shown, so the window comes up sooner
+        self.deferred_tabs = {}  # Tab widget -> method that builds its contents
 
         # Create scenes tab
         self.scenes_tab = QWidget()
-        self.init_scenes_tab()
-        self.tabs.addTab(self.scenes_tab, "Scenes")
+        self.add_deferred_tab(self.scenes_tab, "Scenes", self.init_scenes_tab)
 
         # Patterns Tab
         self.patternsTab = QWidget()
-        self.tabs.addTab(self.patternsTab, "Patterns")
+        self.add_deferred_tab(self.patternsTab, "Patterns", self.init_patterns_tab)
+
+        # Visualizer tab
+        self.visualizer_tab = QWidget()
+        self.add_deferred_tab(self.visualizer_tab, "Visualizer", self.setup_visualizer_tab)
+
+        # Create settings tab
+        self.settings_tab = QWidget()
+        self.add_deferred_tab(self.settings_tab, "Settings", self.init_settings_tab)
+
+        # Diagnostics tab
+        self.diagnostics_tab = QWidget()
+        self.add_deferred_tab(self.diagnostics_tab, "Diagnostics", self.init_diagnostics_tab)
+
+        self.tabs.currentChanged.connect(self.build_deferred_tab)
+
+    def add_deferred_tab(self, tab, title, build):
+        """Add an empty tab whose contents build() creates when the tab is first shown."""
+        self.tabs.addTab(tab, title)
+        self.deferred_tabs[tab] = build
+
+    def build_deferred_tab(self, index):
+        build = self.deferred_tabs.pop(self.tabs.widget(index), None)
+        if build is not None:
+            started = time.perf_counter()
+            build()
+            log.debug("Built the %s tab in %.1f ms", self.tabs.tabText(index), (time.perf_counter() - started) * 1000)
+
+    def init_patterns_tab(self):
         self.patternsLayout = QVBoxLayout(self.patternsTab)
         # Add a QLabel to show the pattern description
         self.patternDescriptionLabel = QLabel("Select a pattern to see its description here.")
         self.patternsLayout.addWidget(self.patternDescriptionLabel)
 
         self.patternListWidget = QListWidget(self)
+        self.patternListWidget.itemSelectionChanged.connect(self.display_selected_pattern_description)
         self.patternsLayout.addWidget(self.patternListWidget)
 
         self.loadPatternsButton = QPushButton('Load Patterns', self)
@@ -316,21 +404,6 @@ class LightApp(QMainWindow):
         self.openPatternEditorButton = QPushButton("Open Pattern Editor", self)
         self.openPatternEditorButton.clicked.connect(self.onOpenPatternEditorButtonClicked)
         self.patternsLayout.addWidget(self.openPatternEditorButton)
-    
-
-
-
-
-
-        # Visualizer tab
-        self.visualizer_tab = QWidget()
-        self.setup_visualizer_tab()
-        self.tabs.addTab(self.visualizer_tab, "Visualizer")
-
-        # Create settings tab
-        self.settings_tab = QWidget()
-        self.init_settings_tab()
-        self.tabs.addTab(self.settings_tab, "Settings")
 
 
 
@@ -348,25 +421,27 @@ class LightApp(QMainWindow):
         await self.discover_lights()
 
     async def discover_lights(self):
+        if self.discovery_settings["mode"] == SWEEP:
+            await self.sweep_lights()
+            return
         self.statusLabel.setText("Discovering lights...")
-        self.lights = []  # Clear previously discovered lights before starting a new search
         
-        # Retrieve the broadcast address from the configuration (you can change this as needed)
-        broadcast_address = self.get_broadcast_address()  # This method can return a default or user-configured value
+        # Every configured broadcast address (and each network interface's) is asked at once
+        broadcast_addresses = self.get_broadcast_addresses()
 
         retry_attempts = 3  # Set retry attempts to 3
         attempt = 0
 
         while attempt < retry_attempts:
             try:
-                lights = await discovery.discover_lights(broadcast_space=broadcast_address)
+                lights = await discover(broadcast_addresses, interfaces=self.discovery_settings["interfaces"])
                 if not lights:
                     raise Exception("No lights found.")
-                print(f"Discovered lights: {lights}")
+                log.debug("Discovered lights: %s", lights)
                 self.on_discovery_completed(lights)
                 return  # Exit if discovery is successful
             except Exception as e:
-                print(f"Error during discovery: {e}")
+                log.error("Error during discovery: %s", e)
                 self.statusLabel.setText(f"Error discovering lights. Retrying... ({attempt + 1}/{retry_attempts})")
                 await asyncio.sleep(1)  # Optional: Add a short delay before retrying
                 attempt += 1
@@ -374,92 +449,192 @@ class LightApp(QMainWindow):
         # If we reach this point, the discovery failed after 3 attempts
         self.statusLabel.setText("Failed to discover lights after 3 attempts. Please check your network.")
 
-    def get_broadcast_address(self):
-        # This is where you retrieve or set the broadcast address, 
-        # you can change this to a user-configured value or a default.
-        return "255.255.255.255"  # Default broadcast address, change as needed.
+    async def sweep_lights(self):
+        """Find lights by asking every address of the configured networks, for networks that filter broadcasts."""
+        settings = self.discovery_settings
+        networks = settings["sweep_networks"]
+        self.statusLabel.setText(f"Sweeping {', '.join(networks) or 'the local networks'} for lights...")
+        try:
+            found = await sweep(
+                networks, concurrency=settings["sweep_concurrency"], timeout=settings["probe_timeout"],
+                expected=settings["expected_lights"]
+            )
+        except (ValueError, OSError) as e:
+            log.error("Error during sweep: %s", e)
+            self.statusLabel.setText(f"Sweep failed: {e}")
+            return
+        log.debug("Swept lights: %s", found)
+        lights = []
+        for ip, config in found:
+            light = wizlight(ip, mac=config["mac"])
+            # The sweep already asked for the model, so the lights don't need to be identified again
+            entry = self.registry.add(light)
+            entry.model = config.get("moduleName") or entry.model
+            if entry.model:
+                self.dispatcher.set_model(ip, entry.model)
+            lights.append(light)
+        self.on_discovery_completed(lights)
 
     def on_discovery_completed(self, lights):
-        # Update self.lights with the newly discovered lights
-        self.lights = lights
-
-        # Clear the listWidget to avoid duplicate entries
-        self.listWidget.clear()
+        """Merge discovered lights into the list; known lights that weren't found are checked one by one."""
         self.statusLabel.setText(f"Discovery completed. {len(lights)} light(s) found.")
 
-        if not self.lights:
+        if not lights:
             self.statusLabel.setText("No lights found. Please check your network and try again.")
+            return
+        found = {light.ip for light in lights}
+        for light in lights:
+            # Add the light, keeping the name it was given before
+            entry = self.registry.add(light)
+            self.show_light(entry)
+            if entry.model is None:
+                asyncio.create_task(self.identify_light(light.ip))
+        for entry in self.registry.pop_displaced():
+            # Another light took this one's IP; its row goes, the IP's checkbox now belongs to the newcomer
+            if entry.row is not None:
+                self.listWidget.takeItem(self.listWidget.row(entry.row))
+
+        # A broadcast can miss a light, only drop the ones that don't answer when asked directly
+        unconfirmed = [ip for ip in self.registry.ips() if ip not in found]
+        self.state_service.retain(self.registry.ips())  # Lights that moved to a new IP are followed there
+        asyncio.create_task(self.verify_lights(unconfirmed))
+        self.light_cache.save(self.registry)
+        self.update_pattern_editor_lights()
+
+    def update_pattern_editor_lights(self):
+        """Give an open pattern editor the current lights."""
+        if getattr(self, 'pattern_editor', None) is not None:
+            self.pattern_editor.set_discovered_lights(self.registry.as_dicts())
+
+    def show_light(self, entry):
+        """Add (or update) a light's row in the device list and its checkbox in the group box."""
+        light_name = entry.display_name
+        if entry.ip not in self.lightCheckBoxes:
+            checkbox = QCheckBox(light_name, self.groupBox)
+            self.lightCheckBoxes[entry.ip] = checkbox
+            self.groupBoxLayout.addWidget(checkbox)
         else:
-            for light in self.lights:
-                # Set or update the light's name if not already named
-                if light.ip not in self.light_names or not self.light_names[light.ip]:
-                    self.light_names[light.ip] = light.ip  # Use IP as fallback if no name
-
-                # Ensure each light has a checkbox, or create one if it doesn’t
-                light_name = self.light_names[light.ip]
-                if light.ip not in self.lightCheckBoxes:
-                    checkbox = QCheckBox(light_name, self.groupBox)
-                    self.lightCheckBoxes[light.ip] = checkbox
-                    self.groupBoxLayout.addWidget(checkbox)
-                else:
-                    # Update checkbox text if the name has changed
-                    self.lightCheckBoxes[light.ip].setText(light_name)
+            # Update checkbox text if the name has changed
+            self.lightCheckBoxes[entry.ip].setText(light_name)
+        self.on_light_state_updated(entry.ip, self.format_light_info(entry))
+        self.state_service.subscribe(entry.ip)
+        self.groupBox.show()
+
+    def remove_light(self, ip):
+        """Forget a light and take it out of the device list and the group box."""
+        entry = self.registry.remove(ip)
+        self.state_service.unsubscribe(ip)
+        if entry is not None and entry.row is not None:
+            self.listWidget.takeItem(self.listWidget.row(entry.row))
+        checkbox = self.lightCheckBoxes.pop(ip, None)
+        if checkbox is not None:
+            checkbox.deleteLater()
+
+    def restore_cached_lights(self):
+        """Show the lights of the last session right away; they are verified in the background."""
+        self.light_cache.load()
+        entries = self.light_cache.restore(self.registry)
+        for entry in entries:
+            if entry.model:
+                self.dispatcher.set_model(entry.ip, entry.model)
+            self.show_light(entry)
+        if entries:
+            self.statusLabel.setText(f"{len(entries)} light(s) from the last session, checking they are still there...")
+            QTimer.singleShot(0, self.verifyCachedLights)
 
-                # Asynchronously update the light's state in the list widget
-                asyncio.create_task(self.update_light_state(light))
-
-            self.groupBox.show()
+    @asyncSlot()
+    async def verifyCachedLights(self):
+        await self.verify_lights(self.registry.ips())
+
+    async def verify_lights(self, ips):
+        """Ask each light for its state directly; lights that don't answer are removed."""
+        if not ips:
+            return
+
+        async def check(ip):
+            result = await get_pilot(ip, timeout=LIGHT_DEADLINE)
+            self.state_service.update(ip, result)  # Shown through on_light_state_changed
+            entry = self.registry.get(ip)
+            if entry is not None and entry.model is None:
+                asyncio.create_task(self.identify_light(ip))
+
+        results = await fan_out(ips, check)
+        missing = [ip for ip, status in results.items() if status != "ok"]
+        for ip in missing:
+            log.warning("Light %s did not answer, removing it.", ip)
+            self.remove_light(ip)
+        if missing:
+            self.update_pattern_editor_lights()
+        self.statusLabel.setText(f"{len(results) - len(missing)} light(s) confirmed, {len(missing)} not responding.")
+        self.light_cache.save(self.registry)
 
     def on_light_state_updated(self, ip, light_info):
         """Update the main device list with the new light state."""
-        for index in range(self.listWidget.count()):
-            if self.listWidget.item(index).text().startswith(ip):
-                self.listWidget.item(index).setText(light_info)
-                return
-        self.listWidget.addItem(light_info)
+        entry = self.registry.get(ip)
+        if entry is None:
+            return
+        if entry.row is None:
+            # The row remembers its light's IP, so selections map back to the light directly
+            row = QListWidgetItem(light_info)
+            row.setData(Qt.UserRole, ip)
+            self.listWidget.addItem(row)
+            self.registry.set_row(ip, row)
+        else:
+            entry.row.setText(light_info)
+            entry.row.setData(Qt.UserRole, ip)  # The light may have moved to a new IP
 
-    async def update_light_state(self, light):
-        try:
-            # Retrieve the light's current state
-            state = await light.updateState()
-            light_name = self.light_names.get(light.ip, light.ip)
-
-            # Format light info with state details
-            light_info = f"{light_name} - {'ON' if state.get_state() else 'OFF'}, " \
-                        f"Color: {state.get_rgb()}, Mode: {state.get_scene()}"
-
-            # Update or add the light's information in the main device list
-            for index in range(self.listWidget.count()):
-                if self.listWidget.item(index).text().startswith(light.ip):
-                    self.listWidget.item(index).setText(light_info)
-                    return
+    def format_light_info(self, entry):
+        """Return the device list text for a light from its last known state."""
+        state = entry.state
+        if state is None:
+            return entry.display_name
+        return f"{entry.display_name} - {'ON' if state.get_state() else 'OFF'}, " \
+               f"Color: {state.get_rgb()}, Mode: {state.get_scene()}"
 
-            # Add the light info if not already present in the list
-            self.listWidget.addItem(light_info)
+    @asyncSlot()
+    async def startStateService(self):
+        await self.state_service.start()
 
-        except Exception as e:
-            print(f"Error updating light {light.ip}: {e}")
+    def on_light_state_changed(self, ip, state):
+        """Show a light's new state, pushed by the light or polled by the state service."""
+        entry = self.registry.update_state(ip, state)
+        if entry is not None:
+            self.on_light_state_updated(ip, self.format_light_info(entry))
 
-    @asyncSlot()
-    async def renameLight(self):
+    async def identify_light(self, ip):
+        """Ask a light for its model, so the dispatcher uses that model's rate limit."""
+        try:
+            config = await get_system_config(ip, timeout=LIGHT_DEADLINE)
+        except (asyncio.TimeoutError, OSError) as e:
+            log.error("Could not get the model of light %s: %r", ip, e)
+            return
+        entry = self.registry.get(ip)
+        model = config.get("moduleName")
+        if entry is not None and model:
+            entry.model = model
+            self.dispatcher.set_model(ip, model)
+
+    def selected_light_ip(self):
+        """Return the IP of the light selected in the device list, or None."""
         current_item = self.listWidget.currentItem()
-        if current_item:
-            current_name = current_item.text().split(' - ')[0]
+        if current_item is None:
+            return None
+        return current_item.data(Qt.UserRole)
+
+    def renameLight(self):
+        selected_ip = self.selected_light_ip()
+        if selected_ip:
+            current_name = self.registry.name(selected_ip)
             new_name, ok = QInputDialog.getText(self, 'Rename Light', 'Enter new name:', text=current_name)
             if ok and new_name:
-                for light in self.lights:
-                    if self.light_names.get(light.ip, light.ip) == current_name:
-                        self.light_names[light.ip] = new_name
-                        break
-                self.listWidget.clear()
-                for light in self.lights:
-                    state = await light.updateState()
-                    light_name = self.light_names.get(light.ip, light.ip)
-                    is_on = state.get_state()
-                    self.listWidget.addItem(f"{light_name} - {'ON' if is_on else 'OFF'}")
-                for light in self.lights:
-                    if light.ip in self.lightCheckBoxes:
-                        self.lightCheckBoxes[light.ip].setText(self.light_names.get(light.ip, light.ip))
+                entry = self.registry.rename(selected_ip, new_name)
+                if entry is None:
+                    return
+                if entry.row is not None:
+                    entry.row.setText(self.format_light_info(entry))
+                if selected_ip in self.lightCheckBoxes:
+                    self.lightCheckBoxes[selected_ip].setText(new_name)
+                self.light_cache.save(self.registry)
 
     def openColorPicker(self):
         color = QColorDialog.getColor()
@@ -468,33 +643,46 @@ class LightApp(QMainWindow):
 
     def setLightColor(self, color):
         rgb = (color.red(), color.green(), color.blue())
-        current_item = self.listWidget.currentItem()
-        if current_item:
-            selected_ip = current_item.text().split(' - ')[0]
-            for light in self.lights:
-                if light.ip == selected_ip:
-                    asyncio.create_task(light.turn_on(PilotBuilder(rgb=rgb)))
-                    break
+        selected_ip = self.selected_light_ip()
+        if selected_ip:
+            if selected_ip in self.registry:
+                self.dispatcher.submit(selected_ip, "color", encode_pilot(rgb=rgb))
         else:
             self.statusLabel.setText("Please select a light to change its color.")
 
-    def get_broadcast_address(self):
-        # You can replace this with the logic to get the current broadcast address
-        return "255.255.255.255"  # Default address
+    def get_broadcast_addresses(self):
+        """Return the broadcast addresses discovery uses, as saved in the Settings tab."""
+        return list(self.discovery_settings["broadcast_addresses"])
 
     def save_broadcast_address(self):
-        # Get the text from the broadcast input field
-        broadcast_address = self.broadcast_input.text()
-
-        # Validate the broadcast address (simple example, you can improve this)
-        if self.is_valid_broadcast_address(broadcast_address):
-            # Save the broadcast address to a config or internal variable
-            self.broadcast_address = broadcast_address
-            print(f"Broadcast address saved: {broadcast_address}")
-            self.statusLabel.setText("Broadcast address saved successfully.")
+        # The field holds one or more addresses, separated by commas
+        broadcast_addresses = [address.strip() for address in self.broadcast_input.text().split(",") if address.strip()]
+
+        if all(self.is_valid_broadcast_address(address) for address in broadcast_addresses):
+            self.discovery_settings["broadcast_addresses"] = broadcast_addresses
+            self.discovery_settings["interfaces"] = self.interface_broadcast_checkbox.isChecked()
+            save_discovery_settings(self.discovery_settings)
+            log.info("Broadcast addresses saved: %s", broadcast_addresses)
+            self.statusLabel.setText("Broadcast addresses saved successfully.")
         else:
             self.statusLabel.setText("Invalid broadcast address. Please try again.")
 
+    def save_sweep_settings(self):
+        """Save the discovery mode and sweep settings from the Settings tab."""
+        networks = [network.strip() for network in self.sweep_networks_input.text().split(",") if network.strip()]
+        invalid = [network for network in networks if not is_valid_network(network)]
+        if invalid:
+            self.statusLabel.setText(f"Invalid network: {invalid[0]}. Use CIDR notation, e.g. 192.168.0.0/22.")
+            return
+        settings = self.discovery_settings
+        settings["mode"] = self.discovery_mode_combo.currentData()
+        settings["sweep_networks"] = networks
+        settings["sweep_concurrency"] = self.sweep_concurrency_spinbox.value()
+        settings["probe_timeout"] = self.probe_timeout_spinbox.value() / 1000
+        settings["expected_lights"] = self.expected_lights_spinbox.value()
+        save_discovery_settings(settings)
+        self.statusLabel.setText("Discovery settings saved successfully.")
+
     def is_valid_broadcast_address(self, address):
         # Simple check to ensure the address looks like a valid broadcast address
         # This can be improved to be more robust if needed
@@ -517,20 +705,16 @@ class LightApp(QMainWindow):
     async def updateBrightness(self):
         """
         Update the brightness of the selected lights in the group in real-time and update the label.
+        Values are coalesced per light, so only the latest slider position is sent once a light is free.
         """
         brightness = self.brightnessSlider.value()  # Get the brightness value from the slider
         self.brightnessLabel.setText(f"Brightness: {brightness}")  # Update the brightness label
 
         selected_lights = [ip for ip, checkbox in self.lightCheckBoxes.items() if checkbox.isChecked()]
+        payload = encode_pilot(brightness=brightness)  # Encoded once for every selected light
 
-        for light in self.lights:
-            if light.ip in selected_lights:
-                try:
-                    # Use PilotBuilder to create a new state with the desired brightness
-                    pilot = PilotBuilder(brightness=brightness)
-                    await light.turn_on(pilot)  # Turn on the light with the updated brightness
-                except Exception as e:
-                    print(f"Error updating brightness for light {light.ip}: {e}")
+        # Turn on the lights with the updated brightness, all lights at once
+        await self.sendToLights([ip for ip in selected_lights if ip in self.registry], "dimming", payload)
 
 
 
@@ -539,10 +723,18 @@ class LightApp(QMainWindow):
         selected_lights = [ip for ip, checkbox in self.lightCheckBoxes.items() if checkbox.isChecked()]
         color = QColorDialog.getColor()
         if color.isValid():
-            rgb = (color.red(), color.green(), color.blue())
-            for light in self.lights:
-                if light.ip in selected_lights:
-                    await light.turn_on(PilotBuilder(rgb=rgb))
+            payload = encode_pilot(rgb=(color.red(), color.green(), color.blue()))
+            await self.sendToLights([ip for ip in selected_lights if ip in self.registry], "color", payload)
+
+    async def sendToLights(self, ips, key, payload):
+        """
+        Send one command to several lights concurrently and report the lights that did not answer.
+        """
+        results = await self.dispatcher.submit_group(ips, key, payload)
+        failed = [ip for ip, status in results.items() if status in ("timeout", "error")]
+        if failed:
+            self.statusLabel.setText(f"Group command: {summarize(results)} ({', '.join(failed)})")
+        return results
 
 
 
@@ -574,7 +766,7 @@ class LightApp(QMainWindow):
 
 
     def open_config_gui(self):
-        current_theme = self.theme_combo.currentText()
+        current_theme = self.current_theme
 
         try:
             # Determine the executable path based on the environment
@@ -585,15 +777,15 @@ class LightApp(QMainWindow):
                 base_path = os.path.abspath(".")
                 script_path = os.path.join(base_path, 'config_gui.exe')
 
-            print(f"Trying to open config_gui.exe from: {script_path}")  # Debug statement
+            log.debug("Trying to open config_gui.exe from: %s", script_path)
 
             subprocess.Popen([script_path, current_theme])  # Pass the theme as an argument
         except FileNotFoundError:
-            print(f"config_gui.exe not found at: {script_path}")
+            log.warning("config_gui.exe not found at: %s", script_path)
 
 
     def open_volume_config_gui(self):
-        current_theme = self.theme_combo.currentText()
+        current_theme = self.current_theme
 
         try:
             # Determine the executable path based on the environment
@@ -604,11 +796,11 @@ class LightApp(QMainWindow):
                 base_path = os.path.abspath(".")
                 script_path = os.path.join(base_path, 'volume_config_gui.exe')
 
-            print(f"Trying to open volume_config_gui.exe from: {script_path}")  # Debugging
+            log.debug("Trying to open volume_config_gui.exe from: %s", script_path)
 
             subprocess.Popen([script_path, current_theme])  # Pass theme
         except FileNotFoundError:
-            print(f"volume_config_gui.exe not found at: {script_path}")
+            log.warning("volume_config_gui.exe not found at: %s", script_path)
 
 
 
@@ -636,8 +828,8 @@ class LightApp(QMainWindow):
             self.pattern_editor.activateWindow()
         else:
             # Create and show the pattern editor, passing the discovered lights
-            lights_list = [{"ip": light.ip, "name": self.light_names.get(light.ip, light.ip)} for light in self.lights]
-            self.pattern_editor = PatternEditor(discovered_lights=lights_list)
+            from pattern_editor import PatternEditor  # Imported on first use, it brings the preview with it
+            self.pattern_editor = PatternEditor(discovered_lights=self.registry.as_dicts(), pattern_library=self.pattern_library)
             self.pattern_editor.show()
 
 
@@ -646,49 +838,64 @@ class LightApp(QMainWindow):
         current_item = self.patternListWidget.currentItem()
         if current_item:
             pattern_name = current_item.text()
-            print(f"Attempting to run pattern: {pattern_name}")
-            for pattern in self.patterns:
-                if pattern.get("name") == pattern_name:
+            log.info("Attempting to run pattern: %s", pattern_name)
+            # Only the header is kept for listing, load the steps (off the Qt thread) to run it
+            path = current_item.data(Qt.UserRole)
+            if path and self.pattern_library is not None:
+                # Loading may evict (and close) the binary pattern that is playing now, stop it first
+                self.stopPattern()
+                loop = asyncio.get_running_loop()
+                pattern = await loop.run_in_executor(None, self.pattern_library.pattern, path)
+                if pattern is not None:
                     await self.startPattern(pattern)
-                    break
         else:
-            print("No pattern selected.")
+            log.warning("No pattern selected.")
 
-    async def runPattern(self, pattern):
+    async def runPattern(self, pattern, timeline=None):
         """Updates lights according to the specified pattern."""
-        steps = pattern.get("steps", [])
+        version = self.registry.version if timeline is not None else None
+
+        def refresh():
+            # The pattern is compiled once and only recompiled when the set of lights changes
+            nonlocal version
+            if version == self.registry.version:
+                return None
+            version = self.registry.version
+            timeline = compile_pattern(pattern, self.registry.ips())
+            for light_ip in timeline.missing:
+                log.warning("Light with IP %s not found.", light_ip)
+            return timeline
+
+        runner = PatternRunner(timeline, self.fireStep, policy=self.late_step_policy)
+        self.pattern_runner = runner
+        self.pilot_tracker = PilotTracker(self.full_refresh_interval)
         try:
-            while True:  # Infinite loop
-                for step in steps:
-                    duration = step.get("duration", 0) / 1000  # Convert milliseconds to seconds
-                    tasks = []
-
-                    if step.get("light_ip") == "all":
-                        # Apply to all lights if "all" is specified as the light_ip
-                        action = step.get("action")
-                        for light in self.lights:
-                            tasks.append(self.performAction(light, action, step))
-                    else:
-                        # Apply to specific lights
-                        light_ips = step.get("light_ip")
-                        if isinstance(light_ips, str):
-                            light_ips = [light_ips]  # Ensure light_ips is a list
-                        for light_ip in light_ips:
-                            light = next((l for l in self.lights if l.ip == light_ip), None)
-                            if light:
-                                action = step.get("action")
-                                tasks.append(self.performAction(light, action, step))
-                            else:
-                                print(f"Light with IP {light_ip} not found.")
-
-                    if tasks:
-                        await asyncio.gather(*tasks)
-                    else:
-                        print(f"No tasks to execute for step: {step}")
-                    
-                    await asyncio.sleep(duration)  # Delay based on duration
+            await runner.run(refresh)
+        except PatternCompileError as e:
+            log.error("Pattern '%s' could not be compiled: %s", pattern.get('name'), e)
+            self.statusLabel.setText(f"Pattern error: {e}")
         except asyncio.CancelledError:
-            print("Pattern task was canceled.")
+            log.info("Pattern task was canceled.")
+        finally:
+            for key in PILOT_KEYS:
+                self.dispatcher.discard(key)  # Don't send steps that were still queued
+            log.info("Pattern run: %s; %s; %s", runner.stats.summary(), self.pilot_tracker.summary(), self.dispatcher.summary())
+
+    def fireStep(self, step):
+        """Queue a timeline step for its lights without waiting for them to answer."""
+        tracker = self.pilot_tracker
+        for ip in step.targets:
+            command = tracker.plan(ip, step)  # Only what changed since the last step
+            if command is None:
+                continue
+            # Each light gets its own deadline and a newer step replaces one that is still queued
+            future = self.dispatcher.submit(ip, command[0], command[1], timeout=LIGHT_DEADLINE)
+            future.add_done_callback(lambda f, ip=ip: self.onStepSent(tracker, ip, f))
+
+    def onStepSent(self, tracker, ip, future):
+        """Make sure a light that missed a step gets a full command with the next one."""
+        if future.cancelled() or future.result() in ("timeout", "error"):
+            tracker.forget(ip)
 
 
     async def performAction(self, light, action, light_info):
@@ -698,20 +905,18 @@ class LightApp(QMainWindow):
                 color = light_info.get("color", [255, 255, 255])
                 brightness = light_info.get("brightness", 255)
 
-                # Ensure color components are integers
-                color = {k: int(v) for k, v in color.items()}
-
-                # Debugging output to check types
-                print(f"Color: {color}, Type: {type(color)}")
-                print(f"Brightness: {brightness}, Type: {type(brightness)}")
+                # Accept both {"r", "g", "b"} and [r, g, b] colors as integers
+                color = dict(zip("rgb", normalize_color(color)))
 
-                await light.turn_on(PilotBuilder(rgb=(color['r'], color['g'], color['b']), brightness=brightness))
+                payload = encode_pilot(rgb=(color['r'], color['g'], color['b']), brightness=brightness)
             elif action == "turn_off":
-                await light.turn_off()
-        except asyncio.TimeoutError:
-            print(f"Timeout while performing action '{action}' for light {light.ip}")
+                payload = encode_pilot(state=False)
+            else:
+                return None  # Unknown actions are ignored
+            return await self.dispatcher.submit(light.ip, "pilot", payload, timeout=LIGHT_DEADLINE)
         except Exception as e:
-            print(f"Error while performing action '{action}' for light {light.ip}: {e}")
+            log.error("Error while performing action '%s' for light %s: %s", action, light.ip, e)
+            return "error"
 
 
     async def startPattern(self, pattern):
@@ -722,61 +927,111 @@ class LightApp(QMainWindow):
                 await self.current_pattern_task  # Wait for the task to be canceled
             except asyncio.CancelledError:
                 pass
-            print("Stopped previous pattern task.")
-        self.current_pattern_task = asyncio.create_task(self.runPattern(pattern))
-        print(f"Started new pattern task for {pattern.get('name')}")
+            log.info("Stopped previous pattern task.")
+        try:
+            # Compile up front so a broken pattern is reported before anything is sent
+            timeline = compile_pattern(pattern, self.registry.ips())
+        except PatternCompileError as e:
+            log.error("Pattern '%s' could not be compiled: %s", pattern.get('name'), e)
+            self.statusLabel.setText(f"Pattern error: {e}")
+            self.current_pattern_task = None
+            return
+        for light_ip in timeline.missing:
+            log.warning("Light with IP %s not found.", light_ip)
+        self.preflightPattern(timeline)
+        self.current_pattern_task = asyncio.create_task(self.runPattern(pattern, timeline))
+        log.info("Started new pattern task for %s", pattern.get('name'))
+
+    def preflightPattern(self, timeline):
+        """Simulate the start of a pattern and warn about lights it would send more commands than their rate limit."""
+        report = simulate(
+            timeline, cycles=PREFLIGHT_CYCLES, max_steps=PREFLIGHT_STEPS, until=PREFLIGHT_SECONDS,
+            refresh_interval=self.full_refresh_interval, max_commands=PREFLIGHT_COMMANDS
+        )
+        overloaded = {}
+        for ip in report.peaks:
+            limit = self.dispatcher.bucket(ip).rate
+            if 0 < limit < report.peak(ip):
+                overloaded[ip] = report.peak(ip)
+                log.warning(
+                    "Pattern '%s' sends up to %.0f commands/sec to %s, which takes %g/sec; "
+                    "the rest are throttled and coalesced.", timeline.name, report.peak(ip), ip, limit
+                )
+        if not overloaded:
+            return
+        busiest = max(overloaded.values())
+        self.statusLabel.setText(f"Warning: pattern sends up to {busiest:.0f} commands/sec to {len(overloaded)} light(s)")
 
     def stopPattern(self):
         """Stops the currently running pattern."""
         if self.current_pattern_task:
             self.current_pattern_task.cancel()
             self.current_pattern_task = None
-            print("Pattern stopped.")  # Debugging line
-
-    def loadPatterns(self):
-        self.patternListWidget.clear()
-        self.patterns = []  # Reset patterns list
-
-        if getattr(sys, '_MEIPASS', False):  # If running as a packaged app
-            pattern_dir = os.path.join(sys._MEIPASS, 'patterns')
-        else:
-            pattern_dir = os.path.join(os.path.abspath("."), 'patterns')
-
-        print(f"Pattern directory path: {pattern_dir}")  # Debug statement
+            log.info("Pattern stopped.")
 
+    @asyncSlot()
+    async def loadPatterns(self):
+        """Bring the pattern list in line with the patterns directory, parsing only changed files."""
+        if self.pattern_library is None:
+            if getattr(sys, '_MEIPASS', False):  # If running as a packaged app
+                pattern_dir = os.path.join(sys._MEIPASS, 'patterns')
+            else:
+                pattern_dir = os.path.join(os.path.abspath("."), 'patterns')
+            log.debug("Pattern directory path: %s", pattern_dir)
+            self.pattern_library = PatternLibrary(pattern_dir, memory_budget=self.pattern_memory_budget)
+            if getattr(self, 'pattern_editor', None) is not None:
+                self.pattern_editor.set_pattern_library(self.pattern_library)
+
+        if self.patterns_loading:
+            return  # A reload is already running
+        self.patterns_loading = True
         try:
-            pattern_files = [f for f in os.listdir(pattern_dir) if f.endswith(".json")]
-
-            # Sort the pattern filenames alphabetically
-            pattern_files.sort()
-
-            for filename in pattern_files:
-                try:
-                    with open(os.path.join(pattern_dir, filename)) as f:
-                        pattern = json.load(f)
-                        self.patterns.append(pattern)
-                        self.patternListWidget.addItem(pattern.get("name", "Unnamed Pattern"))
-                except json.JSONDecodeError as e:
-                    print(f"Error loading {filename}: {e}")
-                except Exception as e:
-                    print(f"Unexpected error with {filename}: {e}")
-
-            if not self.patternListWidget.count():
-                self.patternListWidget.addItem("No patterns found.")
+            # Stat (and parse) the files off the Qt thread so the UI stays responsive
+            loop = asyncio.get_running_loop()
+            added, changed, removed = await loop.run_in_executor(None, self.pattern_library.reload)
         except FileNotFoundError:
-            print(f"Pattern directory not found: {pattern_dir}")
+            log.warning("Pattern directory not found: %s", self.pattern_library.directory)
+            added, changed, removed = [], [], list(self.pattern_items)
+        finally:
+            self.patterns_loading = False
+        self.update_pattern_list(added, changed, removed)
+
+    def update_pattern_list(self, added, changed, removed):
+        """Update the pattern list items in place after a library reload."""
+        if self.patternListWidget.count() and self.patternListWidget.item(0).data(Qt.UserRole) is None:
+            self.patternListWidget.takeItem(0)  # The "No patterns found." placeholder
+
+        for path in removed:
+            item = self.pattern_items.pop(path, None)
+            if item is not None:
+                self.patternListWidget.takeItem(self.patternListWidget.row(item))
+
+        for path in changed:
+            item = self.pattern_items.get(path)
+            if item is not None:
+                item.setText(self.pattern_library.get(path).name)
+
+        if added:
+            paths = self.pattern_library.paths()
+            rows = {path: row for row, path in enumerate(paths)}
+            for path in added:  # Sorted, so every earlier file is already in the list
+                item = QListWidgetItem(self.pattern_library.get(path).name)
+                item.setData(Qt.UserRole, path)
+                self.patternListWidget.insertItem(rows[path], item)
+                self.pattern_items[path] = item
+
+        if not self.patternListWidget.count():
             self.patternListWidget.addItem("No patterns found.")
-
+        elif changed:
+            self.display_selected_pattern_description()
 
     def display_selected_pattern_description(self):
         current_item = self.patternListWidget.currentItem()
-        if current_item:
-            pattern_name = current_item.text()
-            for pattern in self.patterns:
-                if pattern.get("name") == pattern_name:
-                    description = pattern.get("description", "No description available.")
-                    self.patternDescriptionLabel.setText(description)
-                    return
+        path = current_item.data(Qt.UserRole) if current_item else None
+        entry = self.pattern_library.get(path) if path and self.pattern_library else None
+        if entry is not None:
+            self.patternDescriptionLabel.setText(entry.description)
+            return
         self.patternDescriptionLabel.setText("Select a pattern to see its description here.")
 
 
@@ -787,23 +1042,58 @@ class LightApp(QMainWindow):
     def init_settings_tab(self):
         layout = QVBoxLayout(self.settings_tab)
         
-        # Label and input for broadcast address
-        self.broadcast_label = QLabel("Set Broadcast Address:", self)
+        # Label and input for the broadcast addresses, one per subnet/VLAN
+        self.broadcast_label = QLabel("Set Broadcast Addresses (comma separated):", self)
         self.broadcast_input = QLineEdit(self)
-        self.broadcast_input.setText(self.get_broadcast_address())  # Pre-fill with current address if available
-        self.broadcast_input.setPlaceholderText("Enter Broadcast Address (e.g., 192.168.1.255)")
+        self.broadcast_input.setText(", ".join(self.get_broadcast_addresses()))  # Pre-fill with the saved addresses
+        self.broadcast_input.setPlaceholderText("Enter Broadcast Addresses (e.g., 192.168.1.255, 192.168.20.255)")
+        self.interface_broadcast_checkbox = QCheckBox("Also broadcast on every network interface", self)
+        self.interface_broadcast_checkbox.setChecked(self.discovery_settings["interfaces"])
 
         # Add the label and input to the layout
         layout.addWidget(self.broadcast_label)
         layout.addWidget(self.broadcast_input)
+        layout.addWidget(self.interface_broadcast_checkbox)
 
-        # Button to save the broadcast address
-        self.save_broadcast_button = QPushButton("Save Broadcast Address", self)
+        # Button to save the broadcast addresses
+        self.save_broadcast_button = QPushButton("Save Broadcast Addresses", self)
         self.save_broadcast_button.clicked.connect(self.save_broadcast_address)
 
         # Add the button to the layout
         layout.addWidget(self.save_broadcast_button)
 
+        # Discovery without broadcasts: ask every address of some networks directly
+        discovery_mode_label = QLabel("Discover Lights By:")
+        self.discovery_mode_combo = QComboBox()
+        self.discovery_mode_combo.addItem("Broadcast", BROADCAST)
+        self.discovery_mode_combo.addItem("Unicast sweep (for networks that block broadcasts)", SWEEP)
+        self.discovery_mode_combo.setCurrentIndex(self.discovery_mode_combo.findData(self.discovery_settings["mode"]))
+        sweep_networks_label = QLabel("Networks to Sweep (CIDR, comma separated, empty = local networks):")
+        self.sweep_networks_input = QLineEdit(self)
+        self.sweep_networks_input.setText(", ".join(self.discovery_settings["sweep_networks"]))
+        self.sweep_networks_input.setPlaceholderText("e.g., 192.168.0.0/22, 10.0.20.0/24")
+        sweep_concurrency_label = QLabel("Addresses Probed at Once:")
+        self.sweep_concurrency_spinbox = QSpinBox()
+        self.sweep_concurrency_spinbox.setRange(1, 1024)
+        self.sweep_concurrency_spinbox.setValue(self.discovery_settings["sweep_concurrency"])
+        probe_timeout_label = QLabel("Probe Timeout (ms):")
+        self.probe_timeout_spinbox = QSpinBox()
+        self.probe_timeout_spinbox.setRange(50, 10000)
+        self.probe_timeout_spinbox.setValue(round(self.discovery_settings["probe_timeout"] * 1000))
+        expected_lights_label = QLabel("Stop Once This Many Lights Answered (0 = sweep everything):")
+        self.expected_lights_spinbox = QSpinBox()
+        self.expected_lights_spinbox.setRange(0, 4096)
+        self.expected_lights_spinbox.setValue(self.discovery_settings["expected_lights"])
+        self.save_sweep_button = QPushButton("Save Discovery Settings", self)
+        self.save_sweep_button.clicked.connect(self.save_sweep_settings)
+
+        for widget in (
+            discovery_mode_label, self.discovery_mode_combo, sweep_networks_label, self.sweep_networks_input,
+            sweep_concurrency_label, self.sweep_concurrency_spinbox, probe_timeout_label, self.probe_timeout_spinbox,
+            expected_lights_label, self.expected_lights_spinbox, self.save_sweep_button
+        ):
+            layout.addWidget(widget)
+
         # Set the layout for the settings tab
         self.settings_tab.setLayout(layout)
 
@@ -817,7 +1107,7 @@ class LightApp(QMainWindow):
         else:
             base_path = os.path.join(os.path.abspath("."), 'themes')
 
-        print(f"Theme directory path: {base_path}")  # Debug statement
+        log.debug("Theme directory path: %s", base_path)
 
         try:
             theme_files = [f.replace('.qss', '') for f in os.listdir(base_path) if f.endswith('.qss')]
@@ -848,6 +1138,57 @@ class LightApp(QMainWindow):
         layout.addWidget(theme_label)
         layout.addWidget(self.theme_combo)
 
+        # Late-step policy for the pattern runner
+        late_step_label = QLabel("When a Pattern Step Runs Late:")
+        self.late_step_combo = QComboBox()
+        self.late_step_combo.addItem("Catch up (keep the original timing)", CATCH_UP)
+        self.late_step_combo.addItem("Skip steps that are already over", SKIP)
+        self.late_step_combo.addItem("Stretch (shift the rest of the pattern)", STRETCH)
+        self.late_step_combo.setCurrentIndex(LATE_POLICIES.index(self.late_step_policy))
+        self.late_step_combo.currentIndexChanged.connect(self.change_late_step_policy)
+
+        layout.addWidget(late_step_label)
+        layout.addWidget(self.late_step_combo)
+
+        # Patterns only send what changed, with a full command to every light now and then
+        full_refresh_label = QLabel("Resend Full Pattern State Every (seconds, 0 = never):")
+        self.full_refresh_spinbox = QSpinBox()
+        self.full_refresh_spinbox.setRange(0, 3600)
+        self.full_refresh_spinbox.setValue(self.full_refresh_interval)
+        self.full_refresh_spinbox.valueChanged.connect(self.change_full_refresh_interval)
+
+        layout.addWidget(full_refresh_label)
+        layout.addWidget(self.full_refresh_spinbox)
+
+        # How much pattern data stays loaded after patterns were run
+        memory_budget_label = QLabel("Pattern Memory Budget (MB):")
+        self.memory_budget_spinbox = QSpinBox()
+        self.memory_budget_spinbox.setRange(1, 4096)
+        self.memory_budget_spinbox.setValue(self.pattern_memory_budget // (1024 * 1024))
+        self.memory_budget_spinbox.valueChanged.connect(self.change_pattern_memory_budget)
+
+        layout.addWidget(memory_budget_label)
+        layout.addWidget(self.memory_budget_spinbox)
+
+        # Rate limit for lights whose model has no limit of its own in rate_limits.json
+        burst, rate = self.dispatcher.limits.default
+        rate_label = QLabel("Commands per Second to Each Light (0 = no limit):")
+        self.rate_spinbox = QDoubleSpinBox()
+        self.rate_spinbox.setRange(0, 100)
+        self.rate_spinbox.setDecimals(1)
+        self.rate_spinbox.setValue(rate)
+        self.rate_spinbox.valueChanged.connect(self.change_rate_limit)
+        burst_label = QLabel("Commands a Light May Get in a Burst:")
+        self.burst_spinbox = QSpinBox()
+        self.burst_spinbox.setRange(1, 100)
+        self.burst_spinbox.setValue(burst)
+        self.burst_spinbox.valueChanged.connect(self.change_rate_limit)
+
+        layout.addWidget(rate_label)
+        layout.addWidget(self.rate_spinbox)
+        layout.addWidget(burst_label)
+        layout.addWidget(self.burst_spinbox)
+
 
 
     @pyqtSlot(str)
@@ -857,7 +1198,28 @@ class LightApp(QMainWindow):
         """
         load_stylesheet(QApplication.instance(), theme_name)
         self.apply_theme_effects(theme_name)
+        self.current_theme = theme_name
+
+
+    def change_late_step_policy(self, index):
+        """Use the selected late-step policy for patterns started from now on."""
+        self.late_step_policy = self.late_step_combo.itemData(index)
+
+    def change_full_refresh_interval(self, value):
+        """Use the new full refresh interval for patterns started from now on."""
+        self.full_refresh_interval = value
+
+    def change_pattern_memory_budget(self, value):
+        """Change how many MB of loaded patterns are kept; takes effect with the next pattern loaded."""
+        self.pattern_memory_budget = value * 1024 * 1024
+        if self.pattern_library is not None:
+            self.pattern_library.memory_budget = self.pattern_memory_budget
+
 
+    def change_rate_limit(self, _value=None):
+        """Use the new default rate limit for every light without a model-specific one."""
+        limits = self.dispatcher.limits
+        self.dispatcher.set_limits(RateLimits((self.burst_spinbox.value(), self.rate_spinbox.value()), limits.models))
 
     def apply_drop_shadow(self, widget):
         shadow_effect = QGraphicsDropShadowEffect()
@@ -884,6 +1246,11 @@ class LightApp(QMainWindow):
 
     def closeEvent(self, event):
         self.stopPattern()  # Stop any running patterns
+        self.dispatcher.close()  # Drop commands that are still queued
+        self.state_service.close()  # Stop listening for pushed light states
+        close_transport()  # Release the shared light socket
+        self.light_cache.save(self.registry)  # Lights, names and states for the next launch
+        self.write_metrics_snapshot()  # Metrics of this session, for looking into problems later
         event.accept()  # Accept the event to close the application
 
 
@@ -891,6 +1258,91 @@ class LightApp(QMainWindow):
 
 
 
+# DIAGNOSTICS
+
+    def init_diagnostics_tab(self):
+        layout = QVBoxLayout(self.diagnostics_tab)
+
+        self.metrics_checkbox = QCheckBox("Collect Metrics", self)
+        self.metrics_checkbox.setChecked(self.metrics.enabled)
+        self.metrics_checkbox.toggled.connect(self.toggle_metrics)
+        layout.addWidget(self.metrics_checkbox)
+
+        # One row per light: what was sent to it, how it ended and how long the light took
+        self.metrics_table = QTableWidget(0, 8, self)
+        self.metrics_table.setHorizontalHeaderLabels(
+            ["Light", "Sent", "OK", "Timeouts", "Errors", "Latency p50 (ms)", "p99 (ms)", "Max (ms)"]
+        )
+        self.metrics_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.metrics_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.metrics_table)
+
+        self.metrics_label = QLabel(self)
+        self.metrics_label.setWordWrap(True)
+        layout.addWidget(self.metrics_label)
+
+        reset_button = QPushButton("Reset Metrics", self)
+        reset_button.clicked.connect(self.reset_metrics)
+        layout.addWidget(reset_button)
+        snapshot_button = QPushButton("Write Snapshot File Now", self)
+        snapshot_button.clicked.connect(self.write_metrics_snapshot)
+        layout.addWidget(snapshot_button)
+
+        # The tab is only refreshed while it is shown
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.timeout.connect(self.refresh_diagnostics)
+        self.diagnostics_timer.start(1000)
+
+    def refresh_diagnostics(self):
+        if self.tabs.currentWidget() is not self.diagnostics_tab:
+            return
+
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+        lights = self.metrics.lights
+        self.metrics_table.setRowCount(len(lights))
+        for row, (ip, light) in enumerate(sorted(lights.items())):
+            latency = light.latency
+            values = (
+                self.registry.name(ip), light.sent, light.ok, light.timeouts, light.errors,
+                ms(latency.percentile(0.5)), ms(latency.percentile(0.99)), ms(latency.max if latency.count else None),
+            )
+            for column, value in enumerate(values):
+                item = self.metrics_table.item(row, column)
+                if item is None:
+                    self.metrics_table.setItem(row, column, QTableWidgetItem(str(value)))
+                elif item.text() != str(value):
+                    item.setText(str(value))
+
+        lines = []
+        lateness = self.metrics.histograms.get("pattern.step_lateness")
+        if lateness is not None and lateness.count:
+            lines.append(f"Pattern steps: {lateness.count} fired, {self.metrics.counters.get('pattern.steps_skipped', 0)} skipped, "
+                         f"lateness p50 {ms(lateness.percentile(0.5))} ms, p99 {ms(lateness.percentile(0.99))} ms, "
+                         f"max {ms(lateness.max)} ms")
+        for name, label in (("discovery.broadcast_seconds", "Broadcast discovery"), ("discovery.sweep_seconds", "Sweep")):
+            durations = self.metrics.histograms.get(name)
+            if durations is not None and durations.count:
+                lines.append(f"{label}: {durations.count} run(s), mean {durations.mean:.2f} s, max {durations.max:.2f} s")
+        lines.append(", ".join(f"{name}: {gauge()}" for name, gauge in self.metrics.gauges.items()))
+        self.metrics_label.setText("\n".join(lines))
+
+    def toggle_metrics(self, checked):
+        self.metrics.enabled = checked
+
+    def reset_metrics(self):
+        self.metrics.reset()
+        self.metrics_table.setRowCount(0)
+        self.refresh_diagnostics()
+
+    def write_metrics_snapshot(self):
+        if self.metrics.enabled:
+            self.metrics.write_snapshot()
+
+
+
+
 # SCENES
 
     def init_scenes_tab(self):
@@ -930,11 +1382,20 @@ class LightApp(QMainWindow):
         self.current_speed = max(10, min(value, 200))
         self.speedLabel.setText(f"Speed: {self.current_speed}")
 
+        # Adjust lights that are already running a scene, keeping only the latest value
+        payload = encode_pilot(speed=self.current_speed, state=None)
+        for ip in self.scene_lights:
+            self.dispatcher.submit(ip, "speed", payload)
+
 
     def updateDimming(self, value):
         self.current_dimming = value
         self.dimmingLabel.setText(f"Dimming: {value}%")
 
+        payload = encode_pilot(brightness=int((value / 100) * 255), state=None)
+        for ip in self.scene_lights:
+            self.dispatcher.submit(ip, "dimming", payload)
+
     async def applyScene(self):
         """Apply the selected scene with current speed and dimming values."""
         selected_scene = self.sceneComboBox.currentText()
@@ -946,42 +1407,53 @@ class LightApp(QMainWindow):
             speed = max(10, min(self.current_speed, 200))
             brightness = int((self.current_dimming / 100) * 255)  # Mapping to 0-255 range
 
+            payload = encode_pilot(scene=scene_id, speed=speed, brightness=brightness)
+
             if selected_lights:
                 # Apply the scene to each selected light in the Light Controls tab
-                tasks = []
-                for ip in selected_lights:
-                    light = next((l for l in self.lights if l.ip == ip), None)
-                    if light:
-                        pilot = PilotBuilder(scene=scene_id, speed=speed, brightness=brightness)
-                        tasks.append(light.turn_on(pilot))
-                await asyncio.gather(*tasks)
+                ips = [ip for ip in selected_lights if ip in self.registry]
+                self.scene_lights = set(ips)
+                await self.sendToLights(ips, "scene", payload)
             else:
                 # Apply the scene to the selected light in the Device List tab
-                current_item = self.listWidget.currentItem()
-                if current_item:
-                    selected_ip = current_item.text().split(' - ')[0]
-                    light = next((l for l in self.lights if l.ip == selected_ip), None)
-                    if light:
-                        pilot = PilotBuilder(scene=scene_id, speed=speed, brightness=brightness)
-                        await light.turn_on(pilot)
+                selected_ip = self.selected_light_ip()
+                if selected_ip:
+                    if selected_ip in self.registry:
+                        self.scene_lights = {selected_ip}
+                        await self.dispatcher.submit(selected_ip, "scene", payload)
                 else:
-                    print("No lights selected for applying the scene.")
+                    log.warning("No lights selected for applying the scene.")
         else:
-            print("Scene not found or invalid scene selected.")
+            log.warning("Scene not found or invalid scene selected.")
+
+
 
 
 
 
 
+def report_startup():
+    """Print how long each phase of the start took (--profile-startup)."""
+    startup.mark("Event loop running")
+    print(startup.report())
 
 
 if __name__ == "__main__":
+    startup.mark("Imports")
+    setup_logging()
+    startup.mark("Logging")
     app = QApplication(sys.argv)
+    startup.mark("QApplication")
     load_stylesheet(app, "dark")  # Load the "dark" theme by default
-    pyi_splash.close()
+    startup.mark("Stylesheet")
     loop = QEventLoop(app)
     asyncio.set_event_loop(loop)
     mainWindow = LightApp()
     mainWindow.show()
+    startup.mark("Show")
+    if pyi_splash is not None:
+        pyi_splash.close()  # Only now, so there is no gap between the splash and the window
+    if "--profile-startup" in sys.argv:
+        QTimer.singleShot(0, report_startup)  # Runs once the event loop has handled the show
     with loop:
         loop.run_forever()
@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import json
+import logging
+import socket
+
+from pywizlight import PilotBuilder
+
+
+log = logging.getLogger(__name__)
+
+
+# Default UDP port the WiZ lights listen on
+WIZ_PORT = 38899
+
+# Resend schedule for commands that expect an answer (same backoff pywizlight uses)
+FIRST_SEND_INTERVAL = 0.75  # Wait before the first resend
+MAX_BACKOFF = 3  # Longest wait between two resends
+TIMEOUT = 13  # How long we wait in total for an answer
+
+
+def encode_message(method, params):
+    """
+    Encode a WiZ message into the compact bytes that are sent on the wire.
+    """
+    return json.dumps({"method": method, "params": params}, separators=(",", ":")).encode("utf-8")
+
+
+@functools.lru_cache(maxsize=4096)
+def encode_pilot(rgb=None, brightness=None, scene=None, speed=None, state=True):
+    """
+    Return the setPilot payload for a command, encoding each distinct command only once.
+
+    The arguments match pywizlight's PilotBuilder (rgb must be a tuple). state=True turns the
+    light on like wizlight.turn_on, state=False turns it off and state=None leaves it untouched.
+    """
+    if state is False:
+        return encode_message("setPilot", {"state": False})
+    pilot = PilotBuilder(rgb=rgb, brightness=brightness, scene=scene, speed=speed)
+    return encode_message("setPilot", pilot.set_pilot_message(state=state)["params"])
+
+
+class WizTransport(asyncio.DatagramProtocol):
+    """
+    A single UDP socket shared by every command sent to the lights.
+
+    Replies are matched to waiting requests by light IP and method, so any number of lights
+    can be driven through the one socket at the same time.
+    """
+
+    def __init__(self, port=WIZ_PORT):
+        self.port = port
+        self.loop = None
+        self.transport = None
+        self._endpoints = {}  # ip -> (address, port), resolved once per light
+        self._waiters = {}  # (ip, method) -> list of futures waiting for an answer
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        for waiters in self._waiters.values():
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(ConnectionError("WiZ transport closed"))
+        self._waiters.clear()
+
+    def datagram_received(self, data, addr):
+        if not self._waiters:
+            return  # Nobody is waiting, don't bother decoding
+        try:
+            message = json.loads(data)
+        except ValueError:
+            log.debug("Invalid message from %s: %r", addr[0], data)
+            return
+        waiters = self._waiters.pop((addr[0], message.get("method")), None)
+        if waiters:
+            for future in waiters:
+                if not future.done():
+                    future.set_result(message)
+
+    def is_closed(self):
+        return self.transport is None or self.transport.is_closing()
+
+    def endpoint(self, ip):
+        """Return the cached socket address of a light, resolving it on first use."""
+        address = self._endpoints.get(ip)
+        if address is None:
+            try:
+                socket.inet_aton(ip)
+                host = ip
+            except OSError:
+                host = socket.gethostbyname(ip)  # Host name, resolve it once
+            address = self._endpoints[ip] = (host, self.port)
+        return address
+
+    def send(self, ip, payload):
+        """Send payload bytes to a light without waiting for an answer."""
+        self.transport.sendto(payload, self.endpoint(ip))
+
+    async def request(self, ip, payload, method="setPilot", timeout=TIMEOUT):
+        """
+        Send payload bytes to a light and return its decoded answer.
+
+        The datagram is resent with a growing backoff until the light answers. Raises
+        asyncio.TimeoutError if no answer arrived within timeout seconds.
+        """
+        future = self.loop.create_future()
+        key = (ip, method)
+        self._waiters.setdefault(key, []).append(future)
+        address = self.endpoint(ip)
+        deadline = self.loop.time() + timeout
+        wait = FIRST_SEND_INTERVAL
+        try:
+            while True:
+                if self.is_closed():
+                    raise ConnectionError("WiZ transport closed")
+                self.transport.sendto(payload, address)
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait((future,), timeout=min(wait, remaining))
+                if done:
+                    return future.result()
+                wait = min(wait * 2, MAX_BACKOFF)
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self._waiters[key]
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+_shared_transport = None
+_opening = None
+
+
+async def _open_transport(port):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.bind(("", 0))
+    _, protocol = await loop.create_datagram_endpoint(lambda: WizTransport(port), sock=sock)
+    protocol.loop = loop
+    return protocol
+
+
+async def get_transport(port=WIZ_PORT):
+    """
+    Return the process-wide WiZ transport, opening its socket on first use.
+    """
+    global _shared_transport, _opening
+    loop = asyncio.get_running_loop()
+    if _shared_transport is not None and _shared_transport.loop is loop and not _shared_transport.is_closed():
+        return _shared_transport
+    if _opening is None or _opening.get_loop() is not loop:
+        _opening = loop.create_task(_open_transport(port))
+    try:
+        transport = await asyncio.shield(_opening)
+    finally:
+        if _opening is not None and _opening.done():
+            _opening = None
+    _shared_transport = transport
+    return transport
+
+
+def close_transport():
+    """Close the shared transport, if one is open."""
+    global _shared_transport
+    if _shared_transport is not None:
+        _shared_transport.close()
+        _shared_transport = None
+
+
+async def get_system_config(ip, timeout=TIMEOUT):
+    """Return the getSystemConfig result of a light (moduleName, mac, fwVersion, ...)."""
+    transport = await get_transport()
+    message = await transport.request(ip, encode_message("getSystemConfig", {}), method="getSystemConfig", timeout=timeout)
+    return message.get("result") or {}
+
+
+async def get_pilot(ip, timeout=TIMEOUT):
+    """Return the getPilot result of a light (state, dimming, r, g, b, sceneId, ...)."""
+    transport = await get_transport()
+    message = await transport.request(ip, encode_message("getPilot", {}), method="getPilot", timeout=timeout)
+    return message.get("result") or {}